@@ -14,6 +14,7 @@ from pkg_resources import get_distribution, DistributionNotFound
 
 # List of available modules
 __all__ = [
+    'benchmark',
     'chatty',
     'config',
     'functions',
@@ -0,0 +1,534 @@
+r'''Parlance performance benchmarks
+    Copyright (C) 2004-2008  Eric Wald
+    
+    This module times the parts of Parlance that dominate a game's cost.
+    By default, it times the judge's movement algorithm on a collection of
+    synthetic positions, heavier than any found in the DATC test cases.
+    From a source checkout, "datc" on the command line (or calling
+    parlance.test.datc.benchmark()) adds every movement phase adjudicated
+    by those cases.  Results may be saved as a baseline, so that later
+    runs can point out positions that have become slower.
+    
+    Smaller benchmarks time cold imports of the map environment, each in
+    a fresh interpreter; the folding of large messages for each bundled
+    variant; and the reading of those messages from text.  They share
+    the timing loop of TimingBenchmark.
+    
+    Run it as parlance-benchmark, or python -m parlance.benchmark, with
+    "save" on the command line to write a new baseline file, or with
+    "startup", "messages", or "translate" to run one of the smaller
+    benchmarks instead.
+    
+    Parlance may be used, modified, and/or redistributed under the terms of
+    the Artistic License 2.0, as published by the Perl Foundation.
+'''#'''
+
+import gc
+from json        import dump, load
+from os          import environ, path, pathsep
+from random      import Random
+from subprocess  import call
+from sys         import executable, exit
+from timeit      import default_timer
+
+from config      import Configuration, GameOptions, VerboseObject, variants
+from functions   import s
+from gameboard   import Map
+from judge       import JudgeStats
+from orders      import OrderSet, OrderTable
+from tokens      import AMY, CTO, CVY, FLT, MTO, NOW, SMR, SPR, SUB, SUP, VIA
+from xtended     import BEL, EAS, ECH, ENG, FRA, ION, IRI, ITA, LON, LVP, \
+        MAO, NAP, NTH, SYR, TUN, TYS, WES, standard
+
+__all__ = [
+    'AdjudicationBenchmark',
+    'FoldBenchmark',
+    'Position',
+    'StartupBenchmark',
+    'TimingBenchmark',
+    'TranslateBenchmark',
+    'bounce_position',
+    'convoy_chain_position',
+    'full_board_position',
+    'sample_messages',
+    'percentile',
+    'synthetic_positions',
+]
+
+def percentile(values, fraction):
+    ''' Returns the nearest-rank percentile of a sorted list.
+        >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], .9)
+        9
+        >>> percentile([4], .5)
+        4
+    '''#'''
+    index = int(len(values) * fraction + .5) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+class Position(object):
+    ''' A movement phase position and the orders submitted for it.
+        The judge is used for every replay of the position, so it should
+        be configured with the options that the orders expect.
+    '''#'''
+    def __init__(self, name, judge, board_state, submissions):
+        self.name = name
+        self.judge = judge
+        self.board_state = board_state
+        self.submissions = submissions
+    def prepare(self):
+        ''' Resets the judge to the position, with the orders submitted.'''
+        judge = self.judge
+        judge.map.handle_NOW(self.board_state)
+        judge.init_turn()
+        for country, message in self.submissions:
+            judge.submit(country, judge.phase, message)
+        return judge
+    def __repr__(self): return 'Position(%r)' % (self.name,)
+
+def new_judge(variant):
+    judge = variant.new_judge(GameOptions())
+    judge.start()
+    return judge
+
+def random_orders(board, rng):
+    ''' Chooses a legal order for every unit on the board.'''
+    table = OrderTable.get(board)
+    choices, mask = table.legal_orders(board)
+    orders = OrderSet()
+    for key in sorted(choices):
+        order = table.create_order(rng.choice(choices[key]), board)
+        orders.add(order, order.unit.nation.key)
+    return orders
+
+def order_submissions(board, orders):
+    submissions = []
+    for country in sorted(board.powers):
+        message = orders.create_SUB(country)
+        if message: submissions.append((country, message))
+    return submissions
+
+def full_board_position(variant_name='standard', seed=0):
+    ''' Creates a position with an army on every supply center,
+        owned by its home power or spread among the powers for neutral
+        centers, each with a random legal order.
+    '''#'''
+    variant = variants[variant_name]
+    board = Map(variant)
+    powers = sorted(board.powers)
+    units = []
+    neutral = 0
+    for province in sorted(board.spaces.itervalues(),
+            key=lambda province: province.key):
+        if not province.is_supply(): continue
+        owners = [power for power in province.homes if power in powers]
+        if owners: owner = owners[0]
+        else:
+            owner = powers[neutral % len(powers)]
+            neutral += 1
+        units.append([owner, AMY, province.key])
+    board_state = NOW(SPR, 1901) % units
+    board.handle_NOW(board_state)
+    orders = random_orders(board, Random(seed))
+    return Position('synthetic.full_board.%d' % seed, new_judge(variant),
+            board_state, order_submissions(board, orders))
+
+def bounce_position(variant_name='standard', targets=None):
+    ''' Creates a position in which every land neighbour of each target
+        province holds an army moving into it, each for a different power
+        where possible, so that every target sees a many-way bounce.
+    '''#'''
+    variant = variants[variant_name]
+    board = Map(variant)
+    powers = sorted(board.powers)
+    used = set()
+    units = []
+    orders = []
+    for target in targets or sorted(board.spaces):
+        coast = board.coasts.get((AMY, target, None))
+        if target in used or not coast: continue
+        sources = sorted(key for key in coast.borders_out
+                if key[1] not in used and key[1] != target)
+        if len(sources) < 3: continue
+        used.add(target)
+        for index, (unit_type, source, dummy) in enumerate(sources):
+            used.add(source)
+            unit = [powers[index % len(powers)], AMY, source]
+            units.append(unit)
+            orders.append((unit[0], [unit, MTO, target]))
+    return Position('synthetic.bounce', new_judge(variant),
+            NOW(SPR, 1901) % units, submissions_from(orders))
+
+def convoy_chain_position():
+    ''' Creates a position on the standard map with a convoy chain
+        from Liverpool to Syria, attacked in the middle, alongside a
+        shorter convoy with a choice of routes.
+    '''#'''
+    chain = [IRI, MAO, WES, TYS, ION, EAS]
+    army = [ENG, AMY, LVP]
+    units = [army]
+    orders = [(ENG, [army, CTO, SYR, VIA, chain])]
+    for sea in chain:
+        fleet = [ENG, FLT, sea]
+        units.append(fleet)
+        orders.append((ENG, [fleet, CVY, army, CTO, SYR]))
+    attacker = [ITA, FLT, NAP]
+    supporter = [ITA, FLT, TUN]
+    units.extend([attacker, supporter])
+    orders.append((ITA, [attacker, MTO, TYS]))
+    orders.append((ITA, [supporter, SUP, attacker, MTO, TYS]))
+    
+    army = [FRA, AMY, LON]
+    units.append(army)
+    orders.append((FRA, [army, CTO, BEL]))
+    for sea in (NTH, ECH):
+        fleet = [FRA, FLT, sea]
+        units.append(fleet)
+        orders.append((FRA, [fleet, CVY, army, CTO, BEL]))
+    return Position('synthetic.convoy_chain', new_judge(standard),
+            NOW(SPR, 1901) % units, submissions_from(orders))
+
+def submissions_from(orders):
+    ''' Groups a list of (country, order) pairs into SUB messages.'''
+    grouped = {}
+    for country, order in orders:
+        grouped.setdefault(country, []).append(order)
+    return [(country, SUB % grouped[country]) for country in sorted(grouped)]
+
+def synthetic_positions(seeds=(1, 2, 3)):
+    ''' Creates the heavy positions for the standard map.'''
+    positions = [full_board_position('standard', seed) for seed in seeds]
+    positions.append(bounce_position('standard'))
+    positions.append(convoy_chain_position())
+    return positions
+
+class AdjudicationBenchmark(VerboseObject):
+    ''' Times the judge's movement algorithm on a list of positions.
+        Each position is adjudicated once to warm up and count decisions
+        and allocations, then repeatedly for timing.  Allocations are
+        counted as the net number of garbage-collected objects created
+        by one adjudication, with the collector paused.
+    '''#'''
+    __section__ = 'benchmark'
+    __options__ = (
+        ('benchmark_iterations', int, 20, None,
+            'Number of timed adjudications of each position.'),
+        ('benchmark_baseline', file, 'judge_benchmark.json', None,
+            'File to save benchmark results to, and compare them against.'),
+        ('benchmark_tolerance', float, 0.25, None,
+            'Fraction by which the median time of a position may exceed',
+            'its baseline before it is reported as a regression.'),
+    )
+    
+    def __init__(self, iterations=None):
+        self.__super.__init__()
+        self.iterations = iterations or self.options.benchmark_iterations
+    
+    def measure(self, position):
+        ''' Times the adjudication of a single position.'''
+        judge = position.prepare()
+        judge.stats = JudgeStats()
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            before = gc.get_count()[0]
+            judge.move_algorithm()
+            allocations = gc.get_count()[0] - before
+        finally:
+            if enabled: gc.enable()
+        decisions = sum(judge.stats.last()['decisions'].values())
+        
+        times = []
+        for dummy in range(self.iterations):
+            position.prepare()
+            start = default_timer()
+            judge.move_algorithm()
+            times.append(default_timer() - start)
+        times.sort()
+        total = sum(times)
+        return {
+            'ops': total and len(times) / total or 0.0,
+            'mean': total / len(times),
+            'p50': percentile(times, .50),
+            'p90': percentile(times, .90),
+            'p99': percentile(times, .99),
+            'allocations': allocations,
+            'decisions': decisions,
+        }
+    def run(self, positions):
+        ''' Measures each position, returning a dictionary of results
+            keyed by position name.
+        '''#'''
+        results = {}
+        for position in positions:
+            results[position.name] = result = self.measure(position)
+            self.log_debug(10, '%s: %.1f ops/sec', position.name, result['ops'])
+        return results
+    
+    def save(self, results, filename=None):
+        stream = open(filename or self.options.benchmark_baseline, 'w')
+        try: dump({'iterations': self.iterations, 'results': results},
+                stream, indent=1, sort_keys=True)
+        finally: stream.close()
+    def load(self, filename=None):
+        ''' Reads saved results, or returns None if there are none.'''
+        try: stream = open(filename or self.options.benchmark_baseline)
+        except IOError: return None
+        try: return load(stream)['results']
+        finally: stream.close()
+    def compare(self, results, baseline):
+        ''' Lists (name, ratio) pairs for positions whose median time
+            exceeds the baseline by more than the tolerance.
+        '''#'''
+        limit = 1 + self.options.benchmark_tolerance
+        regressions = []
+        for name in sorted(results):
+            base = baseline.get(name)
+            if base and base['p50']:
+                ratio = results[name]['p50'] / base['p50']
+                if ratio > limit: regressions.append((name, ratio))
+        return regressions
+    def report(self, results, baseline=None):
+        ''' Formats the results as lines of text.'''
+        lines = []
+        for name in sorted(results):
+            result = results[name]
+            line = ('%-44s %9.1f ops/sec  p50 %7.3f  p90 %7.3f  p99 %7.3f ms'
+                '  %5d decisions  %6d allocations' % (name, result['ops'],
+                    result['p50'] * 1000, result['p90'] * 1000,
+                    result['p99'] * 1000, result['decisions'],
+                    result['allocations']))
+            base = baseline and baseline.get(name)
+            if base and base['p50']:
+                line += '  %+.0f%%' % ((result['p50'] / base['p50'] - 1) * 100)
+            lines.append(line)
+        total = sum(result['mean'] for result in results.itervalues())
+        lines.append('%d position%s, %.1f ms per pass' % (len(results),
+                s(len(results)), total * 1000))
+        return lines
+
+def sample_messages():
+    ''' Collects the largest messages of each bundled variant:
+        its MDF, SCO, and NOW, plus an SMR listing each of its powers.
+        Returns a list of (name, message) pairs.
+    '''#'''
+    messages = []
+    for variant_name in sorted(variants):
+        variant = variants[variant_name]
+        mdf, sco, now = variant.compiled()
+        board = Map(variant)
+        players = [[power, ['Parlance HoldBot'], ['Version 1.0'],
+                len(board.powers[power].centers)]
+            for power in sorted(board.powers)]
+        smr = SMR(board.current_turn) % players
+        for kind, message in (('MDF', mdf), ('SCO', sco), ('NOW', now),
+                ('SMR', smr)):
+            messages.append(('%s.%s' % (variant_name, kind), message))
+    return messages
+
+class TimingBenchmark(VerboseObject):
+    ''' Base class for the benchmarks that time a few named cases.
+        Subclasses name the option giving the number of timed calls,
+        and define measure() to turn a case into a dict of results,
+        using times() for each operation, and describe() to format
+        one line of the report.
+    '''#'''
+    iteration_option = None
+    
+    def __init__(self, iterations=None):
+        self.__super.__init__()
+        self.iterations = (iterations or
+                getattr(self.options, self.iteration_option))
+    def times(self, function, *args):
+        ''' Calls the function once per iteration,
+            returning the sorted list of times taken.
+        '''#'''
+        times = []
+        for dummy in range(self.iterations):
+            start = default_timer()
+            function(*args)
+            times.append(default_timer() - start)
+        times.sort()
+        return times
+    def mean(self, function, *args):
+        ''' Returns the mean time of a call to the function.'''
+        times = self.times(function, *args)
+        return sum(times) / len(times)
+    def run(self, cases):
+        ''' Measures each case in a list of (name, case) pairs,
+            returning a dict of results by name.
+        '''#'''
+        results = {}
+        for name, case in cases:
+            results[name] = self.measure(case)
+            self.log_debug(10, '%s', self.describe(name, results[name]))
+        return results
+    def report(self, results):
+        ''' Formats the results as lines of text.'''
+        return [self.describe(name, results[name])
+            for name in sorted(results)]
+    def measure(self, case): raise NotImplementedError
+    def describe(self, name, result): raise NotImplementedError
+
+class FoldBenchmark(TimingBenchmark):
+    ''' Times the folding of messages into nested lists,
+        both from Message instances and from packed token numbers.
+    '''#'''
+    __section__ = 'benchmark'
+    __options__ = (
+        ('fold_iterations', int, 200, None,
+            'Number of times to fold each message.'),
+    )
+    iteration_option = 'fold_iterations'
+    
+    def measure(self, message):
+        ''' Times both methods of folding a message,
+            returning the mean time of each.
+        '''#'''
+        rep = variants['standard'].rep
+        return {
+            'tokens': len(message),
+            'fold': self.mean(message.fold),
+            'fold_packed': self.mean(rep.fold_packed, message.pack()),
+        }
+    def describe(self, name, result):
+        return '%-16s %6d tokens  fold %7.3f ms  packed %7.3f ms' % (name,
+                result['tokens'], result['fold'] * 1000,
+                result['fold_packed'] * 1000)
+
+class TranslateBenchmark(TimingBenchmark):
+    ''' Times the translation of message text into Messages,
+        as when a game log is loaded, one line at a time or in a series.
+    '''#'''
+    __section__ = 'benchmark'
+    __options__ = (
+        ('translate_iterations', int, 20, None,
+            'Number of times to translate each set of lines.'),
+    )
+    iteration_option = 'translate_iterations'
+    
+    def measure(self, case):
+        ''' Times both methods of translating a variant's lines,
+            returning the mean time for the whole set.
+        '''#'''
+        rep, lines = case
+        def translate():
+            for line in lines: rep.translate(line)
+        def translate_many():
+            for message in rep.translate_many(lines): pass
+        return {
+            'lines': len(lines),
+            'chars': sum(len(line) for line in lines),
+            'translate': self.mean(translate),
+            'translate_many': self.mean(translate_many),
+        }
+    def run(self, messages):
+        ''' Translates the text of the messages for each variant.'''
+        lines = {}
+        for name, message in messages:
+            variant_name = name.split('.')[0]
+            lines.setdefault(variant_name, []).append(str(message))
+        return self.__super.run([(name, (variants[name].rep, lines[name]))
+            for name in sorted(lines)])
+    def describe(self, name, result):
+        return '%-16s %7d chars  translate %7.3f ms  batch %7.3f ms' % (name,
+                result['chars'], result['translate'] * 1000,
+                result['translate_many'] * 1000)
+
+class StartupBenchmark(TimingBenchmark):
+    ''' Times cold imports, each in a fresh interpreter process.
+        The time for an interpreter that imports nothing is reported
+        alongside, for comparison.
+    '''#'''
+    __section__ = 'benchmark'
+    __options__ = (
+        ('startup_repetitions', int, 5, None,
+            'Number of fresh interpreters to time for each import.'),
+    )
+    iteration_option = 'startup_repetitions'
+    statements = (
+        ('interpreter', 'pass'),
+        ('tokens', 'from parlance.xtended import ENG, LON'),
+        ('variant', 'from parlance.config import variants; variants["standard"]'),
+        ('standard_map', 'from parlance.xtended import standard_map'),
+        ('everything', 'from parlance.xtended import *'),
+    )
+    
+    def measure(self, statement):
+        ''' Times the statement in new interpreters.'''
+        root = path.dirname(path.dirname(path.abspath(__file__)))
+        env = dict(environ)
+        env['PYTHONPATH'] = pathsep.join([root] +
+                [item for item in [environ.get('PYTHONPATH')] if item])
+        def interpret():
+            if call([executable, '-c', statement], env=env):
+                raise RuntimeError('Failed to run %r' % statement)
+        times = self.times(interpret)
+        return {
+            'mean': sum(times) / len(times),
+            'min': times[0],
+            'p50': percentile(times, .50),
+        }
+    def run(self):
+        return self.__super.run(self.statements)
+    def describe(self, name, result):
+        return '%-16s p50 %7.1f  min %7.1f ms' % (name,
+                result['p50'] * 1000, result['min'] * 1000)
+    def report(self, results):
+        lines = []
+        base = results.get('interpreter')
+        for name, statement in self.statements:
+            result = results.get(name)
+            if not result: continue
+            line = self.describe(name, result)
+            if base and name != 'interpreter':
+                line += '  (+%.1f ms)' % ((result['p50'] - base['p50']) * 1000)
+            lines.append(line)
+        return lines
+
+def run(positions=None):
+    r'''Benchmark the judge on the given positions,
+        or on the synthetic positions if none are given,
+        plus the DATC positions if "datc" is given on the command line.
+        Compares the results to the baseline file if it exists,
+        or saves them to it if "save" is given on the command line.
+        Times imports instead if "startup" is given,
+        message folding if "messages" is,
+        or message translation if "translate" is.
+    '''#'''
+    Configuration._args.setdefault('verbosity', 0)
+    if 'startup' in Configuration.arguments:
+        benchmark = StartupBenchmark()
+        for line in benchmark.report(benchmark.run()): print line
+        return
+    if 'messages' in Configuration.arguments:
+        benchmark = FoldBenchmark()
+        for line in benchmark.report(benchmark.run(sample_messages())):
+            print line
+        return
+    if 'translate' in Configuration.arguments:
+        benchmark = TranslateBenchmark()
+        for line in benchmark.report(benchmark.run(sample_messages())):
+            print line
+        return
+    benchmark = AdjudicationBenchmark()
+    if positions is None:
+        positions = synthetic_positions()
+        if 'datc' in Configuration.arguments:
+            try: from parlance.test.datc import datc_positions
+            except ImportError:
+                print 'The DATC positions require a source checkout.'
+                exit(1)
+            positions = datc_positions() + positions
+    results = benchmark.run(positions)
+    if 'save' in Configuration.arguments:
+        benchmark.save(results)
+        baseline = None
+    else: baseline = benchmark.load()
+    for line in benchmark.report(results, baseline): print line
+    if baseline:
+        regressions = benchmark.compare(results, baseline)
+        for name, ratio in regressions:
+            print 'Regression: %s is %.2f times slower' % (name, ratio)
+        if regressions: exit(1)
+
+if __name__ == '__main__': run()
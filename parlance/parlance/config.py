@@ -10,6 +10,7 @@ r'''Parlance configuration management
 '''#'''
 
 import re
+from collections  import deque
 from ConfigParser import RawConfigParser
 from os           import linesep, path
 from pkg_resources import iter_entry_points, resource_stream
@@ -361,20 +362,67 @@ class VerboseObject(Configurable):
         or to a configurable file, based on verbosity level.
         Classes or instances may override prefix to set the label on each
         line written by that item.
+        
+        Lines are only formatted when they will be written somewhere,
+        so arguments should be passed separately from the format string,
+        wrapped in functions.lazy() if they take work to build.
+        Code that loops just to log something can check debugging() first.
+        
+        If trace_size is set, recent lines up to trace_level are also kept
+        in memory, whatever the verbosity, for examination after a failure.
     '''#'''
     __files = {}
+    __limits = {}
+    __trace = deque()
     __section__ = 'main'
     __options__ = (
         ('verbosity', int, 1, 'v',
             'How much debug or logging information to display.'),
         ('log_file', file, '', None,
             'File in which to log output lines, instead of printing them.'),
+        ('log_limits', list, [], None,
+            'Highest levels to log or trace for individual modules,',
+            'as a comma-separated list of module:level pairs.',
+            'For example, "judge:8" silences detailed adjudication logs.'),
+        ('trace_size', int, 0, None,
+            'Number of recent lines to keep in memory, for post-mortems.',
+            'Zero disables the trace.'),
+        ('trace_level', int, 20, None,
+            'Highest level of lines to keep in the trace.'),
     )
     
+    def debugging(self, level):
+        ''' Whether log_debug() would write or trace a line at this level.'''
+        options = self.options
+        if level > options.verbosity and not (options.trace_size
+                and level <= options.trace_level):
+            return False
+        if options.log_limits:
+            limit = self.log_limit()
+            if limit is not None: return level <= limit
+        return True
+    def log_limit(self):
+        ''' The highest level this object's module may log, if limited.'''
+        limits = self.options.log_limits
+        key = tuple(limits)
+        table = self.__limits.get(key)
+        if table is None:
+            table = {}
+            for item in limits:
+                name, sep, level = item.rpartition(':')
+                try: table[name.strip()] = int(level)
+                except ValueError: pass
+            self.__limits[key] = table
+        return table.get(self.__class__.__module__.split('.')[-1])
     def log_debug(self, level, line, *args):
-        if level <= self.options.verbosity:
+        options = self.options
+        if level > options.verbosity and not options.trace_size: return
+        if self.debugging(level):
             line = self.prefix + ': ' + str(line) % args
-            filename = self.options.log_file
+            if options.trace_size and level <= options.trace_level:
+                self.trace_line(line, options.trace_size)
+            if level > options.verbosity: return
+            filename = options.log_file
             if filename:
                 output = self.__files.get(filename)
                 if not output:
@@ -384,6 +432,18 @@ class VerboseObject(Configurable):
             else:
                 try: print line + '\n',
                 except IOError: self.verbosity = 0 # Ignore broken pipes
+    def trace_line(self, line, size):
+        trace = VerboseObject.__trace
+        if trace.maxlen != size:
+            VerboseObject.__trace = trace = deque(trace, size)
+        trace.append(line)
+    @staticmethod
+    def traced_lines():
+        ''' Returns the lines kept in the trace, oldest first.'''
+        return list(VerboseObject.__trace)
+    @staticmethod
+    def clear_trace():
+        VerboseObject.__trace.clear()
     @settable_property
     def prefix(self): return self.__class__.__name__
 
@@ -192,6 +192,23 @@ class Infinity(object):
     def __str__(self): return 'Infinity'
 Infinity = Infinity()
 
+class lazy(object):
+    ''' Defers a function call until the result is formatted.
+        Useful for log_debug() arguments that take work to build:
+        the function is only called if the line is actually logged.
+        
+        >>> def expensive(): print 'Calculating...'; return [1, 2]
+        >>> item = lazy(expensive)
+        >>> print 'Result: %s' % item
+        Calculating...
+        Result: [1, 2]
+    '''#'''
+    __slots__ = ('function', 'args')
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+    def __str__(self): return str(self.function(*self.args))
+
 class settable_property(object):
     def __init__(self, fget): self.fget = fget
     def __get__(self, obj, type): return self.fget(obj)
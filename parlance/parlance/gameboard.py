@@ -9,8 +9,15 @@ r'''Parlance gameboard classes
     the Artistic License 2.0, as published by the Perl Foundation.
 '''#'''
 
+from array import array
+from hashlib import sha1
 from itertools import chain, count
+from os import fdopen, makedirs, path, remove, rename
 from pkg_resources import split_sections
+from random import Random
+from struct import calcsize, pack, unpack
+from sys import byteorder
+from tempfile import mkstemp
 
 from config      import Configuration, VerboseObject, judges, parse_file
 from functions   import Comparable, Immutable, Infinity, all, any, defaultdict
@@ -34,6 +41,8 @@ class Variant(object):
         - powers       A mapping of power names
         - judge        The Judge class used for adjudication
         - rep          The representation dictionary
+        - digest       A hash of the variant file and representation,
+                       or None if the variant was not loaded from a file
     '''#"""#'''
     
     def __init__(self, name, rep=None, filename=None):
@@ -50,9 +59,28 @@ class Variant(object):
         self.start = (SPR, 0)
         self.seasons = (SPR, SUM, FAL, AUT, WIN)
         self.rep = rep or protocol.default_rep
+        self.digest = None
+        self.__compiled = None
         
         if filename:
-            parse_file(filename, self.parse)
+            parse_file(filename, self.load)
+    
+    def compiled(self):
+        ''' Returns the MDF, SCO, and NOW messages for the variant.
+            These are built only once, so the variant should be complete
+            before its first map is created.  For variants loaded from
+            files, they are taken from the compiled variant cache instead,
+            if it is current.  They are shared, so they must not be modified.
+        '''#'''
+        result = self.__compiled
+        if result is None:
+            cache = self.digest and VariantCache()
+            result = cache and cache.load(self)
+            if result is None:
+                result = (self.mdf(), self.sco(), self.now())
+                if cache: cache.store(self, result)
+            self.__compiled = result
+        return result
     
     def mdf(self):
         centers = []
@@ -147,6 +175,20 @@ class Variant(object):
     def new_judge(self, options):
         return judges[self.judge](self, options)
     
+    def load(self, stream):
+        ''' Parses a configuration file,
+            noting its digest for the compiled variant cache.
+        '''#'''
+        text = stream.read()
+        hasher = sha1(text)
+        rep = self.rep
+        while rep:
+            for number, token in sorted(rep.numbers.iteritems()):
+                hasher.update(pack('!H', number) + token.text)
+            rep = rep.base
+        self.digest = hasher.digest()
+        self.parse(text.splitlines())
+    
     def parse(self, stream):
         "Collects information file from a configuration file."
         for section, lines in split_sections(stream):
@@ -216,6 +258,82 @@ class Variant(object):
         self.borders[key] = sites
 
 
+class VariantCache(VerboseObject):
+    ''' Compiled variant files, from which maps load without rebuilding
+        the messages that define them.
+        Each file holds the MDF, SCO, and NOW messages of a variant,
+        as big-endian token numbers, after a header with the format
+        version and the digest of the variant file and representation.
+        A file is only used when both match; otherwise, the messages are
+        built from the variant definition, and the file is replaced.
+    '''#'''
+    __options__ = (
+        ('variant_cache', file, '', None,
+            'Directory in which to keep compiled variant files.',
+            'Leave this blank to build each variant from its definition.'),
+    )
+    
+    magic = 'PVC'
+    version = 1
+    header = '!3sB20sIII'
+    
+    def __init__(self, directory=None):
+        self.__super.__init__()
+        self.directory = directory or self.options.variant_cache
+    def filename(self, variant):
+        return path.join(path.expanduser(self.directory),
+                variant.name + '.pvc')
+    def load(self, variant):
+        ''' Returns the (MDF, SCO, NOW) messages of the variant,
+            or None if there is no current compiled file for it.
+        '''#'''
+        if not (self.directory and variant.digest): return None
+        try:
+            stream = open(self.filename(variant), 'rb')
+            try: data = stream.read()
+            finally: stream.close()
+        except IOError: return None
+        
+        size = calcsize(self.header)
+        if len(data) < size: return None
+        magic, version, digest, mdf, sco, now = unpack(self.header, data[:size])
+        if (magic, version, digest) != (self.magic, self.version, variant.digest):
+            self.log_debug(7, 'Compiled %s variant is out of date', variant.name)
+            return None
+        numbers = array('H', data[size:])
+        if len(numbers) != mdf + sco + now: return None
+        if byteorder == 'little': numbers.byteswap()
+        try: tokens = [variant.rep[number] for number in numbers]
+        except KeyError: return None
+        self.log_debug(11, 'Loaded compiled %s variant', variant.name)
+        return (Message(tokens[:mdf]), Message(tokens[mdf:mdf + sco]),
+                Message(tokens[mdf + sco:]))
+    def store(self, variant, messages):
+        ''' Writes the compiled file for the variant,
+            replacing any older one in a single step.
+        '''#'''
+        if not (self.directory and variant.digest): return
+        numbers = array('H', [int(token)
+                for message in messages for token in message])
+        if byteorder == 'little': numbers.byteswap()
+        data = pack(self.header, self.magic, self.version, variant.digest,
+                *[len(message) for message in messages]) + numbers.tostring()
+        
+        filename = self.filename(variant)
+        directory = path.dirname(filename)
+        try:
+            if not path.isdir(directory): makedirs(directory)
+            handle, temporary = mkstemp('.tmp', variant.name, directory)
+            stream = fdopen(handle, 'wb')
+            try: stream.write(data)
+            finally: stream.close()
+            try: rename(temporary, filename)
+            except OSError:
+                remove(temporary)
+                raise
+        except (IOError, OSError), err:
+            self.log_debug(7, 'Unable to write %s: %s', filename, err)
+
 class Map(VerboseObject):
     ''' The map for the game, with various notes.
         Variables:
@@ -225,6 +343,7 @@ class Map(VerboseObject):
             - spaces:   A map of Provinces (Token -> Province)
             - coasts:   A map of Coasts ((unit,province,coast) -> Coast)
             - neutral:  A Power representing the neutral supply centers
+            - zobrist:  A 64-bit hash of the current position
     '''#'''
     
     def __init__(self, variant):
@@ -236,10 +355,14 @@ class Map(VerboseObject):
         self.prefix  = variant.name + ' map'
         season, year = variant.start
         self.current_turn = Turn(season, year, variant.seasons)
-        self.valid = variant.borders and not self.define(variant.mdf())
+        mdf, sco, now = variant.compiled()
+        self.valid = variant.borders and not self.define(mdf)
         if self.valid: self.restart()
     def __str__(self): return "Map(%r)" % self.name
     
+    # Marker in the distance tables for provinces that can't be reached
+    UNREACHABLE = 255
+    
     def define(self, message):
         ''' Attempts to create a map from an MDF message.
             Returns a string indicating a failure reason,
@@ -248,6 +371,7 @@ class Map(VerboseObject):
         '''#'''
         power_names = self.variant.powers
         province_names = self.variant.provinces
+        self.mdf_key = tuple(message)
         
         (mdf, powers, provinces, adjacencies) = message.fold()
         (centres, non_centres) = provinces
@@ -296,12 +420,41 @@ class Map(VerboseObject):
         self.spaces = provs
         self.coasts = coasts
         
+        # Stable numbering, for array-backed structures
+        self.power_keys = sorted(pows)
+        self.province_keys = sorted(provs)
+        self.coast_keys = sorted(coasts)
+        self.power_index = dict((key, index)
+            for index, key in enumerate(self.power_keys))
+        self.province_index = dict((key, index)
+            for index, key in enumerate(self.province_keys))
+        self.coast_index = dict((key, index)
+            for index, key in enumerate(self.coast_keys))
+        self.distances = {}
+        
+        # Sets of provinces as integer bitsets, by province_index
+        self.province_bits = dict((key, 1 << index)
+            for key, index in self.province_index.iteritems())
+        self.adjacent_bits = {}
+        for key, coast in coasts.iteritems():
+            bits = 0
+            for other in coast.borders_out:
+                bits |= self.province_bits[other[1]]
+            self.adjacent_bits[key] = bits
+        
+        # Position hashing, kept current by Unit actions
+        for power in pows.values() + [self.neutral]: power.board = self
+        self.zobrist_keys = ZobristKeys.get(self)
+        self.zobrist = 0
+        
         for prov in provs.itervalues():
             if not prov.is_valid(): return 'Invalid province: ' + str(prov)
         else: return ''
     def restart(self):
-        if self.variant.ownership: self.handle_SCO(self.variant.sco())
-        if self.variant.position: self.handle_NOW(self.variant.now())
+        mdf, sco, now = self.variant.compiled()
+        for power in self.powers.itervalues(): power.eliminated = False
+        if self.variant.ownership: self.handle_SCO(sco)
+        if self.variant.position: self.handle_NOW(now)
     
     # Information gathering
     def current_powers(self):
@@ -506,27 +659,75 @@ class Map(VerboseObject):
             unit, coast_spec, coast, datc.datc_4b1,
             datc.datc_4b2, datc.datc_4b3, datc.datc_4b6)
         return coast
-    #@Memoize  # Cache results; doesn't work for list args
     def distance(self, coast, provs):
         ''' Returns the coast's distance from the nearest of the provinces,
             particularly for use in determining civil disorder retreats.
         '''#'''
         # Todo: Count army and fleet movements differently?
-        result = 0
-        rank = seen = [coast.province.key]
-        while rank:
-            if any(place in provs for place in rank): return result
-            new_rank = []
-            for here in rank:
-                new_rank.extend([key
-                    for key in self.spaces[here].borders_out
-                    if key not in seen and key not in new_rank
-                ])
-            seen.extend(new_rank)
-            rank = new_rank
-            result += 1
-        # Inaccessible island
-        return Infinity
+        table = self.distance_table()
+        size = len(self.province_keys)
+        source = self.province_index[coast.province.key]
+        index = self.province_index
+        result = min([table[index[prov] * size + source]
+            for prov in provs if prov in index] or [self.UNREACHABLE])
+        if result == self.UNREACHABLE:
+            # Inaccessible island
+            return Infinity
+        return result
+    def distances_from(self, provs, unit_type=None):
+        ''' Returns an array of the distance from each province,
+            in province_index order, to the nearest of the given provinces.
+            Unreachable provinces get Map.UNREACHABLE.
+            
+            >>> dist = standard_map.distances_from([LON, PAR])
+            >>> index = standard_map.province_index
+            >>> print dist[index[LON]], dist[index[BUR]], dist[index[MOS]]
+            0 1 4
+        '''#'''
+        table = self.distance_table(unit_type)
+        size = len(self.province_keys)
+        rows = [table[start:start + size] for start in
+            [self.province_index[prov] * size for prov in provs
+                if prov in self.province_index]]
+        if len(rows) > 1: return array('B', map(min, *rows))
+        elif rows: return rows[0]
+        return array('B', [self.UNREACHABLE]) * size
+    def distance_table(self, unit_type=None):
+        ''' Returns the matrix of distances for the given unit type,
+            or for any unit when unit_type is None.
+            The matrix is a flat array; entry [target * n + source]
+            is the number of moves from source to target province.
+            Each matrix is computed once, on first use.
+        '''#'''
+        table = self.distances.get(unit_type)
+        if table is None:
+            index = self.province_index
+            size = len(self.province_keys)
+            sources = [[] for key in self.province_keys]
+            for key, coast in self.coasts.iteritems():
+                if unit_type and key[0] != unit_type: continue
+                for other in coast.borders_out:
+                    here = index[key[1]]
+                    bucket = sources[index[other[1]]]
+                    if here not in bucket: bucket.append(here)
+            
+            table = array('B', [self.UNREACHABLE]) * (size * size)
+            for target in xrange(size):
+                start = target * size
+                table[start + target] = 0
+                rank = [target]
+                result = 0
+                while rank and result < self.UNREACHABLE - 1:
+                    result += 1
+                    new_rank = []
+                    for here in rank:
+                        for place in sources[here]:
+                            if table[start + place] == self.UNREACHABLE:
+                                table[start + place] = result
+                                new_rank.append(place)
+                    rank = new_rank
+            self.distances[unit_type] = table
+        return table
     def units(self):
         return chain(*[country.units for country in self.powers.values()])
     units = property(fget=units)
@@ -565,6 +766,7 @@ class Map(VerboseObject):
             for country in on_board:
                 power = self.powers[country]
                 if not power.centers: power.eliminated = year
+            self.recompute_hash()
     def handle_NOW(self, message):
         ''' Handles the NOW command, loading turn and unit information.
             May complain about unexpected units.
@@ -596,9 +798,16 @@ class Map(VerboseObject):
                 unit = Unit(power, coast)
                 unit.build()
                 if len(unit_spec) > 3: unit.retreat(unit_spec[4])
+            self.recompute_hash()
     def advance(self):
+        keys = self.zobrist_keys
+        self.zobrist ^= keys.turn(self.current_turn)
         self.current_turn = self.current_turn.next()
+        self.zobrist ^= keys.turn(self.current_turn)
         return self.current_turn
+    def recompute_hash(self):
+        ''' Recalculates the position hash from scratch.'''
+        self.zobrist = self.zobrist_keys.position(self)
     def adjust_ownership(self):
         ''' Lets units take over supply centers they occupy.
             Returns a list of countries that gained supply centers.
@@ -629,6 +838,412 @@ class Map(VerboseObject):
         return [token for token,net in net_growth.iteritems() if net > 0]
 
 
+class BoardState(object):
+    ''' A compact copy of a Map's positions, kept in flat arrays.
+        Variables:
+            - board:     The Map supplying the numbering and message conversion
+            - turn:      The Turn of this position
+            - units:     Owner index of the unit on each coast, or NOBODY
+            - dislodged: Owner index of the dislodged unit on each coast
+            - retreats:  Bitset of retreat coasts for each dislodged unit
+            - centers:   Owner index of each province's supply center
+        
+        Coasts, provinces, and powers are numbered by the coast_index,
+        province_index, and power_index of the Map.
+        The arrays are shared with any snapshots until changed,
+        so snapshot() and restore() take constant time.
+        
+        >>> state = BoardState(standard_map)
+        >>> state.create_NOW() == standard_map.create_NOW()
+        True
+        >>> state.unit_at((AMY, LVP, None))
+        ENG
+        >>> before = state.snapshot()
+        >>> state.move_to((AMY, LVP, None), (AMY, YOR, None))
+        >>> print state.unit_at((AMY, LVP, None))
+        None
+        >>> state.restore(before)
+        >>> state.unit_at((AMY, LVP, None))
+        ENG
+    '''#'''
+    NOBODY = -1
+    fields = ('units', 'dislodged', 'retreats', 'centers')
+    
+    def __init__(self, board):
+        self.board = board
+        coasts = len(board.coast_keys)
+        self.stride = (coasts + 7) // 8
+        self.turn = board.current_turn
+        self.units = array('b', [self.NOBODY]) * coasts
+        self.dislodged = array('b', [self.NOBODY]) * coasts
+        self.retreats = array('B', [0]) * (coasts * self.stride)
+        self.centers = array('b', [self.NOBODY]) * len(board.province_keys)
+        self.shared = set()
+        if board.valid:
+            self.handle_SCO(board.create_SCO())
+            self.handle_NOW(board.create_NOW())
+    
+    # Snapshots
+    def snapshot(self):
+        ''' Returns an opaque record of the current position.'''
+        self.shared.update(self.fields)
+        return (self.turn,) + tuple([getattr(self, name)
+            for name in self.fields])
+    def restore(self, snapshot):
+        ''' Returns to a position recorded by snapshot().'''
+        self.turn = snapshot[0]
+        for name, value in zip(self.fields, snapshot[1:]):
+            setattr(self, name, value)
+        self.shared.update(self.fields)
+    def writable(self, name):
+        ''' Returns the named array, copying it first if it is shared.'''
+        if name in self.shared:
+            setattr(self, name, getattr(self, name)[:])
+            self.shared.discard(name)
+        return getattr(self, name)
+    
+    # Information gathering
+    def unit_at(self, coast_key):
+        ''' Returns the power token for the undislodged unit on the coast,
+            or None if it is empty.
+        '''#'''
+        owner = self.units[self.board.coast_index[coast_key]]
+        if owner == self.NOBODY: return None
+        return self.board.power_keys[owner]
+    def owner(self, province):
+        ''' Returns the power token controlling the supply center,
+            or None if it is neutral or not a supply center.
+        '''#'''
+        owner = self.centers[self.board.province_index[province]]
+        if owner == self.NOBODY: return None
+        return self.board.power_keys[owner]
+    def retreat_keys(self, index):
+        ''' Returns the coast keys to which the dislodged unit may retreat.'''
+        start = index * self.stride
+        keys = self.board.coast_keys
+        return [keys[(byte - start) * 8 + bit]
+            for byte in xrange(start, start + self.stride)
+            if self.retreats[byte]
+            for bit in xrange(8)
+            if self.retreats[byte] & (1 << bit)]
+    
+    # Actions
+    def build(self, nation, coast_key):
+        units = self.writable('units')
+        units[self.board.coast_index[coast_key]] = self.board.power_index[nation]
+    def die(self, coast_key, dislodged=False):
+        index = self.board.coast_index[coast_key]
+        if dislodged:
+            self.writable('dislodged')[index] = self.NOBODY
+            self.set_retreats(index, [])
+        else: self.writable('units')[index] = self.NOBODY
+    def move_to(self, coast_key, destination):
+        ''' Moves the unit on one coast to another, undislodging it.'''
+        coasts = self.board.coast_index
+        index = coasts[coast_key]
+        if self.dislodged[index] != self.NOBODY:
+            owner = self.dislodged[index]
+            self.die(coast_key, True)
+        else:
+            owner = self.units[index]
+            self.writable('units')[index] = self.NOBODY
+        self.writable('units')[coasts[destination]] = owner
+    def retreat(self, coast_key, retreats):
+        ''' Dislodges the unit on the coast, with a list of retreat coast keys.'''
+        index = self.board.coast_index[coast_key]
+        self.writable('dislodged')[index] = self.units[index]
+        self.writable('units')[index] = self.NOBODY
+        self.set_retreats(index, retreats)
+    def set_retreats(self, index, retreats):
+        start = index * self.stride
+        bits = self.writable('retreats')
+        for byte in xrange(start, start + self.stride): bits[byte] = 0
+        for key in retreats:
+            place = self.board.coast_index[key]
+            bits[start + place // 8] |= 1 << (place % 8)
+    def takeover(self, province, nation):
+        index = self.board.province_index[province]
+        if nation is None: owner = self.NOBODY
+        else: owner = self.board.power_index[nation]
+        self.writable('centers')[index] = owner
+    
+    # Conversion to and from messages
+    def create_NOW(self):
+        ''' Creates a unit position message, as Map.create_NOW() would.'''
+        board = self.board
+        units = []
+        for index, owner in enumerate(self.units):
+            if owner != self.NOBODY:
+                units.append((owner, index, False))
+        for index, owner in enumerate(self.dislodged):
+            if owner != self.NOBODY:
+                units.append((owner, index, True))
+        units.sort()
+        
+        message = NOW(self.turn)
+        for owner, index, dislodged in units:
+            coast = board.coasts[board.coast_keys[index]]
+            unit = Message([board.power_keys[owner], coast.unit_type,
+                coast.maybe_coast])
+            if dislodged:
+                unit.extend(MRT([board.coasts[key].maybe_coast
+                    for key in self.retreat_keys(index)]))
+            message = message(unit)
+        return message
+    def create_SCO(self):
+        ''' Creates a supply center ownership message.'''
+        board = self.board
+        centers = defaultdict(list)
+        for index, owner in enumerate(self.centers):
+            if owner != self.NOBODY:
+                centers[owner].append(board.province_keys[index])
+        message = +SCO
+        for owner in sorted(centers):
+            message = message(board.power_keys[owner], *centers[owner])
+        neutral = [prov for prov in board.province_keys
+            if board.spaces[prov].is_supply()
+            and self.centers[board.province_index[prov]] == self.NOBODY]
+        if neutral: message = message(UNO, *neutral)
+        return message
+    def handle_NOW(self, message):
+        ''' Loads turn and unit information from a NOW message.'''
+        board = self.board
+        folded = message.fold()
+        season, year = folded[1]
+        seasons = board.current_turn.seasons
+        if seasons and season in seasons:
+            self.turn = Turn(season, year, seasons,
+                    list(seasons).index(season))
+        else: self.turn = Turn(season, year)
+        
+        self.units = array('b', [self.NOBODY]) * len(self.units)
+        self.dislodged = array('b', [self.NOBODY]) * len(self.dislodged)
+        self.retreats = array('B', [0]) * len(self.retreats)
+        self.shared.difference_update(('units', 'dislodged', 'retreats'))
+        for unit_spec in folded[2:]:
+            (nation, unit_type, loc) = unit_spec[0:3]
+            key = location_key(unit_type, loc)
+            self.build(nation, key)
+            if len(unit_spec) > 3:
+                self.retreat(key, [location_key(unit_type, place)
+                    for place in unit_spec[4]])
+    def handle_SCO(self, message):
+        ''' Loads supply center ownership from an SCO message.'''
+        self.centers = array('b', [self.NOBODY]) * len(self.centers)
+        self.shared.discard('centers')
+        for dist in message.fold()[1:]:
+            country = dist.pop(0)
+            for prov in dist:
+                if country in self.board.power_index:
+                    self.takeover(prov, country)
+
+class ConvoyIndex(object):
+    ''' The network of convoyable provinces on a map.
+        Built once for each map definition, and shared by every Map
+        defined by the same MDF message.
+        Sets of sea provinces are represented as integer bitmasks,
+        so the existence of a route can be checked without listing them;
+        the routes themselves are cached by origin, destination,
+        and the set of occupied seas.
+        
+        >>> index = ConvoyIndex.get(standard_map)
+        >>> fleets = index.mask([NTH, NWG])
+        >>> index.has_route(LON, NWY, fleets)
+        True
+        >>> index.has_route(LON, STP, fleets)
+        False
+        >>> for route in index.routes(LON, NWY, fleets): print route
+        (NTH,)
+        (NTH, NWG)
+    '''#'''
+    indices = {}
+    cache_limit = 10000
+    
+    @classmethod
+    def get(klass, board):
+        ''' Returns the index for the board's map definition.'''
+        index = klass.indices.get(board.mdf_key)
+        if index is None:
+            index = klass.indices[board.mdf_key] = klass(board)
+        return index
+    
+    def __init__(self, board):
+        self.seas = [key for key in board.province_keys
+            if board.spaces[key].can_convoy()]
+        self.bits = dict((key, 1 << n) for n, key in enumerate(self.seas))
+        self.numbers = dict((bit, key) for key, bit in self.bits.iteritems())
+        
+        # Iteration orders match Province.borders_out,
+        # so routes are listed as they always were.
+        self.starts = {}
+        for key, province in board.spaces.iteritems():
+            self.starts[key] = [prov for prov in province.borders_out
+                if prov in self.bits]
+        self.neighbors = dict((key, self.starts[key]) for key in self.seas)
+        self.landings = dict((key, frozenset(board.spaces[key].borders_out))
+            for key in self.seas)
+        self.forward = {}
+        self.backward = dict((bit, 0) for bit in self.numbers)
+        for key in self.seas:
+            bit = self.bits[key]
+            self.forward[bit] = self.mask(self.neighbors[key])
+            for other in self.neighbors[key]:
+                self.backward[self.bits[other]] |= bit
+        self.cache = {}
+    
+    def mask(self, provinces):
+        ''' Returns the bitmask for the convoyable provinces in a list.'''
+        result = 0
+        for key in provinces: result |= self.bits.get(key, 0)
+        return result
+    def fleets(self, board):
+        ''' Returns the bitmask of convoyable provinces with units.'''
+        result = 0
+        for key, bit in self.bits.iteritems():
+            if board.spaces[key].units: result |= bit
+        return result
+    def landing(self, dest):
+        ''' Returns the bitmask of seas bordering the destination.'''
+        result = 0
+        for key, borders in self.landings.iteritems():
+            if dest in borders: result |= self.bits[key]
+        return result
+    def spread(self, mask, fleets, edges):
+        ''' Returns the seas reachable from the mask through the fleets.'''
+        seen = frontier = mask & fleets
+        while frontier:
+            reached = 0
+            while frontier:
+                bit = frontier & -frontier
+                reached |= edges[bit]
+                frontier ^= bit
+            frontier = reached & fleets & ~seen
+            seen |= frontier
+        return seen
+    
+    def has_route(self, origin, dest, fleets):
+        ''' Whether any convoy route from origin to dest uses only
+            the provinces in the fleets bitmask.
+        '''#'''
+        if origin == dest: return False
+        start = self.mask(self.starts.get(origin, ()))
+        return bool(self.spread(start, fleets, self.forward)
+            & self.landing(dest))
+    def routes(self, origin, dest, fleets):
+        ''' Lists each simple route from origin to dest,
+            as a tuple of province tokens, through the fleets bitmask.
+            Shorter routes are listed first.
+        '''#'''
+        key = (origin, dest, fleets)
+        path_list = self.cache.get(key)
+        if path_list is None:
+            path_list = []
+            if self.has_route(origin, dest, fleets):
+                # Only seas that can still reach the destination are useful
+                usable = self.spread(self.landing(dest), fleets, self.backward)
+                bits = self.bits
+                possible = [(p,) for p in self.starts[origin]
+                    if bits[p] & usable]
+                while possible:
+                    route = possible.pop()
+                    here = route[-1]
+                    if dest in self.landings[here]: path_list.append(route)
+                    possible.extend([route + (p,)
+                        for p in self.neighbors[here]
+                        if bits[p] & usable and p not in route])
+                path_list.sort(key=len)
+            if len(self.cache) >= self.cache_limit: self.cache.clear()
+            self.cache[key] = path_list
+        return path_list
+
+class ZobristKeys(object):
+    ''' Random keys for hashing the positions of a map.
+        The hash of a position is the exclusive-or of the keys for each
+        unit, dislodged unit, supply center owner, and the turn,
+        so any single change can be applied or undone in constant time.
+        Keys are generated from a fixed seed, so Maps with the same
+        definition hash positions identically, even in other processes.
+        
+        >>> keys = ZobristKeys.get(standard_map)
+        >>> standard_map.zobrist == keys.position(standard_map)
+        True
+        >>> unit = standard_map.spaces[LON].unit
+        >>> before = standard_map.zobrist
+        >>> unit.die()
+        >>> standard_map.zobrist == before ^ keys.unit(unit)
+        True
+        >>> unit.build()
+        >>> standard_map.zobrist == before
+        True
+    '''#'''
+    indices = {}
+    seed = 0x5EED
+    bits = 64
+    
+    @classmethod
+    def get(klass, board):
+        ''' Returns the keys for the board's map definition.'''
+        keys = klass.indices.get(board.mdf_key)
+        if keys is None:
+            keys = klass.indices[board.mdf_key] = klass(board)
+        return keys
+    
+    def __init__(self, board):
+        generator = Random(self.seed)
+        def generate(number):
+            return [generator.getrandbits(self.bits) for n in xrange(number)]
+        self.power_index = board.power_index
+        self.province_index = board.province_index
+        self.coast_index = board.coast_index
+        self.stride = len(board.coast_keys)
+        self.span = len(board.province_keys)
+        powers = len(board.power_keys)
+        self.units = generate(powers * self.stride)
+        self.dislodged = generate(powers * self.stride)
+        
+        # The last row is for neutral supply centers
+        self.centers = generate((powers + 1) * self.span)
+        self.neutral = powers
+        self.seasons = generate(Turn.options.index_mask + 1)
+        self.years = generate(1)[0] | 1
+        self.mask = (1 << self.bits) - 1
+    
+    def unit(self, unit):
+        ''' Returns the key for a unit in its current state.'''
+        index = (self.power_index[unit.nation.key] * self.stride
+            + self.coast_index[unit.coast.key])
+        if unit.dislodged: return self.dislodged[index]
+        return self.units[index]
+    def center(self, owner, province):
+        ''' Returns the key for a power's ownership of a supply center.'''
+        if owner is None: return 0
+        row = self.power_index.get(owner.key, self.neutral)
+        return self.centers[row * self.span + self.province_index[province]]
+    def turn(self, turn):
+        ''' Returns the key for a turn.'''
+        return (self.seasons[turn.index % len(self.seasons)]
+            ^ ((turn.year * self.years) & self.mask))
+    def position(self, board):
+        ''' Calculates the hash of a board's current position.'''
+        result = self.turn(board.current_turn)
+        for unit in board.units: result ^= self.unit(unit)
+        for key, province in board.spaces.iteritems():
+            if province.is_supply():
+                result ^= self.center(province.owner, key)
+        return result
+    def hash_units(self, unit_specs):
+        ''' Calculates the hash of units listed as in a NOW message,
+            without loading them onto a map.
+        '''#'''
+        result = 0
+        for unit_spec in unit_specs:
+            (nation, unit_type, loc) = unit_spec[0:3]
+            index = (self.power_index[nation] * self.stride
+                + self.coast_index[location_key(unit_type, loc)])
+            if len(unit_spec) > 3: result ^= self.dislodged[index]
+            else: result ^= self.units[index]
+        return result
+
 class Turn(Comparable, Immutable):
     ''' Represents a single turn, consisting of season and year.
         Turns are immutable and hashable, so they can be used as keys.
@@ -810,7 +1425,10 @@ class Power(Comparable):
             - centers    list of Tokens for supply centers controlled
             - units      list of Units owned
             - eliminated year of elimination, or False if still on the board
+            - board      the Map that defined this power, if any
     '''#'''
+    board = None
+    
     def __init__(self, token, home_scs, name=None, adjective=None):
         self.key        = token
         self.name       = name or token.text
@@ -1012,27 +1630,12 @@ class Coast(Comparable, VerboseObject):
             Now collects only routes that currently have fleets.
         '''#'''
         self.log_debug(11, 'Collecting convoy routes to %s', dest.name)
-        path_list = []
         if self.province != dest and dest.is_coastal():
-            possible = [(p,)
-                for p in [board.spaces[key] for key in self.province.borders_out]
-                if p.can_convoy() and len(p.units) > 0
-            ]
-            while possible:
-                route = possible.pop()
-                self.log_debug(12, 'Considering %s',
-                        ' -> '.join([prov.name for prov in route]))
-                here = route[-1]
-                if dest.key in here.borders_out: path_list.append(route)
-                seen = [p.key for p in route]
-                possible.extend([route + (p,)
-                    for p in [board.spaces[key]
-                        for key in here.borders_out
-                        if key not in seen]
-                    if p.can_convoy() and len(p.units) > 0
-                ])
-            # Sort shorter paths to the front, to speed up checking
-            path_list.sort(key=len)
+            index = ConvoyIndex.get(board)
+            routes = index.routes(self.province.key, dest.key, index.fleets(board))
+            path_list = [tuple([board.spaces[key] for key in route])
+                for route in routes]
+        else: path_list = []
         self.log_debug(11, 'Routes found: %s', path_list)
         return path_list
     def matches(self, key):
@@ -1072,6 +1675,8 @@ class Unit(Comparable):
     
     # Actions
     def move_to(self, coast):
+        self.toggle_hash()
+        
         # Update the Provinces
         self.coast.province.units.remove(self)
         coast.province.units.append(self)
@@ -1080,15 +1685,24 @@ class Unit(Comparable):
         self.coast     = coast
         self.dislodged = False
         self.retreats  = None
+        self.toggle_hash()
     def retreat(self, retreats):
+        self.toggle_hash()
         self.dislodged   = True
         self.retreats    = retreats
+        self.toggle_hash()
     def build(self):
         self.nation.units.append(self)
         self.coast.province.units.append(self)
+        self.toggle_hash()
     def die(self):
+        self.toggle_hash()
         self.nation.units.remove(self)
         self.coast.province.units.remove(self)
+    def toggle_hash(self):
+        ''' Toggles this unit's key in its map's position hash.'''
+        board = self.nation and self.nation.board
+        if board: board.zobrist ^= board.zobrist_keys.unit(self)
     def takeover(self):
         ''' Takes control of the current space.
             If control of a supply center changes,
@@ -1098,6 +1712,11 @@ class Unit(Comparable):
         if prov.is_supply():
             former = prov.owner
             if former != self.nation:
+                board = self.nation.board
+                if board:
+                    keys = board.zobrist_keys
+                    board.zobrist ^= (keys.center(former, prov.key)
+                        ^ keys.center(self.nation, prov.key))
                 prov.owner = self.nation
                 self.nation.centers.append(prov.key)
                 former.centers.remove(prov.key)
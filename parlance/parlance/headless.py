@@ -0,0 +1,325 @@
+r'''Parlance headless game runner
+    Copyright (C) 2004-2008  Eric Wald
+    
+    This module plays complete games within a single process, handing
+    messages directly between a Judge and Player instances.  There are no
+    sockets, no threads, and no syntax validation, so it is suitable for
+    running many games in bulk, such as for simulation or bot training.
+    
+    Parlance may be used, modified, and/or redistributed under the terms of
+    the Artistic License 2.0, as published by the Perl Foundation.
+'''#'''
+
+from collections import deque
+from multiprocessing import Pipe, Process, cpu_count
+from random      import randint
+from select      import select
+from struct      import unpack
+from time        import time
+
+from config      import GameOptions, VerboseObject, variants
+from functions   import s
+from language    import Message
+from player      import HoldBot
+from tokens      import HLO, MAP, NOT, NOW, OFF, ORD, REJ, SCO, SET, SMR, YES
+
+__all__ = [
+    'HeadlessGame',
+    'JudgeFarm',
+    'play_games',
+]
+
+class HeadlessGame(VerboseObject):
+    ''' A single game, run without a Server.
+        Each power is played by an instance of the Player subclass given
+        for it, or of HoldBot if none is.  Messages are passed directly
+        to the Judge and to each player's handle_message() method.
+        
+        The history is kept in the same format as the server's Game:
+        a mapping of turn keys to dictionaries of SET, ORD, SCO, and NOW
+        messages, plus a 'new_SCO' flag.
+    '''#'''
+    
+    class Manager(object):
+        ''' Runs "threaded" player handlers immediately.'''
+        def new_thread(self, target, *args, **kwargs): target(*args, **kwargs)
+        def enqueue(self, target, *args, **kwargs): target(*args, **kwargs)
+    
+    class Service(object):
+        ''' Emulates the essentials of a Service object,
+            from the Judge's perspective.
+        '''#'''
+        def __init__(self, game, country):
+            self.game = game
+            self.country = country
+        def send(self, message): self.game.deliver(self.country, message)
+        def send_list(self, message_list):
+            for message in message_list: self.send(message)
+        def accept(self, message): self.send(YES(message))
+        def reject(self, message): self.send(REJ(message))
+    
+    def __init__(self, variant, players=None, game_options=None, reporter=None):
+        ''' Sets up the judge and players.
+            variant may be a Variant or the name of one;
+            players maps power tokens or names to Player subclasses.
+            If given, reporter is called with the key and history entry
+            of each turn as it is completed.
+        '''#'''
+        self.__super.__init__()
+        self.reporter = reporter
+        if isinstance(variant, basestring): variant = variants[variant]
+        self.variant = variant
+        self.game_options = game_options or GameOptions()
+        self.judge = variant.new_judge(self.game_options)
+        self.history = {}
+        self.messages = {}
+        self.queue = deque()
+        self.manager = self.Manager()
+        self.player_classes = players or {}
+        self.create_players()
+    def reset(self):
+        ''' Prepares for another game on the same board, with new players.'''
+        self.judge.reset()
+        self.history = {}
+        self.messages = {}
+        self.queue.clear()
+        self.create_players()
+    def create_players(self):
+        players = self.player_classes
+        variant = self.variant
+        self.players = {}
+        self.passcodes = {}
+        self.services = {}
+        for country in self.judge.players():
+            player_class = (players.get(country)
+                or players.get(country.text) or HoldBot)
+            self.players[country] = player_class(
+                    send_method=self.receiver(country),
+                    representation=variant.rep,
+                    manager=self.manager)
+            self.players[country].threaded = []
+            self.passcodes[country] = randint(100, 8191)
+            self.services[country] = self.Service(self, country)
+    def receiver(self, country):
+        def receive(message): self.queue.append((country, message))
+        return receive
+    
+    def run(self):
+        ''' Plays the game to completion, returning the history.'''
+        for country in self.players:
+            self.deliver(country, MAP(self.variant.mapname))
+            self.send_hello(country)
+        self.flush()
+        self.broadcast(self.judge.start())
+        while self.judge.phase:
+            self.run_judge()
+        self.broadcast([self.summarize()])
+        for player in self.players.itervalues(): player.close()
+        return self.history
+    def run_judge(self):
+        ''' Runs the judge, recording the results as the server would.'''
+        key = self.judge.turn().key
+        self.history[key] = turn = {
+            SET: [], ORD: [], SCO: None, NOW: None, 'new_SCO': False
+        }
+        results = self.judge.run()
+        for message in results:
+            if message[0] in (ORD, SET): turn[message[0]].append(message)
+            elif message[0] in (SCO, NOW): turn[message[0]] = message
+        if not turn[SCO]: turn[SCO] = self.judge.map.create_SCO()
+        else: turn['new_SCO'] = True
+        if self.reporter: self.reporter(key, turn)
+        self.broadcast(results)
+    def summarize(self):
+        ''' Creates the end-of-game SMR message.'''
+        result = self.messages.get(SMR)
+        if not result:
+            players = []
+            for country, player in sorted(self.players.iteritems()):
+                stats = [
+                    country,
+                    [player.name or '""'],
+                    [player.version or ' '],
+                    self.judge.score(country)
+                ]
+                elim = self.judge.eliminated(country)
+                if elim: stats.append(elim)
+                players.append(stats)
+            self.messages[SMR] = result = SMR(self.judge.turn()) % players
+        return result
+    
+    # Message passing
+    def broadcast(self, messages):
+        for message in messages:
+            for country in self.players:
+                self.deliver(country, message)
+            self.flush()
+    def send_hello(self, country):
+        passcode = self.passcodes[country]
+        self.deliver(country, HLO(country)(passcode)(self.game_options))
+    def deliver(self, country, message):
+        ''' Sends a message to a player, queueing any replies.'''
+        player = self.players[country]
+        if not player.closed: player.handle_message(Message(message))
+    def flush(self):
+        ''' Hands messages from the players to the judge,
+            until none are left.
+        '''#'''
+        while self.queue:
+            country, message = self.queue.popleft()
+            self.handle_message(country, message)
+    def handle_message(self, country, message):
+        ''' Dispatches a player's message to the judge.
+            Messages the judge doesn't handle are ignored,
+            except for HLO and OFF.
+        '''#'''
+        self.log_debug(5, '%s >> %s', country, message)
+        first = message[0]
+        if first is HLO: self.send_hello(country)
+        elif first is OFF:
+            self.players[country].close()
+        else:
+            method_name = 'handle_' + first.text
+            if first is NOT: method_name += '_' + message[2].text
+            method = getattr(self.judge, method_name, None)
+            if method: method(self.services[country], message)
+
+def play_games(variant, count, players=None, game_options=None):
+    ''' Plays a number of headless games in a row.
+        Returns a list of (game result, history) pairs.
+    '''#'''
+    results = []
+    for dummy in range(count):
+        game = HeadlessGame(variant, players, game_options)
+        history = game.run()
+        results.append((game.judge.game_result, history))
+    return results
+
+def farm_worker(connection, variant, players, numbers, game_options):
+    ''' Plays the numbered games in a worker process of a JudgeFarm,
+        sending each turn and each game result through the connection.
+    '''#'''
+    game = None
+    for number in numbers:
+        def report(key, turn, number=number):
+            connection.send(('turn', number, key, JudgeFarm.pack_turn(turn)))
+        # The board is built once, and reset between games.
+        if game: game.reset()
+        else: game = HeadlessGame(variant, players, game_options)
+        game.reporter = report
+        game.run()
+        connection.send(('game', number, None, game.judge.game_result.pack()))
+    connection.send(('done', None, None, None))
+    connection.close()
+
+class JudgeFarm(VerboseObject):
+    ''' Plays many headless games in parallel worker processes.
+        Each worker builds one game board, then plays its share of the
+        games on it in a row, streaming each turn back through a pipe.
+        If a worker dies before finishing its games, run() raises
+        RuntimeError naming the games that were lost.
+        Players must be given as classes that can be pickled.
+        The variant is compiled before the workers are forked, so that
+        each inherits it, whether or not it is registered by name.
+    '''#'''
+    __options__ = (
+        ('farm_workers', int, 0, 'judge farm worker processes',
+            'Number of worker processes to run games in.',
+            'Zero means one per processor.'),
+    )
+    
+    def __init__(self, variant, players=None, game_options=None, workers=None):
+        self.__super.__init__()
+        if isinstance(variant, basestring): variant = variants[variant]
+        variant.compiled()
+        self.variant = variant
+        self.players = players
+        self.game_options = game_options or GameOptions()
+        self.workers = workers or self.options.farm_workers or cpu_count()
+        self.results = {}
+        self.games = 0
+        self.elapsed = 0
+    
+    def run(self, count, callback=None):
+        ''' Plays count games, returning a mapping of game numbers
+            to (game result, history) pairs.
+            If given, callback is called with the game number, turn key,
+            and history entry of each turn as it arrives.
+        '''#'''
+        start = time()
+        workers = min(self.workers, count)
+        connections = {}
+        processes = []
+        for index in range(workers):
+            reader, writer = Pipe(False)
+            numbers = range(index, count, workers)
+            process = Process(target=farm_worker, args=(writer,
+                    self.variant, self.players, numbers,
+                    self.game_options))
+            process.daemon = True
+            process.start()
+            writer.close()
+            connections[reader.fileno()] = reader
+            processes.append(process)
+        
+        histories = dict((number, {}) for number in range(count))
+        finished = set()
+        while connections:
+            ready, dummy, dummy = select(connections.keys(), [], [])
+            for fd in ready:
+                connection = connections[fd]
+                try: kind, number, key, data = connection.recv()
+                except EOFError: kind = 'done'
+                if kind == 'turn':
+                    turn = self.unpack_turn(data)
+                    histories[number][key] = turn
+                    if callback: callback(number, key, turn)
+                elif kind == 'game':
+                    result = self.unpack_message(data)
+                    self.results[number] = (result, histories[number])
+                    finished.add(number)
+                    self.games += 1
+                else:
+                    connection.close()
+                    del connections[fd]
+        for process in processes: process.join()
+        
+        self.elapsed += time() - start
+        self.log_debug(7, '%s', self.report())
+        failed = [process.exitcode for process in processes
+            if process.exitcode]
+        missing = sorted(set(range(count)) - finished)
+        if failed or missing:
+            raise RuntimeError('Judge farm workers failed (exit codes %s); '
+                    'games not completed: %s' % (failed, missing))
+        return self.results
+    def rate(self):
+        ''' Returns the number of games completed per second.'''
+        if self.elapsed: return self.games / self.elapsed
+        return 0.0
+    def report(self):
+        return '%d game%s in %.2f seconds (%.2f games/sec) on %d worker%s' % (
+                self.games, s(self.games), self.elapsed, self.rate(),
+                self.workers, s(self.workers))
+    
+    # Transfer between processes, without pickling Tokens
+    @staticmethod
+    def pack_turn(turn):
+        return {
+            'SET': [message.pack() for message in turn[SET]],
+            'ORD': [message.pack() for message in turn[ORD]],
+            'SCO': turn[SCO] and turn[SCO].pack(),
+            'NOW': turn[NOW] and turn[NOW].pack(),
+            'new_SCO': turn['new_SCO'],
+        }
+    def unpack_turn(self, data):
+        return {
+            SET: [self.unpack_message(item) for item in data['SET']],
+            ORD: [self.unpack_message(item) for item in data['ORD']],
+            SCO: data['SCO'] and self.unpack_message(data['SCO']),
+            NOW: data['NOW'] and self.unpack_message(data['NOW']),
+            'new_SCO': data['new_SCO'],
+        }
+    def unpack_message(self, data):
+        rep = self.variant.rep
+        return Message([rep[x] for x in unpack('!' + 'H'*(len(data)//2), data)])
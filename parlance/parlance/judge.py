@@ -10,11 +10,18 @@ r'''Parlance adjudication system
     the Artistic License 2.0, as published by the Perl Foundation.
 '''#'''
 
+from collections import deque
 from itertools import chain
+from json import dumps
+from time import time
+
+try: from threading import Lock
+except ImportError: from dummy_threading import Lock
 
 from config import Configuration, VerboseObject
-from functions import Infinity, all, any, defaultdict, s
+from functions import Infinity, all, any, defaultdict, lazy, s
 from gameboard import Map
+from language import Message
 from orders import DisbandOrder, HoldOrder, OrderSet, \
         RemoveOrder, WaiveOrder, createUnitOrder
 from tokens import *
@@ -318,7 +325,7 @@ class JudgeInterface(VerboseObject):
         self.__super.__init__()
         self.map = Map(variant)
         assert self.map.valid
-        self.mdf = variant.mdf()
+        self.mdf = variant.compiled()[0]
         self.map_name = variant.mapname
         self.variant_name = variant.name
         self.game_opts = game_opts
@@ -367,6 +374,163 @@ class JudgeInterface(VerboseObject):
         '''#'''
         raise NotImplementedError
 
+def frozen(item):
+    ''' Converts nested lists, as from Message.fold(), into tuples.'''
+    if isinstance(item, list): return tuple([frozen(x) for x in item])
+    return item
+
+class AdjudicationCache(object):
+    ''' A bounded cache of hypothetical adjudication results.
+        Keys should be hashable descriptions of a position and order set.
+        When full, the entry that was least recently used ('lru') or
+        least recently stored ('fifo') is evicted to make room.
+        Entries are kept in a circular linked list of [previous, next,
+        key, value] links, with the oldest just after the root.
+    '''#'''
+    policies = ('lru', 'fifo')
+    
+    def __init__(self, size, eviction='lru'):
+        if eviction not in self.policies:
+            raise ValueError('Unknown eviction policy %r' % (eviction,))
+        self.size = size
+        self.eviction = eviction
+        self.lock = Lock()
+        self.clear()
+    def __len__(self): return len(self.links)
+    def __contains__(self, key): return key in self.links
+    
+    def clear(self):
+        ''' Forgets all entries, and resets the counters.'''
+        self.lock.acquire()
+        try:
+            self.links = {}
+            self.root = root = []
+            root[:] = [root, root, None, None]
+            self.hits = self.misses = self.evictions = 0
+        finally: self.lock.release()
+    def lookup(self, key):
+        ''' Returns the value stored for the key, or None.'''
+        self.lock.acquire()
+        try:
+            link = self.links.get(key)
+            if link is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.eviction == 'lru':
+                self.unlink(link)
+                self.append(link)
+            return link[3]
+        finally: self.lock.release()
+    def store(self, key, value):
+        ''' Adds or replaces an entry, evicting one if necessary.'''
+        if self.size <= 0: return
+        self.lock.acquire()
+        try:
+            link = self.links.pop(key, None)
+            if link is not None: self.unlink(link)
+            elif len(self.links) >= self.size:
+                oldest = self.root[1]
+                self.unlink(oldest)
+                del self.links[oldest[2]]
+                self.evictions += 1
+            link = [None, None, key, value]
+            self.append(link)
+            self.links[key] = link
+        finally: self.lock.release()
+    def stats(self):
+        ''' Returns a dictionary of the cache's counters.'''
+        return {
+            'size': len(self.links),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+    
+    # Linked list maintenance; the lock must be held.
+    def unlink(self, link):
+        previous, following = link[0], link[1]
+        previous[1] = following
+        following[0] = previous
+    def append(self, link):
+        root = self.root
+        last = root[0]
+        link[0] = last
+        link[1] = root
+        last[1] = root[0] = link
+
+class JudgeStats(object):
+    ''' Timing and counts for each phase handled by a Judge.
+        Each phase gets a dictionary of plain values, ready for JSON:
+            - turn:        The turn, as text
+            - time:        Seconds spent in each part of the judge
+            - orders:      Number of orders checked by order_note()
+            - decisions:   Number of decisions of each type
+            - calculations: Number of decision calculations
+            - passes:      Number of times the worklist ran dry
+            - paradoxes:   Number of paradox resolutions
+            - rules:       Number of paradox cores resolved by each rule
+            - routes:      Number of convoy routes examined
+    '''#'''
+    def __init__(self):
+        self.phases = {}
+        self.current = None
+    
+    def phase(self, turn):
+        ''' Returns the record for the turn, making it current.'''
+        record = self.phases.get(turn.key)
+        if record is None:
+            record = self.phases[turn.key] = {
+                'turn': str(turn),
+                'time': defaultdict(float),
+                'orders': 0,
+                'decisions': defaultdict(int),
+                'calculations': 0,
+                'passes': 0,
+                'paradoxes': 0,
+                'rules': defaultdict(int),
+                'routes': 0,
+            }
+        self.current = record
+        return record
+    def add_time(self, part, start):
+        ''' Adds the time since start to the current record.'''
+        self.current['time'][part] += time() - start
+    def count(self, field, number=1):
+        self.current[field] += number
+    def count_item(self, field, item, number=1):
+        self.current[field][item] += number
+    
+    def last(self):
+        ''' Returns the record for the most recent phase, or None.'''
+        if self.phases: return self.phases[max(self.phases)]
+        return None
+    def records(self):
+        return [self.phases[key] for key in sorted(self.phases)]
+    def totals(self):
+        ''' Sums the records of every phase into a single record.'''
+        result = {
+            'time': defaultdict(float),
+            'decisions': defaultdict(int),
+            'rules': defaultdict(int),
+        }
+        for record in self.records():
+            for field, value in record.iteritems():
+                if isinstance(value, dict):
+                    for item, number in value.iteritems():
+                        result[field][item] += number
+                elif field != 'turn':
+                    result[field] = result.get(field, 0) + value
+        result['phases'] = len(self.phases)
+        return result
+    def dump(self, stream, **info):
+        ''' Writes the records for the game as a single line of JSON,
+            along with any keyword arguments.
+        '''#'''
+        info['phases'] = self.records()
+        info['totals'] = self.totals()
+        stream.write(dumps(info, sort_keys=True) + '\n')
+
 class Judge(JudgeInterface):
     ''' Implementation of the Judge interface, for DAIDE rules.'''
     __options__ = (
@@ -414,6 +578,21 @@ class Judge(JudgeInterface):
         ('send_ORD', bool, True, 'publish individual orders',
             'Whether to send ORD messages each turn, as required by DAIDE.',
             'Can slow down the game, particularly when syntax-checked by each client.'),
+        
+        # Hypothetical adjudication
+        ('cache_size', int, 0, 'adjudication cache size',
+            'Number of results to remember for hypothetical movement phases,',
+            'as requested by search code through Judge.adjudicate().',
+            'Setting this to 0 will disable the cache.'),
+        ('cache_eviction', str, 'lru', 'adjudication cache eviction',
+            'Which result to forget when the adjudication cache is full:',
+            "'lru' for the least recently used, or 'fifo' for the oldest."),
+        
+        # Instrumentation
+        ('stats_file', str, '', 'judge statistics file',
+            'File to which timing and decision statistics are appended',
+            'at the end of each game, as one line of JSON per game.',
+            'Leave this blank to keep the statistics in memory only.'),
     )
     
     def __init__(self, variant, game_opts):
@@ -422,6 +601,12 @@ class Judge(JudgeInterface):
         self.datc = DatcOptions()
         self.last_orders = [REJ(ORD)]
         self.next_orders = OrderSet()
+        self.cache = None
+        self.scratch = []
+        self.scratch_lock = Lock()
+        self.stats = JudgeStats()
+        self.decisions = Decision_Set()
+        self.contested = 0
         
         # Game-end conditions
         year = self.map.current_turn.year
@@ -435,6 +620,13 @@ class Judge(JudgeInterface):
             if prov.is_supply(): centers += 1
         self.win_condition = (centers // 2) + 1
         self.log_debug(11, 'Setting win_condition to %d.', self.win_condition)
+    def reset(self):
+        ''' Prepares the judge to begin a fresh game with the same map.'''
+        self.__super.reset()
+        self.game_result = None
+        self.last_orders = [REJ(ORD)]
+        self.next_orders = OrderSet()
+        self.contested = 0
     
     # Requests for information
     def handle_NOW(self, client, message): client.send(self.map.create_NOW())
@@ -447,24 +639,7 @@ class Judge(JudgeInterface):
         country = client.country
         phase = self.phase  # Needed to avoid thread problems
         if country and phase:
-            orders = self.next_orders
-            for tlist in message.fold()[1:]:
-                power = self.map.powers[country]
-                order = createUnitOrder(tlist, power, self.map, self.datc)
-                note = order.order_note(power, phase, orders)
-                self.log_debug(14, ' SUB: %s => %s', order, note)
-                order.__note = note
-                if note == MBV:
-                    order.__result = None
-                    orders.add(order, country)
-                elif self.game_opts.AOA:
-                    if order.is_moving() and self.illegal(order):
-                        # Make it act like it's holding
-                        self.log_debug(13, ' Changing behavior of "%s" (%s) to hold', order, order.__note)
-                        order.is_moving = lambda: False
-                    order.__result = note
-                    orders.add(order, country)
-                    note = MBV
+            for order, note in self.submit(country, phase, message):
                 client.send(THX(order)(note))
             missing = self.missing_orders(country)
             if missing: client.send(missing)
@@ -516,6 +691,35 @@ class Judge(JudgeInterface):
         else: client.reject(message)
     
     # Support functions for the above
+    def submit(self, country, phase, message):
+        ''' Adds the orders in a SUB message to the next order set.
+            Returns a list of (order, note) pairs for the THX replies.
+        '''#'''
+        start = time()
+        self.stats.phase(self.map.current_turn)
+        results = []
+        orders = self.next_orders
+        power = self.map.powers[country]
+        for tlist in message.fold()[1:]:
+            order = createUnitOrder(tlist, power, self.map, self.datc)
+            note = order.order_note(power, phase, orders)
+            self.log_debug(14, ' SUB: %s => %s', order, note)
+            order.__note = note
+            if note == MBV:
+                order.__result = None
+                orders.add(order, country)
+            elif self.game_opts.AOA:
+                if order.is_moving() and self.illegal(order):
+                    # Make it act like it's holding
+                    self.log_debug(13, ' Changing behavior of "%s" (%s) to hold', order, order.__note)
+                    order.is_moving = lambda: False
+                order.__result = note
+                orders.add(order, country)
+                note = MBV
+            results.append((order, note))
+        self.stats.count('orders', len(results))
+        self.stats.add_time('submit', start)
+        return results
     def missing_orders(self, country):
         self.log_debug(14, 'Finding missing orders for %s from %s', country, self.next_orders)
         return self.next_orders.missing_orders(self.phase, self.map.powers[country])
@@ -553,6 +757,8 @@ class Judge(JudgeInterface):
             Returns applicable ORD, NOW, and SCO messages.
             At the end of the game, returns SLO/DRW and SMY messages.
         '''#'''
+        stats = self.stats
+        stats.phase(self.map.current_turn)
         msg = self.check_draw()
         if msg:
             results = [msg]
@@ -568,15 +774,19 @@ class Judge(JudgeInterface):
                 results.extend(self.create_SETs(turn))
             
             # Execute and report orders
+            start = time()
             if self.phase == turn.move_phase:
                 orders = self.move_algorithm()
                 self.last_orders = orders
+                stats.add_time('move_algorithm', start)
             elif self.phase == turn.retreat_phase:
                 orders = self.retreat_algorithm()
                 self.last_orders.extend(orders)
+                stats.add_time('retreat_algorithm', start)
             elif self.phase == turn.build_phase:
                 orders = self.build_algorithm()
                 self.last_orders.extend(orders)
+                stats.add_time('build_algorithm', start)
             if self.options.send_ORD: results.extend(orders)
             
             # Skip to the next phase that requires action
@@ -592,15 +802,27 @@ class Judge(JudgeInterface):
                     # End the game
                     self.game_result = msg
                     results.append(msg)
+                    start = time()
                     results.append(self.map.create_NOW())
+                    stats.add_time('create_NOW', start)
                     self.phase = None
                     break
                 else:
                     self.init_turn()
                     if self.unready:
+                        start = time()
                         results.append(self.map.create_NOW())
+                        stats.add_time('create_NOW', start)
                         break
+        if not self.phase and self.options.stats_file: self.write_stats()
         return results
+    def write_stats(self):
+        ''' Appends the game's statistics to the statistics file.'''
+        stream = open(self.options.stats_file, 'a')
+        try:
+            self.stats.dump(stream, variant=self.variant_name,
+                result=str(self.game_result))
+        finally: stream.close()
     def create_SETs(self, turn):
         return [SET(nation)(turn) % [([order], [order.__note])
                 for order in self.next_orders.order_list(nation)]
@@ -611,8 +833,9 @@ class Judge(JudgeInterface):
         self.unready.clear()
         self.next_orders.clear()
         self.phase = self.map.current_turn.phase()
-        self.unready.update([country for country in self.map.powers
-                if self.missing_orders(country)])
+        self.unready.update([country for country, power
+                in self.map.powers.iteritems()
+                if self.next_orders.missing_count(self.phase, power)])
     def check_draw(self):
         ''' Checks for the end of the game by agreed draw.
             Note that in a PDA game, if more than one combination
@@ -703,7 +926,9 @@ class Judge(JudgeInterface):
         '''#'''
         orders = []
         removed = []
-        destinations = defaultdict(list)
+        retreats = []
+        entered = bounced = 0
+        bits = self.map.province_bits
         turn = self.map.current_turn
         for unit in self.map.units:
             if unit.dislodged:
@@ -713,118 +938,243 @@ class Judge(JudgeInterface):
                     removed.append(order.unit)
                     result = SUC
                 elif order.order_type == RTO:
-                    destinations[order.destination.province.key].append(order)
+                    bit = bits[order.destination.province.key]
+                    if entered & bit: bounced |= bit
+                    entered |= bit
+                    retreats.append((bit, order))
                     result = None
                 else: result = FLD   # Unrecognized order, but correct season
                 if result: orders.append(ORD(turn)(order)(result))
         for unit in removed: unit.die()
-        for unit_list in destinations.itervalues():
-            if len(unit_list) == 1:
-                # Successful retreat
-                order = unit_list[0]
+        for bit, order in retreats:
+            if bounced & bit:
+                orders.append(ORD(turn)(order)(BNC))
+                order.unit.die()
+            else:
                 orders.append(ORD(turn)(order)(SUC))
                 order.unit.move_to(order.destination)
-            else:
-                # Bouncing
-                for order in unit_list:
-                    orders.append(ORD(turn)(order)(BNC))
-                    order.unit.die()
         return orders
+    def adjudicate(self, board_state, order_set):
+        ''' Adjudicates a hypothetical movement phase, without side effects.
+            board_state is a NOW message for a movement phase of this variant,
+            and order_set is an OrderSet for any map of the variant.
+            Returns the ORD messages and a NOW message with the resulting
+            positions, still dated for the movement turn; dislodged units
+            are listed with their possible retreats.
+            
+            Neither this judge nor its map is touched, so this may be called
+            from several threads at once.
+            
+            If the cache_size option is set, results are remembered by
+            the turn, the position hash of the units, the retreat options
+            of any dislodged units, and the orders submitted by each power.
+            Each caller gets its own copy of the messages, so changing them
+            does not affect the cache.
+        '''#'''
+        submissions = []
+        for country in sorted(self.map.powers):
+            message = order_set.create_SUB(country)
+            if message: submissions.append((country, message))
+        
+        cache = self.cache
+        if cache is None and self.options.cache_size > 0:
+            cache = self.cache = AdjudicationCache(self.options.cache_size,
+                self.options.cache_eviction)
+        if cache is not None:
+            folded = board_state.fold()
+            # The position hash doesn't cover retreat options.
+            retreats = tuple(sorted(frozen(unit)
+                for unit in folded[2:] if len(unit) > 3))
+            key = (tuple(folded[1]),
+                self.map.zobrist_keys.hash_units(folded[2:]), retreats,
+                tuple((country, tuple(message))
+                    for country, message in submissions))
+            result = cache.lookup(key)
+            if result is None:
+                result = self.hypothesize(board_state, submissions)
+                cache.store(key, result)
+            orders, now = result
+            result = [Message(order) for order in orders], Message(now)
+        else: result = self.hypothesize(board_state, submissions)
+        return result
+    def hypothesize(self, board_state, submissions):
+        ''' Adjudicates orders for a position in a scratch judge.
+            Scratch judges are kept for reuse, one per concurrent call,
+            so their maps are only built once.
+        '''#'''
+        self.scratch_lock.acquire()
+        try:
+            if self.scratch: judge = self.scratch.pop()
+            else: judge = None
+        finally: self.scratch_lock.release()
+        if judge is None:
+            judge = self.__class__(self.map.variant, self.game_opts)
+        
+        try:
+            judge.datc = self.datc
+            judge.next_orders = OrderSet()
+            judge.map.handle_NOW(board_state)
+            turn = judge.map.current_turn
+            phase = turn.phase()
+            if phase != turn.move_phase:
+                raise ValueError('Only movement phases can be adjudicated')
+            for country, message in submissions:
+                judge.submit(country, phase, message)
+            orders = judge.move_algorithm()
+            return orders, judge.map.create_NOW()
+        finally:
+            self.scratch_lock.acquire()
+            try: self.scratch.append(judge)
+            finally: self.scratch_lock.release()
     def move_algorithm(self):
         ''' The main adjudication routine for movement phases.
             Returns a list of ORD messages.
         '''#'''
         # 0) Initialize arrays
-        decisions = Decision_Set()
+        self.stats.phase(self.map.current_turn)
+        decisions = self.decisions
         convoyers = {}
         for province in self.map.spaces.itervalues(): province.entering = []
         
-        # 1) Run through the units, collecting orders and checking validity.
-        # Each unit gets a Dislodge decision.
-        # Each moving unit gets Move, Attack, and Prevent decisions.
-        # Each valid supporting unit gets a Support decision.
-        # Each province moved into gets a Hold decision.
-        for unit in self.map.units:
-            order = unit.current_order = self.unit_order(unit, HoldOrder)
-            self.log_debug(13, 'Using "%s" for %s', order, unit)
-            unit.supports = []
-            unit.decisions = {}
-            decisions.add(Dislodge_Decision(order))
-            if order.is_moving():
-                self.add_movement_decisions(order, unit, decisions)
-            elif order.is_convoying():
-                if order.matches(self.next_orders) and not self.illegal(order):
-                    convoyers[unit.coast.province.key] = (order.supported.key, unit.nation.key)
-                elif not order.__result: order.__result = NSO
-            elif order.is_supporting() and not order.__result:
-                if order.matches(self.next_orders):
-                    decisions.add(Support_Decision(order))
-                else: order.__result = NSO
-        self.log_debug(11, "Convoyers = %s", convoyers)
-        
-        # 2) Clean up order inter-dependencies.
-        # Each moving unit in a potential head-to-head conflict
-        # gets Head and Defend decisions.
-        # Each moving unit gets a Path decision.
-        # Find available routes for convoyed units.
-        # Tell supported units about their supports.
-        for choice in decisions[Decision.MOVE]:
-            self.add_path_decisions(choice.order, convoyers, decisions)
-        for choice in decisions[Decision.SUPPORT]:
-            choice.order.supported.supports.append(choice)
-        
-        # 3) Initialize the dependencies in each decision.
-        decision_list = decisions.sorted()
-        for choice in decisions: choice.init_deps()
-        
-        # 4a) Pre-make some decisions if so requested
-        if self.datc.datc_4a2 == 'b':
-            resolved = self.eightytwo(decision_list)
-            decision_list = [choice for choice in decision_list
-                if choice not in resolved]
-        
-        # 4) Run through the decisions until they are all made.
-        while decision_list:
-            self.log_debug(11, '%d decisions to make...', len(decision_list))
-            for choice in decision_list:
-                self.log_debug(14, choice)
-                for dep in choice.depends: self.log_debug(15, '- ' + str(dep))
-            remaining = [choice for choice in decision_list
-                    if not choice.calculate()]
-            if len(remaining) == len(decision_list):
-                decision_list = self.resolve_paradox(remaining)
-            else: decision_list = remaining
-        
-        # 5) Move units around
-        turn = self.map.current_turn
-        orders = [ORD (turn) (unit.current_order.strict)
-            (self.process_results(unit)) for unit in self.map.units]
-        
-        # 6) Clean up all of the circular references
-        for choice in decisions: del choice.depends
-        for unit in self.map.units: del unit.decisions
-        
-        # 7) Return the ORD messages
-        return orders
+        try:
+            # 1) Run through the units, collecting orders
+            # and checking validity.
+            # Each unit gets a Dislodge decision.
+            # Each moving unit gets Move, Attack, and Prevent decisions.
+            # Each valid supporting unit gets a Support decision.
+            # Each province moved into gets a Hold decision.
+            for unit in self.map.units:
+                order = unit.current_order = self.unit_order(unit, HoldOrder)
+                self.log_debug(13, 'Using "%s" for %s', order, unit)
+                unit.supports = []
+                unit.tally = None
+                unit.decisions = {}
+                decisions.new(Dislodge_Decision, order)
+                if order.is_moving():
+                    self.add_movement_decisions(order, unit, decisions)
+                elif order.is_convoying():
+                    if (order.matches(self.next_orders)
+                            and not self.illegal(order)):
+                        convoyers[unit.coast.province.key] = (
+                            order.supported.key, unit.nation.key)
+                    elif not order.__result: order.__result = NSO
+                elif order.is_supporting() and not order.__result:
+                    if order.matches(self.next_orders):
+                        decisions.new(Support_Decision, order)
+                    else: order.__result = NSO
+            self.log_debug(11, "Convoyers = %s", convoyers)
+            
+            # 2) Clean up order inter-dependencies.
+            # Each moving unit in a potential head-to-head conflict
+            # gets Head and Defend decisions.
+            # Each moving unit gets a Path decision.
+            # Find available routes for convoyed units.
+            # Tell supported units about their supports.
+            for choice in decisions[Decision.MOVE]:
+                self.add_path_decisions(choice.order, convoyers, decisions)
+            for choice in decisions[Decision.SUPPORT]:
+                supported = choice.order.supported
+                if not supported.supports: supported.tally = Support_Tally()
+                supported.supports.append(choice)
+                supported.tally.add(choice.order.unit.nation.key)
+            
+            # 3) Initialize the dependencies in each decision.
+            decision_list = decisions.sorted()
+            for choice in decisions: choice.init_deps()
+            for kind, choices in decisions.iteritems():
+                self.stats.count_item('decisions', Decision.names[kind],
+                    len(choices))
+            
+            # 4a) Pre-make some decisions if so requested
+            if self.datc.datc_4a2 == 'b':
+                resolved = self.eightytwo(decision_list)
+                decision_list = [choice for choice in decision_list
+                    if choice not in resolved]
+                if resolved: self.stats.count_item('rules', '1982')
+            
+            # 4) Run through the decisions until they are all made.
+            self.make_decisions(decision_list)
+            self.contested = self.closed_provinces()
+            
+            # 5) Move units around
+            turn = self.map.current_turn
+            orders = [ORD (turn) (unit.current_order.strict)
+                (self.process_results(unit)) for unit in self.map.units]
+            
+            # 6) Return the ORD messages
+            return orders
+        finally:
+            # 7) Clean up all of the circular references,
+            # keeping the decisions for the next movement phase,
+            # even if adjudication failed part of the way through
+            decisions.release()
+            for unit in self.map.units:
+                if hasattr(unit, 'decisions'): del unit.decisions
     
+    def make_decisions(self, decision_list):
+        ''' Calculates each decision in the list until all are decided.
+            Rather than recalculating every undecided decision on each pass,
+            keeps a worklist of decisions whose dependencies have changed
+            since they were last calculated.  When the worklist runs dry
+            with decisions still undecided, the rest form a paradox.
+        '''#'''
+        # Reverse dependency edges: which decisions rely on this one?
+        dependents = defaultdict(list)
+        for choice in decision_list:
+            for dep in choice.depends:
+                if dep: dependents[dep].append(choice)
+        
+        pending = set(decision_list)
+        worklist = deque(decision_list)
+        queued = set(decision_list)
+        calculations = passes = 0
+        while pending:
+            self.log_debug(11, '%d decisions to make...', len(pending))
+            passes += 1
+            while worklist:
+                choice = worklist.popleft()
+                queued.discard(choice)
+                if choice not in pending: continue
+                if self.debugging(14):
+                    self.log_debug(14, '%s', choice)
+                    for dep in choice.depends: self.log_debug(15, '- %s', dep)
+                before = choice.values()
+                calculations += 1
+                if choice.calculate(): pending.discard(choice)
+                elif choice.values() == before: continue
+                for dep in dependents[choice]:
+                    if dep in pending and dep not in queued:
+                        worklist.append(dep)
+                        queued.add(dep)
+            if pending:
+                remaining = [choice for choice in decision_list
+                        if choice in pending]
+                unresolved = self.resolve_paradox(remaining)
+                for choice in remaining:
+                    if choice not in unresolved:
+                        pending.discard(choice)
+                        for dep in dependents[choice]:
+                            if dep in unresolved and dep not in queued:
+                                worklist.append(dep)
+                                queued.add(dep)
+        self.stats.count('calculations', calculations)
+        self.stats.count('passes', passes)
     def add_movement_decisions(self, order, unit, decisions):
-        decisions.add(Move_Decision(order))
-        decisions.add(Attack_Decision(order))
-        decisions.add(Prevent_Decision(order))
+        decisions.new(Move_Decision, order)
+        decisions.new(Attack_Decision, order)
+        decisions.new(Prevent_Decision, order)
         
         into = order.destination.province
         if not into.entering:
-            hold = Hold_Decision(into)
-            decisions.add(hold)
-            into.hold = hold
+            into.hold = decisions.new(Hold_Decision, into)
         into.entering.append(unit)
     def add_path_decisions(self, order, convoyers, decisions):
         # Is anyone moving in the opposite direction?
         unit_list = order.unit.coast.province.entering
         heads = any(u in unit_list for u in order.destination.province.units)
         if heads:
-            decisions.add(Head_Decision(order))
-            decisions.add(Defend_Decision(order))
+            decisions.new(Head_Decision, order)
+            decisions.new(Defend_Decision, order)
         
         # Warning: if any routes are given, a convoy will be attempted.
         # So, only give routes if 4.A.3 allows the convoy.
@@ -833,6 +1183,8 @@ class Judge(JudgeInterface):
         try_overland = False
         if order.is_convoyed():
             routes = order.get_routes(convoyers, disrupt_any)
+            self.stats.count('routes', len(order.path and [order.path]
+                or order.routes))
             if order.maybe_overland():
                 if not routes: routes = None
                 elif self.datc.datc_4a3 == 'd':
@@ -846,11 +1198,13 @@ class Judge(JudgeInterface):
         else: routes = None
         
         self.log_debug(11, "Path_Decision(%s, %s, %s, %s) from '%s' for 4.A.1 and '%s' for 4.A.3",
-                order, routes and [[s.key for s in p] for p in routes],
+                order, lazy(lambda: routes and [[s.key for s in p] for p in routes]),
                 not disrupt_any, try_overland, self.datc.datc_4a1, self.datc.datc_4a3)
-        path = Path_Decision(order, routes, not disrupt_any, try_overland)
-        if order.__result: path.failed = True
-        else: decisions.add(path)
+        if order.__result:
+            path = Path_Decision(order, routes, not disrupt_any, try_overland)
+            path.failed = True
+        else: decisions.new(Path_Decision, order, routes,
+                not disrupt_any, try_overland)
     def unit_order(self, unit, order_class):
         ''' Returns the last order given by the unit's owner.
             Depends on handle_SUB() to weed out invalid orders.
@@ -880,10 +1234,24 @@ class Judge(JudgeInterface):
         ''' Resolve the paradox, somehow.
             This may involve circular motion, convoy paradox,
             or stranger things in certain variants.
+            Each independent paradox core is resolved at once.
         '''#'''
         self.log_debug(7, 'Warning: Paradox resolution')
+        start = time()
+        self.stats.count('paradoxes')
         decision_list = set(decisions)
-        core = self.get_core(decisions)
+        for core in self.get_cores(decisions):
+            resolved = self.resolve_core(core)
+            self.log_debug(8, 'Resolved choices:')
+            for choice in resolved:
+                self.log_debug(8, '- %s', choice)
+                decision_list.discard(choice)
+        self.stats.add_time('paradox', start)
+        return decision_list
+    def resolve_core(self, core):
+        ''' Resolves a single paradox core,
+            returning the list of decisions it made.
+        '''#'''
         convoy = False
         moving_to = set()
         moving_from = set()
@@ -898,18 +1266,22 @@ class Judge(JudgeInterface):
                     if order.is_convoying() and not order.__result:
                         convoy = True
         
-        resolved = None
+        resolved = rule = None
         if convoy:
-            if   self.datc.datc_4a2 == 'd': resolved = self.Szykman(core)
-            elif self.datc.datc_4a2 == 'f': resolved = self.dptg(core)
+            if self.datc.datc_4a2 == 'd':
+                rule = 'Szykman'
+                resolved = self.Szykman(core)
+            elif self.datc.datc_4a2 == 'f':
+                rule = 'DPTG'
+                resolved = self.dptg(core)
         elif moving_to and moving_to == moving_from:
+            rule = 'circular'
             resolved = self.circular(core)
-        if not resolved: resolved = self.fallback(core)
-        self.log_debug(8, 'Resolved choices:')
-        for choice in resolved:
-            self.log_debug(8, '- %s', choice)
-            decision_list.discard(choice)
-        return decision_list
+        if not resolved:
+            rule = 'fallback'
+            resolved = self.fallback(core)
+        self.stats.count_item('rules', rule)
+        return resolved
     def eightytwo(self, decisions):
         ''' Applies the 1982 rule for convoy disruption paradoxes:
             If a convoyed army attacks a fleet which is supporting an action
@@ -937,9 +1309,10 @@ class Judge(JudgeInterface):
                 convoying = is_convoying(choice.order.destination.province.unit)
                 army = any(is_convoyed(attack) for attack in choice.depends)
                 self.log_debug(11, '* %s: %s, %s', choice, convoying, army)
-                for dep in choice.depends: self.log_debug(17, '- ' + str(dep))
+                if self.debugging(17):
+                    for dep in choice.depends: self.log_debug(17, '- %s', dep)
                 if convoying and army:
-                    choice.passed = True
+                    choice.settle(True, choice.failed)
                     result.append(choice)
         return result
     def Szykman(self, decisions):
@@ -988,33 +1361,74 @@ class Judge(JudgeInterface):
         result = []
         self.log_debug(7, 'Applying fallback rule.')
         for choice in decisions:
-            if choice.type in (Decision.MOVE, Decision.SUPPORT):
+            if choice.type == Decision.MOVE:
                 choice.failed = True
                 result.append(choice)
+            elif choice.type == Decision.SUPPORT:
+                choice.settle(choice.passed, True)
+                result.append(choice)
         return result
-    def get_core(self, decisions):
-        choices = {}
+    def get_cores(self, decisions):
+        ''' Finds the paradox cores among the undecided decisions.
+            Each core is a strongly connected component of the dependency
+            graph that depends on no other undecided decision.
+            Uses Tarjan's algorithm, so this takes linear time.
+        '''#'''
+        graph = {}
         for choice in decisions:
-            choices[choice] = set([dep for dep in choice.depends
-                if dep and not dep.decided()])
-            self.log_debug(8, '%s:', choice)
-            for dep in choice.depends: self.log_debug(11, '- %s', dep)
-        while True:
-            additions = False
-            for deps in choices.itervalues():
-                newdeps = set()
-                for choice in deps:
-                    newdeps |= choices[choice]
-                if not (newdeps <= deps):
-                    deps |= newdeps
-                    additions = True
-            if not additions: break
-        result = decisions
+            graph[choice] = [dep for dep in choice.depends
+                if dep and not dep.decided()]
+            if self.debugging(8):
+                self.log_debug(8, '%s:', choice)
+                for dep in choice.depends: self.log_debug(11, '- %s', dep)
+        for choice, deps in graph.iteritems():
+            deps[:] = [dep for dep in deps if dep in graph]
+        
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for root in decisions:
+            if root in index: continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(graph[root]))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(graph[child])))
+                        break
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = set()
+                        while True:
+                            choice = stack.pop()
+                            on_stack.discard(choice)
+                            component.add(choice)
+                            if choice is node: break
+                        components.append(component)
+        
+        result = []
         self.log_debug(8, '%d original decisions', len(decisions))
-        for choice,dep_list in choices.iteritems():
-            self.log_debug(11, '%s -> depends on %d', choice, len(dep_list))
-            if len(dep_list) < len(result): result = dep_list
-        return result or decisions
+        for component in components:
+            deps = set(chain(*[graph[choice] for choice in component]))
+            self.log_debug(11, '%d decisions -> depends on %d',
+                    len(component), len(deps))
+            # Only components with cycles and no outside dependencies
+            if deps and deps <= component: result.append(component)
+        return result or [decisions]
     def process_results(self, unit):
         ''' Returns the result of the unit's order, based on decisions.
             False Path    -> DSR or NSO (FAR determined earlier)
@@ -1033,8 +1447,9 @@ class Judge(JudgeInterface):
         result = order.__result
         self.log_debug(13, 'Processing %s; %s', order, result)
         if not result:
-            for choice in unit.decisions.itervalues():
-                self.log_debug(14, '- ' + str(choice))
+            if self.debugging(14):
+                for choice in unit.decisions.itervalues():
+                    self.log_debug(14, '- %s', choice)
             if order.is_moving():
                 path = unit.decisions[Decision.PATH]
                 if path.passed:
@@ -1061,25 +1476,74 @@ class Judge(JudgeInterface):
             if result: return (result, RET)
             else: return RET
         else: return result or SUC
+    def closed_provinces(self):
+        ''' Returns the bitset of provinces closed to retreating units:
+            those still occupied after the moves, and those contested
+            by a unit that could have entered or stayed there.
+            Must be called after the decisions are made,
+            but before any unit moves.
+        '''#'''
+        bits = self.map.province_bits
+        closed = 0
+        for unit in self.map.units:
+            order = unit.current_order
+            if not (order.is_moving() and unit.decisions[Decision.MOVE].passed):
+                closed |= bits[unit.coast.province.key]
+        for province in self.map.spaces.itervalues():
+            if province.entering and (province.hold.max_value > 0 or
+                    any(unit.decisions[Decision.PREVENT].max_value > 0
+                        for unit in province.entering)):
+                closed |= bits[province.key]
+        return closed
     def collect_retreats(self, unit):
         self.log_debug(8, 'Collecting retreats for %s, dislodged by %s', unit, unit.dislodger)
-        return [coast.maybe_coast for coast in
-                [self.map.coasts[key] for key in unit.coast.borders_out]
-                if self.valid_retreat(coast, unit.dislodger)]
-    def valid_retreat(self, retreat, dislodger):
-        if retreat.province == dislodger: return False
-        for unit in retreat.province.units:
-            order = unit.current_order
-            if not (order.is_moving() and order.unit.decisions[Decision.MOVE].passed):
-                return False
-        if retreat.province.entering:
-            if retreat.province.hold.max_value > 0: return False
-            for unit in retreat.province.entering:
-                if unit.current_order.unit.decisions[Decision.PREVENT].max_value > 0:
-                    return False
-        return True
+        bits = self.map.province_bits
+        coast = unit.coast
+        open_bits = self.map.adjacent_bits[coast.key] & ~(self.contested
+                | bits[unit.dislodger.key])
+        if not open_bits: return []
+        return [retreat.maybe_coast for retreat in
+                [self.map.coasts[key] for key in coast.borders_out]
+                if open_bits & bits[retreat.province.key]]
 
 
+class Support_Tally(object):
+    ''' Running counts of the supports given to a unit, in total and for
+        each supporting power, updated as each Support decision is made.
+        Strength calculations read these counts instead of checking
+        every support, so each takes time independent of the supports.
+            - passed:   Supports that have passed
+            - possible: Supports that have not failed
+            - powers:   [passed, possible] counts for each supporting power
+    '''#'''
+    __slots__ = ('passed', 'possible', 'powers')
+    def __init__(self):
+        self.passed = 0
+        self.possible = 0
+        self.powers = {}
+    def add(self, nation):
+        ''' Counts a new, undecided support from the nation.'''
+        self.possible += 1
+        counts = self.powers.get(nation)
+        if counts: counts[1] += 1
+        else: self.powers[nation] = [0, 1]
+    def change(self, nation, passed, failed):
+        ''' Adjusts the counts for a support that has newly passed or failed.
+            The arguments are the changes in its passed and failed flags.
+        '''#'''
+        counts = self.powers[nation]
+        counts[0] += passed
+        counts[1] -= failed
+        self.passed += passed
+        self.possible -= failed
+    def count(self, minimal, excluded=()):
+        if minimal: index, total = 0, self.passed
+        else: index, total = 1, self.possible
+        for nation in excluded:
+            counts = self.powers.get(nation)
+            if counts: total -= counts[index]
+        return total
+
 class Decision_Set(defaultdict):
     ''' Holds a set of Decisions, separating them by type.
         As a list, they are returned in the following order:
@@ -1087,9 +1551,31 @@ class Decision_Set(defaultdict):
         PREVENT decisions, HOLD decisions, MOVE decisions, DISLODGE decisions.
         This order attempts to maximize decisions made in the first pass.
         (But it could be better by alternating attack and support...)
+        
+        A judge keeps one Decision_Set for the whole game.  Decisions made
+        by new() come from free lists of released decisions when possible,
+        and release() returns every decision in the set to those lists,
+        so each movement phase reuses the objects of the one before.
     '''#'''
-    def __init__(self): super(Decision_Set, self).__init__(list)
+    def __init__(self):
+        super(Decision_Set, self).__init__(list)
+        self.free = defaultdict(list)
     def add(self, decision): self[decision.type].append(decision)
+    def new(self, decision_class, *args):
+        ''' Adds a decision of the given class, reusing one if possible.'''
+        free = self.free[decision_class.type]
+        if free:
+            decision = free.pop()
+            decision.reset(*args)
+        else: decision = decision_class(*args)
+        self[decision_class.type].append(decision)
+        return decision
+    def release(self):
+        ''' Empties the set, keeping its decisions for reuse.'''
+        for kind, choices in self.iteritems():
+            for choice in choices: choice.release()
+            self.free[kind].extend(choices)
+            del choices[:]
     def __iter__(self): return chain(*self.itervalues())
     def sorted(self):
         return (self[Decision.PATH] +
@@ -1126,19 +1612,30 @@ class Decision(object):
     # memory management is crucial.
     __slots__ = ('depends', 'into', 'order')
     
-    def __init__(self, order):
+    def __init__(self, *args):
         self.depends = []    # Decisions on which this one depends.
+        self.reset(*args)
+    def reset(self, order):
+        ''' Prepares the decision for a new order,
+            keeping its list of dependencies.
+        '''#'''
+        del self.depends[:]
         self.into    = None  # Province being moved into
         self.order   = order
         
         if self.type != Decision.HOLD:
             order.unit.decisions[self.type] = self
             if order.destination: self.into = order.destination.province
+    def release(self):
+        ''' Drops references to the phase's orders and decisions.'''
+        del self.depends[:]
+        self.into = self.order = None
     def __str__(self):
         return '%s decision for %s; %s' % (
             self.names[self.type], self.order.unit, self.state())
     def __repr__(self): return str(self)   # To make lists look nice
     def state(self): raise NotImplementedError
+    def values(self): raise NotImplementedError
     def battles(self):
         unit_list = self.order.unit.coast.province.entering
         return [unit for unit in self.into.units if unit in unit_list]
@@ -1152,8 +1649,8 @@ class Tristate_Decision(Decision):
         (True,  True):  'Confused'
     }
     
-    def __init__(self, *args):
-        Decision.__init__(self, *args)
+    def reset(self, *args):
+        Decision.reset(self, *args)
         self.passed = False
         self.failed = False
     def decided(self):
@@ -1164,6 +1661,8 @@ class Tristate_Decision(Decision):
         return self.passed or self.failed
     def state(self):
         return self.status[(self.passed, self.failed)]
+    def values(self):
+        return self.passed, self.failed
     def minmax(self, decision_list):
         ''' Returns the highest maximum and minimum values in the decision list.'''
         min_found = max_found = 0
@@ -1200,7 +1699,7 @@ class Support_Decision(Tristate_Decision):
     __slots__ = ()
     type = Decision.SUPPORT
     def init_deps(self):
-        self.depends = [self.order.unit.decisions[Decision.DISLODGE]] + [
+        self.depends[:] = [self.order.unit.decisions[Decision.DISLODGE]] + [
             u.decisions[Decision.ATTACK]
             for u in self.order.unit.coast.province.entering
             if u.coast.province != self.into
@@ -1208,9 +1707,17 @@ class Support_Decision(Tristate_Decision):
     def calculate(self):
         dislodge = self.depends[0]
         min_oppose, max_oppose = self.minmax(self.depends[1:])
-        self.passed = dislodge.failed and max_oppose == 0
-        self.failed = dislodge.passed or  min_oppose >= 1
+        self.settle(dislodge.failed and max_oppose == 0,
+                    dislodge.passed or  min_oppose >= 1)
         return self.decided()
+    def settle(self, passed, failed):
+        ''' Sets the state of the decision,
+            keeping the supported unit's tally up to date.
+        '''#'''
+        self.order.supported.tally.change(self.order.unit.nation.key,
+            passed - self.passed, failed - self.failed)
+        self.passed = passed
+        self.failed = failed
 class Dislodge_Decision(Tristate_Decision):
     # Failed: the unit stays; Passed: it must retreat.
     __slots__ = ()
@@ -1219,7 +1726,7 @@ class Dislodge_Decision(Tristate_Decision):
         if self.order.is_moving():
             my_move = self.order.unit.decisions[Decision.MOVE]
         else: my_move = None
-        self.depends = [my_move] + [unit.decisions[Decision.MOVE]
+        self.depends[:] = [my_move] + [unit.decisions[Decision.MOVE]
             for unit in self.order.unit.coast.province.entering]
     def calculate(self):
         my_move = self.depends[0]
@@ -1231,8 +1738,8 @@ class Path_Decision(Tristate_Decision):
     # A unit moving overland will have an empty routes.
     __slots__ = ('routes', 'disrupt_all', 'backup')
     type = Decision.PATH
-    def __init__(self, order, routes, disrupt_all, try_overland):
-        Tristate_Decision.__init__(self, order)
+    def reset(self, order, routes, disrupt_all, try_overland):
+        Tristate_Decision.reset(self, order)
         self.disrupt_all = disrupt_all
         self.backup = try_overland
         self.routes = routes and [sum([[unit.decisions[Decision.DISLODGE]
@@ -1240,9 +1747,11 @@ class Path_Decision(Tristate_Decision):
                 for prov in path], [])
             for path in routes
         ]
+    def release(self):
+        Tristate_Decision.release(self)
+        self.routes = None
     def init_deps(self):
-        if self.routes: self.depends = set(sum(self.routes, []))
-        else: self.depends = []
+        if self.routes: self.depends[:] = set(sum(self.routes, []))
     def calculate(self):
         #print 'Calculating %s (%s, %s, %s):' % (self,
         #        self.routes and [[s.key for s in p] for p in self.routes],
@@ -1309,7 +1818,7 @@ class Head_Decision(Tristate_Decision):
     def init_deps(self):
         path = self.order.unit.decisions[Decision.PATH]
         heads = [unit.decisions[Decision.HEAD] for unit in self.battles()]
-        self.depends = [path] + heads
+        self.depends[:] = [path] + heads
     def calculate(self):
         # If this unit is convoyed, it fails.
         # If the opposing heads all fail, it fails.
@@ -1334,8 +1843,8 @@ class Numeric_Decision(Decision):
         The minimum never decreases; the maximum never increases.
     '''#'''
     __slots__ = ('min_value', 'max_value')
-    def __init__(self, order):
-        Decision.__init__(self, order)
+    def reset(self, order):
+        Decision.reset(self, order)
         self.min_value = 0
         self.max_value = Infinity
     def decided(self):
@@ -1346,6 +1855,15 @@ class Numeric_Decision(Decision):
         return self.max_value == self.min_value
     def state(self):
         return 'minimum %d, maximum %s' % (self.min_value, self.max_value)
+    def support_strength(self, unit, minimal, excluded=()):
+        ''' Counts the supports given to the unit that have passed,
+            if minimal is true, or that have not failed, if false,
+            ignoring those from the excluded powers.
+        '''#'''
+        if unit.supports: return unit.tally.count(minimal, excluded)
+        return 0
+    def values(self):
+        return self.min_value, self.max_value
 class Attack_Decision(Numeric_Decision):
     # Strength of the attack
     __slots__ = ()
@@ -1355,7 +1873,7 @@ class Attack_Decision(Numeric_Decision):
         path = unit.decisions[Decision.PATH]
         heads = [other.decisions[Decision.HEAD] for other in self.battles()]
         moves = [other.decisions.get(Decision.MOVE) for other in self.into.units]
-        self.depends = [path] + heads + moves + unit.supports
+        self.depends[:] = [path] + heads + moves + unit.supports
     def calculate(self):
         attacked = self.into.units
         index1 = 1 + len(self.battles())
@@ -1363,24 +1881,21 @@ class Attack_Decision(Numeric_Decision):
         path = self.depends[0]
         heads = self.depends[1:index1]
         moves = zip(attacked, self.depends[index1:index2])
-        supports = self.depends[index2:]
         def minimal_test(choice): return choice and choice.passed
         def maximal_test(choice): return choice and not choice.failed
-        self.min_value = self.calc_attack(path, heads, moves, supports, minimal_test, maximal_test)
-        self.max_value = self.calc_attack(path, heads, moves, supports, maximal_test, minimal_test)
+        self.min_value = self.calc_attack(path, heads, moves, True, minimal_test, maximal_test)
+        self.max_value = self.calc_attack(path, heads, moves, False, maximal_test, minimal_test)
         #print 'Attack values: "%s" / "%s"' % (self.min_value, self.max_value)
-        #print '  from (%s, %s, %s, %s)' % (path, heads, moves, supports)
+        #print '  from (%s, %s, %s)' % (path, heads, moves)
         return self.decided()
-    def calc_attack(self, path, heads, moves, supports, valid, valid_head):
+    def calc_attack(self, path, heads, moves, minimal, valid, valid_head):
         if valid(path):
-            valid_supports = filter(valid, supports)
             powers = set([choice.order.unit.nation.key
                 for choice in heads if valid_head(choice)] +
                 [unit.nation.key for unit, choice in moves if not valid(choice)])
             #print 'Calc attack powers: %s' % powers
             if self.order.unit.nation.key in powers: return 0
-            return 1 + len([choice for choice in valid_supports
-                if choice.order.unit.nation.key not in powers])
+            return 1 + self.support_strength(self.order.unit, minimal, powers)
         else: return 0
 class Hold_Decision(Numeric_Decision):
     # Strength of the defense
@@ -1393,8 +1908,8 @@ class Hold_Decision(Numeric_Decision):
         # Todo: Make this multi-unit safe
         for unit in self.order.units:
             if unit.current_order.is_moving():
-                self.depends = [unit.decisions[Decision.MOVE]]
-            else: self.depends = [None] + unit.supports
+                self.depends[:] = [unit.decisions[Decision.MOVE]]
+            else: self.depends[:] = [None] + unit.supports
     def calculate(self):
         if self.depends:
             first = self.depends[0]
@@ -1405,12 +1920,12 @@ class Hold_Decision(Numeric_Decision):
                     self.min_value = 0
                     self.max_value = 1
             else:
+                supports = self.depends[1:]
                 self.min_value = self.max_value = 1
-                for support in self.depends[1:]:
-                    if not support.failed:
-                        self.max_value += 1
-                        if support.passed:
-                            self.min_value += 1
+                if supports:
+                    unit = supports[0].order.supported
+                    self.min_value += self.support_strength(unit, True)
+                    self.max_value += self.support_strength(unit, False)
         else: self.max_value = self.min_value = 0
         return self.decided()
 class Prevent_Decision(Numeric_Decision):
@@ -1421,7 +1936,7 @@ class Prevent_Decision(Numeric_Decision):
         path = unit.decisions[Decision.PATH]
         head = unit.decisions.get(Decision.HEAD)
         moves = [other.decisions[Decision.MOVE] for other in self.battles()]
-        self.depends = [path, head] + moves + unit.supports
+        self.depends[:] = [path, head] + moves + unit.supports
     def calculate(self):
         path = self.depends[0]
         if path.failed: self.max_value = self.min_value = 0
@@ -1429,14 +1944,9 @@ class Prevent_Decision(Numeric_Decision):
             head = self.depends[1]
             moves = [choice for choice in self.depends
                 if choice and choice.type == Decision.MOVE]
-            supports = [choice for choice in self.depends
-                if choice and choice.type == Decision.SUPPORT]
-            
-            self.max_value = self.min_value = 1
-            for support in supports:
-                if not support.failed:
-                    self.max_value += 1
-                    if support.passed: self.min_value += 1
+            unit = self.order.unit
+            self.min_value = 1 + self.support_strength(unit, True)
+            self.max_value = 1 + self.support_strength(unit, False)
             if (head and not head.failed
                     and any(not choice.failed for choice in moves)):
                 self.min_value = 0
@@ -1449,18 +1959,15 @@ class Defend_Decision(Numeric_Decision):
     type = Decision.DEFEND
     def init_deps(self):
         unit = self.order.unit
-        self.depends = [unit.decisions[Decision.HEAD]] + unit.supports
+        self.depends[:] = [unit.decisions[Decision.HEAD]] + unit.supports
     def calculate(self):
         # Significantly different from the DATC description,
         # taking the new HEAD decisions into account.
         head = self.depends[0]
         if head.failed: self.min_value = self.max_value = 0
         else:
-            self.min_value = self.max_value = 1
-            for support in self.depends[1:]:
-                if not support.failed:
-                    self.max_value += 1
-                    if support.passed:
-                        self.min_value += 1
+            unit = self.order.unit
+            self.min_value = 1 + self.support_strength(unit, True)
+            self.max_value = 1 + self.support_strength(unit, False)
             if not head.passed: self.min_value = 0
         return self.decided()
@@ -9,13 +9,16 @@ r'''Parlance language classes
 '''#'''
 
 import re
+from array     import array
 from struct    import pack
+from sys       import byteorder
 
-from functions import Comparable, rindex
+from functions import Comparable
 from config    import Configurable, VerboseObject, parse_file
 
 __all__ = [
     'Message',
+    'PackedMessage',
     'Token',
     'StringToken',
     'IntegerToken',
@@ -51,8 +54,8 @@ class Message(list):
     def fold(self):
         ''' Folds the token into a list, with bracketed sublists as lists.
             Also converts text and number tokens to strings and integers.
-            This version takes about half the time for a map definition,
-            but probably a bit longer than old_fold() for simple messages.
+            Works in a single pass, keeping the enclosing lists on a stack,
+            so it takes time linear in the length of the message.
             
             >>> NOT(GOF).fold()
             [NOT, [GOF]]
@@ -71,15 +74,41 @@ class Message(list):
                 ...
             ValueError: unbalanced parentheses in folded Message
         '''#'''
-        complaint = 'unbalanced parentheses in folded Message'
-        if self.count(BRA) != self.count(KET): raise ValueError, complaint
-        series = self.convert()
-        while BRA in series:
-            k = series.index(KET)
-            try: b = rindex(series[:k], BRA)
-            except ValueError: raise ValueError, complaint
-            series[b:k+1] = [series[b+1:k]]
-        return series
+        text_category = protocol.token_cats['Text']
+        bra = BRA.number
+        ket = KET.number
+        max_pos = protocol.max_pos_int
+        max_neg = protocol.max_neg_int
+        
+        result = []
+        stack = []
+        text = ''
+        append = result.append
+        for token in self:
+            if token.category == text_category:
+                text += token.text
+                continue
+            if text:
+                append(text)
+                text = ''
+            number = token.number
+            if number == bra:
+                sublist = []
+                append(sublist)
+                stack.append(result)
+                result = sublist
+                append = result.append
+            elif number == ket:
+                if not stack: raise ValueError, self.unbalanced
+                result = stack.pop()
+                append = result.append
+            elif number < max_pos: append(number)
+            elif number < max_neg: append(number - max_neg)
+            else: append(token)
+        if stack: raise ValueError, self.unbalanced
+        if text: append(text)
+        return result
+    unbalanced = 'unbalanced parentheses in folded Message'
     def convert(self):
         ''' Converts a Message into a list,
             with embedded strings and tokens converted into Python values.
@@ -153,7 +182,9 @@ class Message(list):
             >>> print map(lambda x: hex(ord(x)), NOT(GOF).pack())
             ['0x48', '0xd', '0x40', '0x0', '0x48', '0x3', '0x40', '0x1']
         '''#'''
-        return pack('!' + 'H'*len(self), *map(int, self))
+        numbers = array('H', self)
+        if byteorder == 'little': numbers.byteswap()
+        return numbers.tostring()
     def tokenize(self): return self
     
     # Formerly module methods, but only used in this class.
@@ -251,8 +282,16 @@ class Message(list):
             NME ( "name" ) ( "version" )
             >>> print CCD (ENG) (SPR, 1901)
             CCD ( ENG ) ( SPR 1901 )
+            
+            # A packed argument stays packed, so that it can be forwarded.
+            >>> m = YES(PackedMessage(NOT(GOF).pack(), default_rep))
+            >>> print m.__class__.__name__, m
+            PackedMessage YES ( NOT ( GOF ) )
         '''#'''
-        if len(args) == 1: return self + self.wrap(*args)
+        if len(args) == 1:
+            if isinstance(args[0], PackedMessage):
+                return args[0].prefixed(self)
+            return self + self.wrap(*args)
         else: return self + self.wrap(args)
     __and__ = __call__
     def __iand__(self, other):
@@ -310,6 +349,85 @@ class Message(list):
         '''#'''
         list.insert(self, index, protocol.base_rep[value])
 
+class PackedMessage(object):
+    ''' A read-only Message kept as a string of packed token numbers,
+        as received from the network.  Tokens are only looked up in the
+        representation when individual items are used, so a message can
+        be forwarded or archived without being decoded and re-encoded.
+        
+        >>> m = PackedMessage(NOT(GOF).pack(), default_rep)
+        >>> print m
+        NOT ( GOF )
+        >>> m[0], len(m), GOF in m
+        (NOT, 4, True)
+        >>> print m[1:]
+        ( GOF )
+        >>> m.fold()
+        [NOT, [GOF]]
+        >>> m == NOT(GOF)
+        True
+    '''#'''
+    __slots__ = ('data', 'rep', '__numbers')
+    
+    def __init__(self, data, rep=None):
+        if len(data) % 2:
+            raise ValueError('packed messages must have an even length')
+        self.data = data
+        self.rep = rep or protocol.default_rep
+        self.__numbers = None
+    @property
+    def numbers(self):
+        ''' The token numbers, as an array in native byte order.'''
+        numbers = self.__numbers
+        if numbers is None:
+            numbers = array('H', self.data)
+            if byteorder == 'little': numbers.byteswap()
+            self.__numbers = numbers
+        return numbers
+    
+    def pack(self): return self.data
+    def fold(self): return self.rep.fold_packed(self.data)
+    def prefixed(self, prefix):
+        ''' Returns prefix(self) as a PackedMessage, without decoding.
+            Calling a token or Message on a PackedMessage does this.
+        '''#'''
+        return PackedMessage(prefix.pack() + pack('!H', BRA) + self.data +
+                pack('!H', KET), self.rep)
+    def tokenize(self): return self.message()
+    def message(self):
+        ''' Decodes the whole message into a Message.'''
+        rep = self.rep
+        return Message([rep[number] for number in self.numbers])
+    
+    def __len__(self): return len(self.data) // 2
+    def __iter__(self):
+        rep = self.rep
+        for number in self.numbers: yield rep[number]
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return PackedMessage(self.data[2 * start:2 * max(start, stop)],
+                        self.rep)
+            return Message([self.rep[number]
+                for number in self.numbers[index]])
+        return self.rep[self.numbers[index]]
+    def __contains__(self, token): return int(token) in self.numbers
+    def count(self, token): return self.numbers.count(int(token))
+    def index(self, token): return self.numbers.index(int(token))
+    
+    def __eq__(self, other):
+        if isinstance(other, PackedMessage): return self.data == other.data
+        elif isinstance(other, list): return list(self.numbers) == other
+        return NotImplemented
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented: return result
+        return not result
+    __hash__ = None
+    def __str__(self): return str(self.message())
+    def __repr__(self): return 'PackedMessage(%r)' % (self.data,)
+
 
 class _integer_Token(int):
     ''' Core for the Token class, based on an integer.
@@ -722,9 +840,64 @@ class Representation(Configurable):
         self.numbers = nums = {}
         for number, name in tokens.iteritems():
             nums[number] = names[name] = Token(name, number)
+        self.__table = None
+        self.__words = None
+        self.__parsed = {}
+    
+    # Integer and text tokens shared by every representation
+    __values = None
+    @staticmethod
+    def value_table():
+        ''' Returns a list of 0x10000 items, holding the integer and text
+            tokens at their numbers, and None for every other number.
+            >>> table = Representation.value_table()
+            >>> table[0x3FFD], table[0x4B41]
+            (IntegerToken(-3), StringToken('A'))
+        '''#'''
+        table = Representation.__values
+        if table is None:
+            pos = protocol.max_pos_int
+            neg = protocol.max_neg_int
+            table = [None] * 0x10000
+            table[:pos] = [IntegerToken(number) for number in xrange(pos)]
+            table[pos:neg] = [IntegerToken(number)
+                for number in xrange(pos - neg, 0)]
+            text = protocol.quot_prefix
+            table[text:text + 0x100] = [StringToken(chr(number))
+                for number in xrange(0x100)]
+            Representation.__values = table
+        return table
+    
+    @property
+    def table(self):
+        ''' A list of every known token, indexed by number.
+            Tokens of this representation override those of its base.
+            Built on first use, so that loading a variant stays quick.
+        '''#'''
+        table = self.__table
+        if table is None:
+            if self.base: table = list(self.base.table)
+            else: table = list(self.value_table())
+            for number, token in self.numbers.iteritems():
+                table[number] = token
+            self.__table = table
+        return table
+    @property
+    def words(self):
+        ''' A dictionary of every known token, indexed by name.'''
+        words = self.__words
+        if words is None:
+            if self.base: words = dict(self.base.words)
+            else: words = {}
+            words.update(self.names)
+            self.__words = words
+        return words
     
     def __getitem__(self, key):
         ''' Returns a Token from its name or number.'''
+        if isinstance(key, int) and 0 <= key < 0x10000:
+            result = (self.__table or self.table)[key]
+            if result is not None: return result
         result = self.get(key)
         if result is None:
             if isinstance(key, int): key = '0x%04X' % key
@@ -734,7 +907,18 @@ class Representation(Configurable):
         ''' Returns a Token from its name or number.
             >>> default_rep.get('ITA')
             ITA
+            >>> default_rep.get(0x4101)
+            ENG
         '''#'''
+        # Fast paths for known tokens; anything else is handled below.
+        if isinstance(key, int):
+            if 0 <= key < 0x10000:
+                result = (self.__table or self.table)[key]
+                if result is not None: return result
+        elif isinstance(key, str):
+            result = (self.__words or self.words).get(key)
+            if result is not None: return result
+        
         result = self.numbers.get(key) or self.names.get(key)
         if result is None:
             if isinstance(key, Token): result = key
@@ -752,6 +936,57 @@ class Representation(Configurable):
                     else: result = default
         return result
     
+    def fold_packed(self, data):
+        ''' Folds a string of packed token numbers, as Message.fold() would
+            fold the Message it holds, without creating the Message.
+            
+            >>> default_rep.fold_packed(NME('name')(-3).pack())
+            [NME, ['name'], [-3]]
+            >>> default_rep.fold_packed(NOT(GOF).pack()[:-2])
+            Traceback (most recent call last):
+                ...
+            ValueError: unbalanced parentheses in folded Message
+        '''#'''
+        numbers = array('H', data)
+        if byteorder == 'little': numbers.byteswap()
+        text_prefix = protocol.quot_prefix
+        bra = BRA.number
+        ket = KET.number
+        max_pos = protocol.max_pos_int
+        max_neg = protocol.max_neg_int
+        
+        table = self.table
+        result = []
+        stack = []
+        text = ''
+        append = result.append
+        for number in numbers:
+            if number & 0xFF00 == text_prefix:
+                text += chr(number & 0x00FF)
+                continue
+            if text:
+                append(text)
+                text = ''
+            if number == bra:
+                sublist = []
+                append(sublist)
+                stack.append(result)
+                result = sublist
+                append = result.append
+            elif number == ket:
+                if not stack: raise ValueError, Message.unbalanced
+                result = stack.pop()
+                append = result.append
+            elif number < max_pos: append(number)
+            elif number < max_neg: append(number - max_neg)
+            else:
+                token = table[number]
+                if token is None: token = self[number]
+                append(token)
+        if stack: raise ValueError, Message.unbalanced
+        if text: append(text)
+        return result
+    
     def has_key(self, key):
         ''' Determines whether a given TLA is in use.'''
         return ((key in self.names) or (key in self.numbers) or
@@ -801,6 +1036,20 @@ class Representation(Configurable):
         if self.options.input_escape == self.options.quot_char:
             return self.translate_doubled_quotes(text)
         else: return self.translate_backslashed(text)
+    def translate_many(self, lines):
+        ''' Translates a series of diplomacy message strings,
+            such as the lines of a game log, generating a Message for each.
+            Lines are read one at a time, so a whole log is never held
+            in memory.  The escape model is chosen once for the series.
+            
+            >>> default_rep.options.input_escape = '\\\\'
+            >>> list(default_rep.translate_many(['HLO ( ENG )', 'NOT(GOF)']))
+            [Message([HLO, [ENG]]), Message([NOT, [GOF]])]
+        '''#'''
+        if self.options.input_escape == self.options.quot_char:
+            translate = self.translate_doubled_quotes
+        else: translate = self.translate_backslashed
+        for line in lines: yield translate(line)
     
     def translate_doubled_quotes(self, text):
         ''' Translates diplomacy message strings into Messages,
@@ -846,7 +1095,7 @@ class Representation(Configurable):
         
         # Complain if the message wasn't finished
         if in_text: raise ValueError, 'unterminated string in Diplomacy message'
-        else: return Message(message)
+        else: return self.message(message)
     
     def translate_backslashed(self, text):
         ''' Translates diplomacy message strings into Messages,
@@ -895,7 +1144,13 @@ class Representation(Configurable):
         # Complain if the message wasn't finished
         if saved or not in_text:
             raise ValueError, 'unterminated string in Diplomacy message'
-        else: return Message(message)
+        else: return self.message(message)
+    @staticmethod
+    def message(tokens):
+        ''' Creates a Message from a list of tokens, without checking them.'''
+        result = Message()
+        list.extend(result, tokens)
+        return result
     
     def tokenize_quote(self, text):
         ''' Returns a list of tokens from a string within a quotation.
@@ -904,7 +1159,10 @@ class Representation(Configurable):
             >>> default_rep.tokenize_quote('name')
             [StringToken('n'), StringToken('a'), StringToken('m'), StringToken('e')]
         '''#'''
-        return [StringToken(c) for c in text]
+        # The value table fills the StringToken cache for every byte.
+        self.value_table()
+        try: return map(StringToken.cache.__getitem__, text)
+        except KeyError: return [StringToken(c) for c in text]
     
     def tokenize_normal(self, text):
         ''' Returns a list of tokens from a string without quotations.
@@ -915,12 +1173,32 @@ class Representation(Configurable):
                 ...
             KeyError: "unknown token 'NAME'"
         '''#'''
-        # Switch parentheses to three-character notation
-        text = text.replace('(', ' BRA ')
-        text = text.replace(')', ' KET ')
+        # Words already seen are looked up in bulk.
+        words = self.word_pattern.findall(text)
+        parsed = self.__parsed
+        try: return map(parsed.__getitem__, words)
+        except KeyError: pass
         
-        # Pass items into Token, converting integers if necessary
-        return [self[maybe_int(word.upper())] for word in text.split()]
+        table = self.table
+        result = []
+        for word in words:
+            token = parsed.get(word)
+            if token is None:
+                # Switch parentheses to three-character notation
+                if word == '(': key = 'BRA'
+                elif word == ')': key = 'KET'
+                else: key = maybe_int(word.upper())
+                
+                # Pass items into Token, converting integers if necessary
+                token = self[key]
+                
+                # Unknown tokens depend on the options, so aren't kept.
+                if (0 <= token < 0x10000 and table[token] is token
+                        and len(parsed) < 0x10000):
+                    parsed[word] = token
+            result.append(token)
+        return result
+    word_pattern = re.compile(r'[()]|[^\s()]+')
 
 
 class Protocol(VerboseObject):
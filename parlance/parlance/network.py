@@ -16,7 +16,7 @@ from time      import sleep
 
 from config    import VerboseObject
 from functions import any
-from language  import Message, Representation, protocol
+from language  import PackedMessage, Representation, protocol
 from tokens    import ADM, MDF, OFF, REJ, YES
 
 
@@ -56,6 +56,10 @@ class Connection(SocketWrapper):
         ('null_rm', bool, False, 'send empty representation messages',
             'Whether to send an empty RM for the standard map.',
             'The standard says yes, but that may be changed soon.'),
+        ('packed_messages', bool, False, 'keep incoming messages packed',
+            'Whether to pass incoming diplomatic messages along as',
+            'PackedMessage objects, decoding tokens only when they are used.',
+            'Useful for programs that mostly forward or archive messages.'),
     )
     
     def __init__(self):
@@ -167,10 +171,22 @@ class Connection(SocketWrapper):
     def unpack_message(self, data):
         ''' Produces a Message from a string of token numbers.
             Uses values in the representation, if available.
+            With the packed_messages option, the result is a PackedMessage,
+            and tokens are checked by number without being decoded;
+            only numbers missing from the representation are looked up.
         '''#'''
         try:
-            result = Message([self.rep[x]
-                for x in unpack('!' + 'H'*(len(data)//2), data)])
+            packed = PackedMessage(data, self.rep)
+            if self.options.packed_messages:
+                result = packed
+                numbers = set(packed.numbers)
+                table = self.rep.table
+                for number in numbers:
+                    if table[number] is None: self.rep[number]
+                categories = set(number >> 8 for number in numbers)
+            else:
+                result = packed.message()
+                categories = set(token.category for token in result)
         except ValueError:
             # Someone foolishly chose to disconnect over an unknown token.
             self.send_error(self.proto.IllegalToken)
@@ -178,7 +194,8 @@ class Connection(SocketWrapper):
         else:
             # Tokens in the "Reserved for AI use" category
             # must never be sent over the wire.
-            if any('Reserved' in token.category_name() for token in result):
+            if any('Reserved' in self.proto.token_cats.get(category, '')
+                    for category in categories):
                 self.send_error(self.proto.IllegalToken)
                 result = None
         return result
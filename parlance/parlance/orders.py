@@ -9,11 +9,12 @@ r'''Parlance unit orders
     the Artistic License 2.0, as published by the Perl Foundation.
 '''#'''
 
+from array       import array
 from itertools   import chain
 from operator    import lt, gt
 
 from functions   import Comparable, all, any, autosuper, defaultdict
-from gameboard   import Coast, Power, Turn, Unit
+from gameboard   import Coast, ConvoyIndex, Power, Turn, Unit
 from language    import Message
 from tokens      import *
 
@@ -36,6 +37,7 @@ __all__ = [
     'BuildOrder',
     'RemoveOrder',
     'OrderSet',
+    'OrderTable',
 ]
 
 class UnitOrder(Comparable):
@@ -502,6 +504,16 @@ def createUnitOrder(order, nation, board, datc):
     key = len(order) > 1 and 1 or 0
     return _class_types[order[key]].create(order, nation, board, datc)
 
+def author_key(nation):
+    ''' Returns the token for an order author, either a Power or a token.'''
+    return getattr(nation, 'key', nation)
+def remove_identical(items, item):
+    ''' Removes a particular object from a list, ignoring equal ones.'''
+    for index, other in enumerate(items):
+        if other is item:
+            del items[index]
+            break
+
 class OrderSet(defaultdict):
     ''' A mapping of Coast key -> UnitOrder, with special provisions for Waives.
         >>> Moscow = standard_map.spaces[MOS].unit
@@ -519,11 +531,26 @@ class OrderSet(defaultdict):
     def __init__(self, default_nation=None):
         super(OrderSet, self).__init__(list)
         self.default = default_nation
+        self.reset_indexes()
+    def reset_indexes(self):
+        ''' Empties the secondary indexes, which are kept up to date
+            by add() and discard():
+                - authored:  Lists of orders, keyed by author token
+                - latest:    The last order for each (unit key, author token)
+                - owned:     Sets of keys of units ordered by their owners,
+                             keyed by power token
+                - provinces: Number of orders for units in each province
+        '''#'''
+        self.authored = defaultdict(list)
+        self.latest = {}
+        self.owned = defaultdict(set)
+        self.provinces = defaultdict(int)
+        self.size = 0
     def __len__(self):
         ''' Primarily to allow "if order_set:" to work as expected,
             but also makes iteration slightly more efficient.
         '''#'''
-        return sum([len(orders) for orders in self.itervalues()])
+        return self.size
     def __iter__(self):
         ''' Allows the construction "for order in order_set:" '''
         return chain(*self.values())
@@ -536,17 +563,43 @@ class OrderSet(defaultdict):
                 (nation, ', '.join(map(str, orders)))
             for nation, orders in nations.iteritems()])
     def __copy__(self):
-        # Inefficient, but it works much better than straight copy() does.
         result = OrderSet(self.default)
-        for order in self:
-            item = order.unit or order.nation
-            result[item.key].append(order)
+        for order in self: result.add(order, order.__author)
         return result
     
     def add(self, order, nation=None):
         order.__author = nation or self.default or (order.unit or order).nation
         item = order.unit or order.nation
         self[item.key].append(order)
+        author = author_key(order.__author)
+        self.authored[author].append(order)
+        unit = order.unit
+        if unit:
+            self.latest[(unit.key, author)] = order
+            if author == unit.nation.key: self.owned[author].add(unit.key)
+            self.provinces[unit.coast.province.key] += 1
+        self.size += 1
+    def discard(self, order):
+        ''' Removes an order object from the set and its indexes.'''
+        item = order.unit or order.nation
+        order_list = self[item.key]
+        author = author_key(order.__author)
+        remove_identical(order_list, order)
+        remove_identical(self.authored[author], order)
+        unit = order.unit
+        if unit:
+            key = (unit.key, author)
+            if self.latest.get(key) is order:
+                # Fall back to the previous order from the same author
+                for other in reversed(order_list):
+                    if author_key(other.__author) == author:
+                        self.latest[key] = other
+                        break
+                else:
+                    del self.latest[key]
+                    self.owned[author].discard(unit.key)
+            self.provinces[unit.coast.province.key] -= 1
+        self.size -= 1
     def remove(self, order, nation=None):
         ''' Attempt to remove a specific order.
             Returns the actual order removed, or None if it wasn't found.
@@ -568,10 +621,10 @@ class OrderSet(defaultdict):
             { ENG: Fleet London -> English Channel }
         '''#'''
         author = nation or self.default
-        order_list = self[(order.unit or order.nation).key]
-        for index, item in enumerate(order_list):
+        for item in self[(order.unit or order.nation).key]:
             if item == order and (item.__author == author or not author):
-                return order_list.pop(index)
+                self.discard(item)
+                return item
         return None
     def waive(self, number, nation=None):
         for dummy in range(number):
@@ -585,13 +638,14 @@ class OrderSet(defaultdict):
         if result: return SUB % sorted(result)
         return None
     def order_list(self, nation=None):
-        if nation: return [o for o in self if o.__author == nation]
+        if nation: return list(self.authored.get(author_key(nation), ()))
         else: return list(self)
     def clear(self, nation=None):
         if nation:
-            for key, orders in self.items():
-                self[key] = [o for o in orders if o.__author != nation]
-        else: dict.clear(self)
+            for order in self.order_list(nation): self.discard(order)
+        else:
+            dict.clear(self)
+            self.reset_indexes()
     
     def holding(self): return [o for o in self if o.is_holding()]
     def moving_into(self, province):
@@ -601,18 +655,12 @@ class OrderSet(defaultdict):
         result = self.get_order(unit)
         return result and result.is_moving()
     def has_order(self, province):
-        for order in self:
-            if order.unit and order.unit.coast.province == province:
-                return True
-        else: return False
+        return self.provinces.get(province.key, 0) > 0
     def get_order(self, unit):
         ''' Find the "best" order for a given unit.
             Currently returns the last order given by the unit's owner.
         '''#'''
-        result = None
-        for order in self[unit.key]:
-            if order.__author == unit.nation: result = order
-        return result
+        return self.latest.get((unit.key, unit.nation.key))
     
     def builds_remaining(self, power):
         ''' Counts the number of builds the power still needs to order,
@@ -671,6 +719,31 @@ class OrderSet(defaultdict):
         if   surplus > 0: return -max(0, surplus - len(removes))
         elif surplus < 0: return -min(0, surplus + len(builds) + waives)
         return 0
+    def missing_count(self, phase, nation=None):
+        ''' Counts the orders the power still needs for the phase:
+            units without orders from their owner in movement and retreat
+            phases, or builds or removals in build phases.
+            The owned index makes this linear in the power's units,
+            regardless of how many orders have been submitted.
+        '''#'''
+        units, surplus = self.unordered(phase, nation)
+        return len(units) + abs(surplus)
+    def unordered(self, phase, nation=None):
+        ''' Returns the units still needing orders from the power,
+            and the number of removals (positive) or builds (negative)
+            it still owes.  Phases without orders need neither.
+        '''#'''
+        power = nation or self.default
+        ordered = self.owned.get(power.key, ())
+        if phase == Turn.move_phase:
+            return [unit for unit in power.units
+                if unit.key not in ordered], 0
+        elif phase == Turn.retreat_phase:
+            return [unit for unit in power.units
+                if unit.dislodged and unit.key not in ordered], 0
+        elif phase == Turn.build_phase:
+            return [], -self.builds_remaining(power)
+        else: return [], 0
     def missing_orders(self, phase, nation=None):
         ''' Returns the MIS message for the power,
             or None if no orders are required.
@@ -701,19 +774,10 @@ class OrderSet(defaultdict):
             # Restore original map
             >>> standard_map.restart()
         '''#'''
-        power = nation or self.default
-        if phase == Turn.move_phase:
-            result = [unit.key for unit in power.units
-                if not self.get_order(unit)]
-            if result: return MIS % result
-        elif phase == Turn.retreat_phase:
-            result = [unit for unit in power.units
-                if unit.dislodged and not self.get_order(unit)]
-            if result: return MIS % result
-        elif phase == Turn.build_phase:
-            surplus = -self.builds_remaining(power)
-            if surplus: return MIS(surplus)
-        else: raise NotImplementedError
+        units, surplus = self.unordered(phase, nation)
+        if phase == Turn.move_phase: units = [unit.key for unit in units]
+        if units: return MIS % units
+        elif surplus: return MIS(surplus)
         return None
     def complete_set(self, board):
         ''' Fills out the order set with default orders for the phase.
@@ -741,3 +805,258 @@ class OrderSet(defaultdict):
             if not self.has_key(unit.coast.key):
                 self.add(RemoveOrder(unit), power)
                 surplus -= 1
+
+class OrderTable(object):
+    ''' A numbering of every order that could be legal on a map,
+        used to list legal orders without testing each candidate.
+        Built once for each map definition, and shared by every Map
+        defined by the same MDF message.
+        
+        Orders for each coast are numbered contiguously, in the order
+        HLD, MTO, SUP, CVY, CTO, RTO, DSB, REM, followed by the BLD
+        and WVE orders for each power; spans gives the range for each.
+        Supports and convoys are listed for each pair of provinces
+        that could possibly be connected, so some will never be legal.
+        
+        >>> table = OrderTable.get(standard_map)
+        >>> choices, mask = table.legal_orders(standard_map)
+        >>> Moscow = standard_map.spaces[MOS].unit
+        >>> for number in choices[Moscow.key]:
+        ...     print Message(table.create_order(number, standard_map))
+        ... 
+        ( RUS AMY MOS ) HLD
+        ( RUS AMY MOS ) MTO UKR
+        ( RUS AMY MOS ) MTO WAR
+        ( RUS AMY MOS ) MTO LVN
+        ( RUS AMY MOS ) MTO SEV
+        ( RUS AMY MOS ) MTO STP
+        ( RUS AMY MOS ) SUP ( RUS AMY WAR )
+        ( RUS AMY MOS ) SUP ( RUS FLT SEV )
+        ( RUS AMY MOS ) SUP ( RUS FLT ( STP SCS ) )
+        ( RUS AMY MOS ) SUP ( RUS AMY WAR ) MTO UKR
+        ( RUS AMY MOS ) SUP ( RUS AMY WAR ) MTO LVN
+        ( RUS AMY MOS ) SUP ( RUS FLT ( STP SCS ) ) MTO LVN
+        >>> sum(mask) == sum([len(numbers) for numbers in choices.values()])
+        True
+    '''#'''
+    tables = {}
+    
+    @classmethod
+    def get(klass, board):
+        ''' Returns the table for the board's map definition.'''
+        table = klass.tables.get(board.mdf_key)
+        if table is None:
+            table = klass.tables[board.mdf_key] = klass(board)
+        return table
+    
+    def __init__(self, board):
+        self.index = index = ConvoyIndex.get(board)
+        seas = index.mask(index.seas)
+        self.reach = dict((key, frozenset([place[1]
+                for place in coast.borders_out]))
+            for key, coast in board.coasts.iteritems())
+        
+        # Armies that could be convoyed, and where
+        coastal = [key for key in board.province_keys
+            if board.spaces[key].is_coastal()
+            and (AMY, key, None) in board.coasts]
+        self.convoy_dests = dict((origin, [dest for dest in coastal
+                if dest != origin and index.has_route(origin, dest, seas)])
+            for origin in coastal)
+        sources = defaultdict(list)
+        for origin, dests in self.convoy_dests.iteritems():
+            for dest in dests: sources[dest].append(origin)
+        
+        self.actions = []
+        self.spans = {}
+        self.holds = {}
+        self.moves = {}
+        self.supports = {}
+        self.support_moves = {}
+        self.convoys = {}
+        self.convoyed = {}
+        self.retreats = {}
+        self.disbands = {}
+        self.removes = {}
+        self.builds = {}
+        self.waives = {}
+        for key in board.coast_keys:
+            coast = board.coasts[key]
+            home = key[1]
+            start = len(self.actions)
+            self.holds[key] = self.number((key, HLD))
+            dests = sorted(coast.borders_out)
+            self.moves[key] = [self.number((key, MTO, dest)) for dest in dests]
+            self.supports[key] = dict((prov, self.number((key, SUP, prov)))
+                for prov in sorted(self.reach[key]))
+            self.support_moves[key] = moves = {}
+            for prov in sorted(self.reach[key]):
+                movers = set(board.spaces[prov].borders_in)
+                movers.update(sources.get(prov, ()))
+                movers.discard(home)
+                movers.discard(prov)
+                for mover in sorted(movers):
+                    moves[(mover, prov)] = self.number(
+                        (key, SUP, mover, MTO, prov))
+            self.convoys[key] = convoys = {}
+            if key[0] == FLT and coast.province.can_convoy():
+                for origin in coastal:
+                    for dest in self.convoy_dests[origin]:
+                        convoys[(origin, dest)] = self.number(
+                            (key, CVY, origin, CTO, dest))
+            self.convoyed[key] = dict((dest, self.number((key, CTO, dest)))
+                for dest in self.convoy_dests.get(home, ())
+                if key[0] == AMY)
+            self.retreats[key] = dict((board.coasts[dest].maybe_coast,
+                    self.number((key, RTO, dest)))
+                for dest in dests)
+            self.disbands[key] = self.number((key, DSB))
+            self.removes[key] = self.number((key, REM))
+            self.spans[key] = (start, len(self.actions))
+        for power in board.power_keys:
+            start = len(self.actions)
+            self.builds[power] = dict((key, self.number((power, BLD, key)))
+                for key in board.coast_keys
+                if power in (board.spaces[key[1]].homes or ()))
+            self.waives[power] = self.number((power, WVE))
+            self.spans[power] = (start, len(self.actions))
+        self.numbers = dict((action, number)
+            for number, action in enumerate(self.actions))
+    def number(self, action):
+        self.actions.append(action)
+        return len(self.actions) - 1
+    def __len__(self): return len(self.actions)
+    
+    def legal_orders(self, board):
+        ''' Lists the legal orders for the current phase of the board.
+            Returns a dictionary of sorted arrays of order numbers,
+            keyed by unit key for movement and retreat phases, and by
+            power token for build phases, along with a byte array
+            marking every legal order number with a 1.
+            The arrays support the buffer interface, so they can be
+            wrapped by numpy.frombuffer() without copying.
+        '''#'''
+        choices = {}
+        phase = board.current_turn.phase()
+        if phase == Turn.move_phase: self.movement_choices(board, choices)
+        elif phase == Turn.retreat_phase:
+            for unit in board.units:
+                if unit.dislodged:
+                    key = unit.coast.key
+                    retreats = self.retreats[key]
+                    choices[unit.key] = [self.disbands[key]] + [retreats[place]
+                        for place in unit.retreats if place in retreats]
+        elif phase == Turn.build_phase:
+            for token, power in board.powers.iteritems():
+                surplus = power.surplus()
+                if surplus < 0:
+                    result = [self.waives[token]]
+                    for key, number in self.builds[token].iteritems():
+                        province = board.spaces[key[1]]
+                        if province.owner == power and not province.units:
+                            result.append(number)
+                    choices[token] = result
+                elif surplus > 0:
+                    choices[token] = [self.removes[unit.coast.key]
+                        for unit in power.units]
+        
+        mask = array('B', [0]) * len(self.actions)
+        for key, numbers in choices.items():
+            numbers.sort()
+            for number in numbers: mask[number] = 1
+            choices[key] = array('I', numbers)
+        return choices, mask
+    def movement_choices(self, board, choices):
+        index = self.index
+        fleets = index.fleets(board)
+        occupied = dict((unit.coast.province.key, unit)
+            for unit in board.units)
+        routes = {}
+        for origin, unit in occupied.iteritems():
+            if unit.can_be_convoyed():
+                for dest in self.convoy_dests[origin]:
+                    if index.has_route(origin, dest, fleets):
+                        routes[(origin, dest)] = index.routes(origin,
+                            dest, fleets)
+        
+        for home, unit in occupied.iteritems():
+            key = unit.coast.key
+            result = [self.holds[key]] + self.moves[key]
+            for prov, number in self.supports[key].iteritems():
+                if prov in occupied: result.append(number)
+            for (mover, prov), number in self.support_moves[key].iteritems():
+                supported = occupied.get(mover)
+                if supported is None: continue
+                if prov in self.reach[supported.coast.key]:
+                    result.append(number)
+                elif [route for route in routes.get((mover, prov), ())
+                        if home not in route]:
+                    result.append(number)
+            if unit.can_convoy():
+                convoys = self.convoys[key]
+                for pair, path_list in routes.iteritems():
+                    if pair in convoys and [route for route in path_list
+                            if home in route]:
+                        result.append(convoys[pair])
+            for dest, number in self.convoyed[key].iteritems():
+                if (home, dest) in routes: result.append(number)
+            choices[unit.key] = result
+    
+    def create_order(self, number, board):
+        ''' Creates a UnitOrder for an order number,
+            using the units currently on the board.
+            Returns None if the unit to be ordered is missing.
+        '''#'''
+        action = self.actions[number]
+        order_type = action[1]
+        if order_type is WVE: return WaiveOrder(board.powers[action[0]])
+        elif order_type is BLD:
+            return BuildOrder(Unit(board.powers[action[0]],
+                board.coasts[action[2]]))
+        
+        unit = self.unit_at(board, action[0], order_type in (RTO, DSB))
+        if unit is None: return None
+        if order_type is HLD: result = HoldOrder(unit)
+        elif order_type is MTO:
+            result = MoveOrder(unit, board.coasts[action[2]])
+        elif order_type is RTO:
+            result = RetreatOrder(unit, board.coasts[action[2]])
+        elif order_type is DSB: result = DisbandOrder(unit)
+        elif order_type is REM: result = RemoveOrder(unit)
+        elif order_type is CTO:
+            dest = board.coasts[(AMY, action[2], None)]
+            result = ConvoyedOrder(unit, dest)
+            result.routes = unit.coast.convoy_routes(dest.province, board)
+        else:
+            supported = board.spaces[action[2]].unit
+            if supported is None: return None
+            if order_type is CVY:
+                dest = board.coasts[(AMY, action[4], None)]
+                result = ConvoyingOrder(unit, supported, dest)
+                result.routes = supported.coast.convoy_routes(dest.province,
+                    board)
+            elif len(action) > 3:
+                province = board.spaces[action[4]]
+                dest = self.support_coast(supported, province)
+                result = SupportMoveOrder(unit, supported, dest)
+                if not supported.can_move_to(province):
+                    result.routes = supported.coast.convoy_routes(province,
+                        board)
+            else: result = SupportHoldOrder(unit, supported)
+        return result
+    def support_coast(self, unit, province):
+        ''' Finds the coast of a supported move,
+            as the judge would for an order without a coastline.
+        '''#'''
+        possible = [coast for coast in province.coasts
+            if coast.unit_type == unit.coast.unit_type]
+        if len(possible) != 1:
+            possible = [coast for coast in possible
+                if coast.key in unit.coast.borders_out]
+        if len(possible) == 1: return possible[0]
+        return Coast(None, province, None, [])
+    def unit_at(self, board, key, dislodged):
+        for unit in board.spaces[key[1]].units:
+            if unit.coast.key == key and bool(unit.dislodged) == dislodged:
+                return unit
+        return None
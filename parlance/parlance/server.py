@@ -20,7 +20,7 @@ from gameboard  import Turn
 from language   import Message, Time, protocol
 from player     import HoldBot
 from tokens     import *
-from validation import Validator
+from validation import Validator, find_ket
 
 class Command(object):
     def __init__(self, pattern, callback, help):
@@ -423,8 +423,7 @@ class Historian(VerboseObject):
         rep = protocol.base_rep
         history = {}
         messages = {}
-        for line in stream:
-            message = rep.translate(line)
+        for message in rep.translate_many(stream):
             self.log_debug(13, 'Loading "%s" from game log.', message)
             first = message[0]
             if first in (ORD, SET):
@@ -1014,13 +1013,19 @@ class Game(Historian):
                             client.client_id)
                     pass
             else:
-                press = Message(folded[2 + offset])
+                # The press is sliced from the message itself, so that
+                # packed press is forwarded without being decoded.
+                start = 1
+                for group in folded[1:2 + offset]:
+                    start += find_ket(message[start:]) + 1
+                press = message[start + 1:start + find_ket(message[start:])]
+                if isinstance(press, list): press = Message(press)
                 # Send OUT if any power in press is eliminated
                 for nation in eliminated:
                     if nation in press:
                         client.send(OUT(nation)(message))
                         return
-                self.validator.trim(press)
+                press = self.validator.trim(press)
                 outgoing = FRM(country)(recips)(press)
                 for nation in recips:
                     # Hope that nobody disappears here...
@@ -1384,6 +1389,27 @@ class Game(Historian):
         else:
             self.queue_action(client, self.close, 'ending the game.',
                     None, 'ending the game.', ('end', 'close'))
+    def judge_stats(self, client, match):
+        stats = getattr(self.judge, 'stats', None)
+        record = stats and stats.last()
+        if not record:
+            client.admin('No adjudication statistics are available.')
+            return
+        totals = stats.totals()
+        for name, summary in (('Last phase (%s)' % record['turn'], record),
+                ('Whole game (%d phase%s)' % (totals['phases'],
+                    s(totals['phases'])), totals)):
+            client.admin('%s: %.3f seconds, %d orders, %d decisions, '
+                '%d calculations in %d passes, %d paradoxes, %d convoy routes',
+                name, sum(summary['time'].values()), summary['orders'],
+                sum(summary['decisions'].values()), summary['calculations'],
+                summary['passes'], summary['paradoxes'], summary['routes'])
+            if summary['time']:
+                client.admin('  Time: %s', ', '.join(['%s %.3f' % item
+                    for item in sorted(summary['time'].items())]))
+            if summary['rules']:
+                client.admin('  Paradox rules: %s', ', '.join(['%s %d' % item
+                    for item in sorted(summary['rules'].items())]))
     def veto_admin(self, client, match):
         word = match.group(2)
         if word: actions = [a for a in self.actions if word in a.terms]
@@ -1412,6 +1438,8 @@ class Game(Historian):
             '  eject <player> - Disconnect <player> (either name or country) from the game'),
         Command(r'end game', end_game,
             '  end game - Ends the game (without a winner)'),
+        Command(r'judge stat(istic)?s', judge_stats,
+            '  judge stats - Reports adjudication times and decision counts'),
         Command(r'start (an? )?(\w+) as (\w+)', start_bot,
             '  start <bot> as <country> - Start a copy of <bot> to play <country>'),
         Command(r'start (an? |\d+ )?(\w+)()', start_bot,
@@ -0,0 +1,157 @@
+r'''Test cases for the Parlance adjudication benchmarks
+    Copyright (C) 2004-2008  Eric Wald
+    
+    This module tests the benchmark harness, though not the speed
+    of the judge itself.
+    
+    Parlance may be used, modified, and/or redistributed under the terms of
+    the Artistic License 2.0, as published by the Perl Foundation.
+'''#'''
+
+import sys
+import unittest
+from os import close, remove
+from StringIO import StringIO
+from tempfile import mkstemp
+
+from parlance.benchmark import AdjudicationBenchmark, FoldBenchmark, \
+        StartupBenchmark, TranslateBenchmark, bounce_position, \
+        convoy_chain_position, full_board_position, sample_messages
+from parlance.config    import Configuration
+from parlance.test      import datc
+from parlance.test.datc import datc_positions
+from parlance.tokens    import *
+from parlance.xtended   import *
+
+class BenchmarkTestCase(unittest.TestCase):
+    ''' Positions and measurements for judge benchmarks'''
+    def setUp(self):
+        Configuration.set_globally('verbosity', 0)
+    def results(self, position):
+        return [message.fold()[2:] for message in
+                position.prepare().move_algorithm()]
+    
+    def test_datc_positions(self):
+        positions = datc_positions('DATC_6_A')
+        names = [position.name for position in positions]
+        self.failUnless('DATC_6_A.6A5' in names)
+        self.failIf('DATC_6_A.6A1' in names)
+    def test_datc_replay(self):
+        ''' Replayed DATC positions get the same results.'''
+        position = [position for position in datc_positions('DATC_6_A')
+                if position.name == 'DATC_6_A.6A5'][0]
+        results = self.results(position)
+        self.failUnless([[[GER, FLT, LON], MTO, YOR], [SUC]] in results)
+        self.failUnless([[[ENG, AMY, YOR], HLD], [RET]] in results)
+    def test_datc_failures(self):
+        ''' Failing cases are torn down and keep their positions,
+            but other errors are raised.
+        '''#'''
+        torn = []
+        class DATC_Broken(datc.DiplomacyAdjudicatorTestCase):
+            def tearDown(self): torn.append(self.id())
+            def test_failure(self):
+                self.init_state(SPR, 1901, [[ENG, AMY, LON]])
+                self.assertMapState([[ENG, AMY, YOR]])
+            def test_zerror(self): raise KeyError('broken')
+        datc.DATC_Broken = DATC_Broken
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            self.failUnlessRaises(KeyError, datc_positions, 'DATC_Broken')
+            self.failUnlessEqual(len(torn), 2)
+            del DATC_Broken.test_zerror
+            positions = datc_positions('DATC_Broken')
+        finally:
+            output, sys.stdout = sys.stdout, stdout
+            del datc.DATC_Broken
+        self.failUnlessEqual([position.name for position in positions],
+                ['DATC_Broken.failure'])
+        self.failUnless(output.getvalue().startswith(
+                'DATC case DATC_Broken.failure failed: '))
+    def test_full_board(self):
+        position = full_board_position('standard', 1)
+        board = position.prepare().map
+        self.failUnlessEqual(len(list(board.units)), 34)
+        self.failUnlessEqual(len(self.results(position)), 34)
+    def test_full_board_seed(self):
+        self.failUnlessEqual(full_board_position('standard', 2).submissions,
+                full_board_position('standard', 2).submissions)
+    def test_bounce(self):
+        results = self.results(bounce_position('standard', [BUR]))
+        self.failUnlessEqual(len(results), 7)
+        for order, result in results: self.failUnlessEqual(result, [BNC])
+    def test_convoy_chain(self):
+        results = self.results(convoy_chain_position())
+        self.failUnless([[[ENG, AMY, LVP], CTO, SYR, VIA,
+            [IRI, MAO, WES, TYS, ION, EAS]], [DSR]] in results)
+        self.failUnless([[[ITA, FLT, NAP], MTO, TYS], [SUC]] in results)
+    
+    def test_measure(self):
+        result = AdjudicationBenchmark(3).measure(convoy_chain_position())
+        self.failUnless(result['ops'] > 0)
+        self.failUnless(result['p50'] <= result['p90'] <= result['p99'])
+        self.failUnless(result['decisions'] > 0)
+    def test_compare(self):
+        benchmark = AdjudicationBenchmark(1)
+        benchmark.options.benchmark_tolerance = .5
+        baseline = {'fast': {'p50': .01}, 'slow': {'p50': .01}}
+        results = {'fast': {'p50': .012}, 'slow': {'p50': .02},
+            'new': {'p50': .5}}
+        self.failUnlessEqual(benchmark.compare(results, baseline),
+                [('slow', 2.0)])
+    def test_baseline_file(self):
+        benchmark = AdjudicationBenchmark(2)
+        results = benchmark.run([convoy_chain_position()])
+        handle, filename = mkstemp()
+        close(handle)
+        try:
+            benchmark.save(results, filename)
+            baseline = benchmark.load(filename)
+        finally: remove(filename)
+        self.failUnlessEqual(sorted(baseline), ['synthetic.convoy_chain'])
+        self.failUnlessEqual(benchmark.compare(results, baseline), [])
+    def test_missing_baseline(self):
+        benchmark = AdjudicationBenchmark(1)
+        self.failUnlessEqual(benchmark.load('/nonexistent/baseline'), None)
+    def test_report(self):
+        benchmark = AdjudicationBenchmark(1)
+        results = benchmark.run([convoy_chain_position()])
+        lines = benchmark.report(results, results)
+        self.failUnless(lines[0].startswith('synthetic.convoy_chain'))
+        self.failUnless(lines[0].endswith('+0%'))
+        self.failUnless(lines[-1].startswith('1 position, '))
+    
+    def test_fold(self):
+        messages = [item for item in sample_messages()
+            if item[0].startswith('mini.')]
+        benchmark = FoldBenchmark(1)
+        results = benchmark.run(messages)
+        self.failUnlessEqual(sorted(results),
+                ['mini.MDF', 'mini.NOW', 'mini.SCO', 'mini.SMR'])
+        lines = benchmark.report(results)
+        self.failUnlessEqual(len(lines), 4)
+        self.failUnless(lines[0].startswith('mini.MDF '))
+    def test_translate(self):
+        messages = [item for item in sample_messages()
+            if item[0].startswith('mini.')]
+        results = TranslateBenchmark(1).run(messages)
+        self.failUnlessEqual(results.keys(), ['mini'])
+        self.failUnlessEqual(results['mini']['lines'], 4)
+        self.failUnless(results['mini']['translate_many'] > 0)
+    
+    def test_startup(self):
+        benchmark = StartupBenchmark(1)
+        result = benchmark.measure('pass')
+        self.failUnless(0 < result['min'] <= result['p50'])
+    def test_startup_report(self):
+        benchmark = StartupBenchmark(1)
+        results = {
+            'interpreter': {'p50': .01, 'min': .01, 'mean': .01},
+            'tokens': {'p50': .05, 'min': .04, 'mean': .05},
+        }
+        lines = benchmark.report(results)
+        self.failUnlessEqual(len(lines), 2)
+        self.failUnless(lines[1].startswith('tokens '))
+        self.failUnless(lines[1].endswith('(+40.0 ms)'))
+
+if __name__ == '__main__': unittest.main()
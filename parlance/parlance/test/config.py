@@ -0,0 +1,75 @@
+r'''Test cases for Parlance configuration and logging
+    Copyright (C) 2004-2008  Eric Wald
+    
+    This module tests the logging system shared by configurable objects.
+    
+    Parlance may be used, modified, and/or redistributed under the terms of
+    the Artistic License 2.0, as published by the Perl Foundation.
+'''#'''
+
+import sys
+import unittest
+from StringIO import StringIO
+
+from parlance.config    import VerboseObject
+from parlance.functions import lazy
+
+class Logger(VerboseObject):
+    prefix = 'Logger'
+
+class LoggingTestCase(unittest.TestCase):
+    "Tests for lazy logging and the trace buffer"
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = self.output = StringIO()
+        self.logger = Logger()
+        self.logger.options.verbosity = 5
+        self.logger.options.log_file = ''
+        self.logger.options.log_limits = []
+        self.logger.options.trace_size = 0
+        VerboseObject.clear_trace()
+        self.calls = []
+    def tearDown(self):
+        VerboseObject.clear_trace()
+        sys.stdout = self.stdout
+    def lines(self):
+        return self.output.getvalue().splitlines()
+    def expensive(self):
+        self.calls.append(True)
+        return 'expensive'
+    
+    def test_log_written(self):
+        self.logger.log_debug(5, 'Line %d: %s', 1, lazy(self.expensive))
+        self.failUnlessEqual(self.lines(), ['Logger: Line 1: expensive'])
+    def test_lazy_skipped(self):
+        self.logger.log_debug(6, 'Line %d: %s', 1, lazy(self.expensive))
+        self.failUnlessEqual(self.lines(), [])
+        self.failIf(self.calls)
+    def test_debugging(self):
+        self.failUnless(self.logger.debugging(5))
+        self.failIf(self.logger.debugging(6))
+    def test_module_limit(self):
+        self.logger.options.log_limits = ['judge:9', 'config:3']
+        self.failUnless(self.logger.debugging(3))
+        self.failIf(self.logger.debugging(4))
+        self.logger.log_debug(4, 'Limited')
+        self.failUnlessEqual(self.lines(), [])
+    def test_other_module_limit(self):
+        self.logger.options.log_limits = ['judge:1']
+        self.failUnless(self.logger.debugging(5))
+    def test_trace(self):
+        self.logger.options.trace_size = 2
+        self.logger.options.trace_level = 10
+        for number in range(4): self.logger.log_debug(8, 'Line %d', number)
+        self.failUnlessEqual(VerboseObject.traced_lines(),
+                ['Logger: Line 2', 'Logger: Line 3'])
+        self.failUnlessEqual(self.lines(), [])
+    def test_trace_level(self):
+        self.logger.options.trace_size = 5
+        self.logger.options.trace_level = 7
+        self.failUnless(self.logger.debugging(7))
+        self.logger.log_debug(8, '%s', lazy(self.expensive))
+        self.failIf(self.calls)
+        self.failUnlessEqual(VerboseObject.traced_lines(), [])
+
+if __name__ == '__main__': unittest.main()
@@ -9,7 +9,9 @@ r'''DATC test cases for the Parlance judge
 '''#'''
 
 import unittest
+from unittest import TestLoader
 
+from parlance.benchmark import Position, run, synthetic_positions
 from parlance.config    import Configuration, GameOptions, variants
 from parlance.functions import fails
 from parlance.language  import Message
@@ -5293,4 +5295,59 @@ class DATC_6_J(DiplomacyAdjudicatorTestCase):
         ])
         self.assertMapState(steady_state)
 
+def datc_positions(prefix='DATC'):
+    ''' Collects every movement phase run by the DATC test cases
+        in classes whose names start with the prefix.
+        Each test is run once; the position and orders are recorded
+        whenever the test asks its judge to adjudicate a movement phase.
+        Failing tests are reported, but keep the phases they recorded;
+        any other error is raised.
+    '''#'''
+    loader = TestLoader()
+    options = dict(Configuration._cache)
+    positions = []
+    for class_name in sorted(globals()):
+        klass = globals()[class_name]
+        if not (isinstance(klass, type) and class_name.startswith(prefix)):
+            continue
+        for method in loader.getTestCaseNames(klass):
+            case = klass(method)
+            case.setUp()
+            judge = case.judge
+            name = '%s.%s' % (class_name, method[5:])
+            recorded = []
+            def record(run=judge.run, judge=judge, recorded=recorded):
+                turn = judge.map.current_turn
+                if judge.phase == turn.move_phase:
+                    submissions = []
+                    for country in sorted(judge.map.powers):
+                        message = judge.next_orders.create_SUB(country)
+                        if message: submissions.append((country, message))
+                    recorded.append((judge.map.create_NOW(), submissions))
+                return run()
+            judge.run = record
+            try:
+                try: getattr(case, method)()
+                except case.failureException, error:
+                    print 'DATC case %s failed: %s' % (name, error)
+            finally:
+                del judge.run
+                case.tearDown()
+            for index, (board_state, submissions) in enumerate(recorded):
+                if index: label = '%s.%d' % (name, index + 1)
+                else: label = name
+                positions.append(Position(label, judge,
+                        board_state, submissions))
+    
+    # Keep the game options of the last test out of later judges
+    Configuration._cache.clear()
+    Configuration._cache.update(options)
+    return positions
+
+def benchmark():
+    ''' Runs the adjudication benchmark on the DATC positions
+        as well as the synthetic ones.
+    '''#'''
+    run(datc_positions() + synthetic_positions())
+
 if __name__ == '__main__': unittest.main()
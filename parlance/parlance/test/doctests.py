@@ -12,6 +12,7 @@ def _test():
     import doctest
     import sys
     
+    from parlance import benchmark
     from parlance import functions
     from parlance import gameboard
     from parlance import language
@@ -21,6 +22,7 @@ def _test():
     
     # List of modules to test
     modules = [
+        benchmark,
         functions,
         gameboard,
         language,
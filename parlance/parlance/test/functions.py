@@ -12,7 +12,10 @@ import unittest
 
 from parlance.config import EntryPointContainer
 from parlance.player import HoldBot
-from parlance.language import Representation, protocol
+from parlance.language import IntegerToken, Message, PackedMessage, \
+        Representation, StringToken, protocol
+from parlance.tokens import BRA, GOF, HLO, KET, NME, NOT, SCO, UNO
+from parlance.xtended import ENG, standard
 
 class EntryPointTestCase(unittest.TestCase):
     def setUp(self):
@@ -54,5 +57,140 @@ class RepresentationTests(unittest.TestCase):
         second = {"ONE": 0x4A00}
         self.failUnlessEqual(first, second)
 
+class MessageFoldTests(unittest.TestCase):
+    "Test cases for folding messages into nested lists"
+    def assertFolds(self, message, expected):
+        self.failUnlessEqual(message.fold(), expected)
+        self.failUnlessEqual(standard.rep.fold_packed(message.pack()), expected)
+    def test_deep_nesting(self):
+        depth = 5000
+        message = Message([BRA] * depth + [UNO] + [KET] * depth)
+        folded = message.fold()
+        for dummy in range(depth): folded = folded[0]
+        self.failUnlessEqual(folded, [UNO])
+    def test_text_and_numbers(self):
+        self.assertFolds(NME('one')(-3)('two')(8191),
+                [NME, ['one'], [-3], ['two'], [8191]])
+    def test_extra_ket(self):
+        message = Message([SCO, BRA, UNO, KET, KET, BRA])
+        self.failUnlessRaises(ValueError, message.fold)
+        self.failUnlessRaises(ValueError,
+                standard.rep.fold_packed, message.pack())
+    def test_packed_map(self):
+        mdf = standard.mdf()
+        self.assertFolds(mdf, mdf.fold())
+        folded = standard.rep.fold_packed(mdf.pack())
+        self.failUnless(folded[1][0] is mdf.fold()[1][0])
+
+class PackedMessageTests(unittest.TestCase):
+    "Test cases for messages kept in their packed form"
+    def setUp(self):
+        self.message = standard.sco()
+        self.packed = PackedMessage(self.message.pack(), standard.rep)
+    def test_pack_unchanged(self):
+        data = self.message.pack()
+        self.failUnless(PackedMessage(data, standard.rep).pack() is data)
+    def test_pack_matches_struct(self):
+        from struct import pack
+        message = NME('one')(-3)
+        self.failUnlessEqual(message.pack(),
+                pack('!' + 'H' * len(message), *map(int, message)))
+    def test_tokens(self):
+        self.failUnlessEqual(len(self.packed), len(self.message))
+        self.failUnlessEqual(list(self.packed), self.message)
+        self.failUnless(self.packed[-1] is self.message[-1])
+    def test_message(self):
+        message = self.packed.message()
+        self.failUnless(isinstance(message, Message))
+        self.failUnlessEqual(message, self.message)
+        self.failUnlessEqual(str(self.packed), str(self.message))
+    def test_slice(self):
+        part = self.packed[2:7]
+        self.failUnless(isinstance(part, PackedMessage))
+        self.failUnlessEqual(part, self.message[2:7])
+        self.failUnlessEqual(self.packed[::2], self.message[::2])
+        self.failUnlessEqual(len(self.packed[7:2]), 0)
+    def test_fold(self):
+        self.failUnlessEqual(self.packed.fold(), self.message.fold())
+    def test_search(self):
+        self.failUnless(UNO in self.packed)
+        self.failIf(NME in self.packed)
+        self.failUnlessEqual(self.packed.index(BRA), self.message.index(BRA))
+        self.failUnlessEqual(self.packed.count(KET), self.message.count(KET))
+    def test_equality(self):
+        other = PackedMessage(self.message.pack(), standard.rep)
+        self.failUnlessEqual(self.packed, other)
+        self.failIf(self.packed != self.message)
+        self.failIfEqual(self.packed, other[1:])
+    def test_odd_length(self):
+        self.failUnlessRaises(ValueError, PackedMessage, 'abc')
+
+class RepresentationTableTests(unittest.TestCase):
+    "Test cases for looking up tokens by number"
+    def setUp(self):
+        self.rep = Representation({0x4101: 'STH', 0x4A00: 'ABC'},
+                protocol.default_rep)
+    def test_override(self):
+        self.failUnlessEqual(str(self.rep[0x4101]), 'STH')
+        self.failUnlessEqual(str(protocol.default_rep[0x4101]), 'ENG')
+    def test_base_tokens(self):
+        self.failUnless(self.rep[BRA.number] is BRA)
+        self.failUnless(self.rep['UNO'] is UNO)
+        self.failUnless(self.rep[0x4A00] is self.rep['ABC'])
+    def test_values(self):
+        self.failUnless(self.rep[5] is IntegerToken(5))
+        self.failUnless(self.rep[-5] is IntegerToken(-5))
+        self.failUnless(self.rep[0x4B41] is StringToken('A'))
+    def test_unknown(self):
+        unknown = self.rep[0x5A5A]
+        self.failUnlessEqual(str(unknown), '0x5A5A')
+        self.failUnlessEqual(self.rep.get('XYZ'), None)
+
+class TranslateTests(unittest.TestCase):
+    "Test cases for translating text into Messages"
+    def setUp(self):
+        self.rep = standard.rep
+        self.escape = self.rep.options.input_escape
+        self.rep.options.input_escape = '\\'
+    def tearDown(self):
+        self.rep.options.input_escape = self.escape
+    def test_round_trip(self):
+        for message in (standard.mdf(), standard.sco(), standard.now()):
+            self.failUnlessEqual(self.rep.translate(str(message)), message)
+    def test_words(self):
+        message = self.rep.translate('hlo(Eng)\t(-3 0)(bra ket)8191')
+        self.failUnlessEqual(message,
+                HLO(ENG)(-3, 0)([BRA, KET]) + [8191])
+        self.failUnless(isinstance(message, Message))
+    def test_repeated_words(self):
+        first = self.rep.translate('SCO ( ENG LON )')
+        second = self.rep.translate('sco ( eng lon )')
+        self.failUnlessEqual(first, second)
+        self.failUnless(second[2] is ENG)
+    def test_unknown_word(self):
+        self.failUnlessRaises(KeyError, self.rep.translate, 'NOT ( XYZ )')
+        self.failUnlessRaises(KeyError, self.rep.translate, 'NOT ( XYZ )')
+    def test_text(self):
+        message = self.rep.translate('NME ("a\\"b(c)") (" ")')
+        self.failUnlessEqual(message, NME('a"b(c)')(' '))
+    def test_doubled_quotes(self):
+        self.rep.options.input_escape = '"'
+        message = self.rep.translate('NME ("a""b") ("")')
+        self.failUnlessEqual(message, NME('a"b')(''))
+    def test_translate_many(self):
+        lines = ['HLO ( ENG ) ( 5 )', 'NOT ( GOF )', 'NME ( "x" )']
+        self.failUnlessEqual(list(self.rep.translate_many(lines)),
+                [self.rep.translate(line) for line in lines])
+        self.failUnlessEqual(list(self.rep.translate_many([])), [])
+    def test_translate_many_lazily(self):
+        read = []
+        def lines():
+            for line in ['HLO ( ENG ) ( 5 )', 'NOT ( GOF )']:
+                read.append(line)
+                yield line
+        messages = self.rep.translate_many(lines())
+        self.failUnlessEqual(messages.next(), HLO(ENG)(5))
+        self.failUnlessEqual(read, ['HLO ( ENG ) ( 5 )'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -10,16 +10,25 @@ r'''Test cases for the Parlance gameboard and unit orders
 
 import time
 import unittest
+from os import listdir, path
+from shutil import rmtree
+from subprocess import call
+from sys import executable
+from tempfile import mkdtemp
+from threading import Event, Thread
+from types import ModuleType
 
-from parlance.config     import variants
-from parlance.functions  import fails
-from parlance.gameboard  import Map, Province, Turn, Variant
+from parlance.config     import Configuration, variants
+from parlance.functions  import Infinity, all, fails
+from parlance.gameboard  import BoardState, ConvoyIndex, Map, Province, \
+        Turn, Unit, Variant, VariantCache, ZobristKeys
 from parlance.judge      import DatcOptions
-from parlance.language   import IntegerToken, Representation, protocol
+from parlance.language   import IntegerToken, Representation, Token, protocol
 from parlance.orders     import createUnitOrder
 from parlance.tokens     import *
 from parlance.validation import Validator
 from parlance.xtended    import *
+from parlance.xtended    import LazyModule
 
 def load_variant(information):
     variant = Variant("testing")
@@ -960,6 +969,323 @@ class StandardVariantTests(unittest.TestCase):
     def test_now_valid(self):
         self.failUnlessValid(variants[self.variant].sco())
 
+class VariantCacheTests(unittest.TestCase):
+    "Tests for the compiled variant files"
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.cache = VariantCache(self.directory)
+        self.variant = self.load()
+    def tearDown(self):
+        Configuration.set_globally('variant_cache', '')
+        rmtree(self.directory)
+    def load(self):
+        return Variant("standard", filename="parlance://data/standard.cfg")
+    def messages(self, variant):
+        return (variant.mdf(), variant.sco(), variant.now())
+    def test_missing(self):
+        self.failUnlessEqual(self.cache.load(self.variant), None)
+    def test_round_trip(self):
+        messages = self.messages(self.variant)
+        self.cache.store(self.variant, messages)
+        self.failUnlessEqual(self.cache.load(self.load()), messages)
+    def test_stale(self):
+        self.cache.store(self.variant, self.messages(self.variant))
+        variant = self.load()
+        variant.digest = '\0' * 20
+        self.failUnlessEqual(self.cache.load(variant), None)
+    def test_version(self):
+        self.cache.store(self.variant, self.messages(self.variant))
+        self.cache.version += 1
+        self.failUnlessEqual(self.cache.load(self.variant), None)
+    def test_truncated(self):
+        self.cache.store(self.variant, self.messages(self.variant))
+        filename = self.cache.filename(self.variant)
+        data = open(filename, 'rb').read()
+        open(filename, 'wb').write(data[:-2])
+        self.failUnlessEqual(self.cache.load(self.variant), None)
+    def test_new_directory(self):
+        self.cache.directory = path.join(self.directory, 'compiled')
+        self.cache.store(self.variant, self.messages(self.variant))
+        self.failUnlessEqual(listdir(self.cache.directory), ['standard.pvc'])
+    def test_unparsed_variant(self):
+        variant = Variant("testing")
+        self.failUnlessEqual(variant.digest, None)
+        self.cache.store(variant, self.messages(self.variant))
+        self.failIf(listdir(self.directory))
+    def test_compiled_shared(self):
+        self.failUnless(self.variant.compiled() is self.variant.compiled())
+    def test_compiled_unparsed(self):
+        ''' Variants built in code are compiled only once, too.'''
+        variant = Variant("testing")
+        variant.borders = self.variant.borders
+        variant.homes = self.variant.homes
+        variant.ownership = self.variant.ownership
+        variant.position = self.variant.position
+        variant.rep = self.variant.rep
+        self.failUnless(variant.compiled() is variant.compiled())
+        Map(variant)
+        self.failUnless(variant.compiled() is variant.compiled())
+    def test_compiled_from_cache(self):
+        mdf, sco, now = self.messages(self.variant)
+        self.cache.store(self.variant, (mdf, sco, NOW(SPR, 1901)))
+        Configuration.set_globally('variant_cache', self.directory)
+        board = Map(self.load())
+        self.failUnlessEqual(list(board.units), [])
+    def test_map_from_cache(self):
+        self.cache.store(self.variant, self.messages(self.variant))
+        Configuration.set_globally('variant_cache', self.directory)
+        board = Map(self.load())
+        self.failUnless(board.valid)
+        original = Map(standard)
+        self.failUnlessEqual(board.create_NOW(), original.create_NOW())
+        self.failUnlessEqual(board.create_SCO(), original.create_SCO())
+
+class LazyModuleTests(unittest.TestCase):
+    "Tests for the lazily built standard map environment"
+    def setUp(self):
+        self.calls = []
+        original = ModuleType('lazy_test', 'Testing module')
+        original.plain = 1
+        def build(module):
+            self.calls.append(module)
+            return module.plain + 1
+        self.module = LazyModule(original, {'built': build})
+    def test_plain(self):
+        self.failUnlessEqual(self.module.plain, 1)
+        self.failUnlessEqual(self.module.__name__, 'lazy_test')
+    def test_built_once(self):
+        self.failUnlessEqual(self.module.built, 2)
+        self.failUnlessEqual(self.module.built, 2)
+        self.failUnlessEqual(self.calls, [self.module])
+    def test_missing(self):
+        self.failUnlessRaises(AttributeError, getattr, self.module, 'other')
+    def test_failed_build(self):
+        ''' A builder that raises is tried again next time.'''
+        failures = [ValueError('not yet')]
+        def build(module):
+            if failures: raise failures.pop()
+            return 'ready'
+        module = LazyModule(ModuleType('lazy_test'), {'flaky': build})
+        self.failUnlessRaises(ValueError, getattr, module, 'flaky')
+        self.failUnlessEqual(module.flaky, 'ready')
+    def test_threaded_build(self):
+        ''' Threads reading an attribute mid-build wait for it.'''
+        started = Event()
+        release = Event()
+        def build(module):
+            self.calls.append(module)
+            started.set()
+            release.wait(5)
+            return 'built'
+        module = LazyModule(ModuleType('lazy_test'), {'slow': build})
+        results = []
+        def read(): results.append(module.slow)
+        threads = [Thread(target=read) for dummy in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]: thread.start()
+        release.set()
+        for thread in threads: thread.join(5)
+        self.failUnlessEqual(results, ['built'] * 3)
+        self.failUnlessEqual(len(self.calls), 1)
+    def test_variant_entry_point(self):
+        self.failUnless(variants['standard'] is standard)
+        self.failUnless(standard_map.variant is standard)
+    def test_tokens_only(self):
+        ''' Importing tokens builds no maps.'''
+        root = path.dirname(path.dirname(path.dirname(path.abspath(__file__))))
+        status = call([executable, '-c', 'import sys; sys.path.insert(0, %r); '
+            'from parlance.xtended import ENG; import parlance.xtended as x; '
+            'sys.exit("standard_map" in vars(x) or "standard" in vars(x))'
+            % root])
+        self.failUnlessEqual(status, 0)
+
+class BoardStateTests(unittest.TestCase):
+    "Tests for the array-backed board state"
+    def setUp(self):
+        self.board = Map(variants["standard"])
+        self.state = BoardState(self.board)
+    def test_now_round_trip(self):
+        self.failUnlessEqual(self.state.create_NOW(), self.board.create_NOW())
+    def test_sco_round_trip(self):
+        old = self.board.create_SCO().fold()
+        new = self.state.create_SCO().fold()
+        self.failUnlessEqual(sorted(map(sorted, old[1:])),
+                sorted(map(sorted, new[1:])))
+    def test_dislodged_round_trip(self):
+        now = NOW(SUM, 1901) % [
+            [ENG, FLT, GAS, MRT, [MAO, BRE, (SPA, NCS)]],
+            [FRA, AMY, GAS],
+        ]
+        self.state.handle_NOW(now)
+        self.board.handle_NOW(self.state.create_NOW())
+        self.failUnlessEqual(self.board.create_NOW(), now)
+    def test_snapshot_restore(self):
+        before = self.state.create_NOW()
+        snapshot = self.state.snapshot()
+        self.state.move_to((AMY, PAR, None), (AMY, BUR, None))
+        self.state.takeover(BEL, FRA)
+        self.failUnlessEqual(self.state.unit_at((AMY, BUR, None)), FRA)
+        self.failUnlessEqual(self.state.owner(BEL), FRA)
+        self.state.restore(snapshot)
+        self.failUnlessEqual(self.state.create_NOW(), before)
+        self.failUnlessEqual(self.state.owner(BEL), None)
+    def test_snapshot_unchanged(self):
+        snapshot = self.state.snapshot()
+        self.state.die((AMY, PAR, None))
+        self.failUnlessEqual(snapshot[1][self.board.coast_index[(AMY, PAR, None)]],
+                self.board.power_index[FRA])
+    def test_map_untouched(self):
+        before = self.board.create_NOW()
+        self.state.move_to((AMY, PAR, None), (AMY, BUR, None))
+        self.failUnlessEqual(self.board.create_NOW(), before)
+
+class DistanceTests(unittest.TestCase):
+    "Tests for the precomputed distance tables"
+    def setUp(self):
+        self.board = Map(variants["standard"])
+    def distance(self, source, target, unit_type=None):
+        dist = self.board.distances_from([target], unit_type)
+        return dist[self.board.province_index[source]]
+    def test_distance_same(self):
+        coast = self.board.coasts[(AMY, PAR, None)]
+        self.failUnlessEqual(self.board.distance(coast, [PAR, MOS]), 0)
+    def test_distance_nearest(self):
+        coast = self.board.coasts[(AMY, BUR, None)]
+        self.failUnlessEqual(self.board.distance(coast, [MOS, PAR]), 1)
+    def test_distance_unknown(self):
+        coast = self.board.coasts[(AMY, BUR, None)]
+        self.failUnlessEqual(self.board.distance(coast, [Token('SWI', 0x504B)]), Infinity)
+    def test_army_distance(self):
+        self.failUnlessEqual(self.distance(PAR, MUN, AMY), 2)
+    def test_army_distance_sea(self):
+        self.failUnlessEqual(self.distance(NTH, LON, AMY), Map.UNREACHABLE)
+    def test_fleet_distance(self):
+        self.failUnlessEqual(self.distance(LON, NWY, FLT), 2)
+    def test_fleet_distance_inland(self):
+        self.failUnlessEqual(self.distance(LON, PAR, FLT), Map.UNREACHABLE)
+    def test_distances_from_multiple(self):
+        dist = self.board.distances_from([LON, MOS])
+        index = self.board.province_index
+        self.failUnlessEqual(dist[index[WAL]], 1)
+        self.failUnlessEqual(dist[index[UKR]], 1)
+        self.failUnlessEqual(dist[index[LON]], 0)
+    def test_distances_from_empty(self):
+        dist = self.board.distances_from([])
+        self.failUnless(all(d == Map.UNREACHABLE for d in dist))
+
+class ProvinceBitsTests(unittest.TestCase):
+    "Tests for the province bitsets"
+    def setUp(self):
+        self.board = Map(variants["standard"])
+    def mask(self, provinces):
+        return sum(self.board.province_bits[key] for key in provinces)
+    def test_bits_distinct(self):
+        bits = self.board.province_bits.values()
+        self.failUnlessEqual(len(set(bits)), len(self.board.spaces))
+        self.failUnlessEqual(sum(bits), (1 << len(bits)) - 1)
+    def test_adjacent_army(self):
+        self.failUnlessEqual(self.board.adjacent_bits[(AMY, BEL, None)],
+                self.mask([BUR, HOL, PIC, RUH]))
+    def test_adjacent_coast(self):
+        self.failUnlessEqual(self.board.adjacent_bits[(FLT, SPA, SCS)],
+                self.mask([GOL, MAO, MAR, POR, WES]))
+
+class ConvoyIndexTests(unittest.TestCase):
+    "Tests for the shared convoy route index"
+    def setUp(self):
+        self.board = Map(variants["standard"])
+        self.index = ConvoyIndex.get(self.board)
+    def test_index_shared(self):
+        other = Map(variants["standard"])
+        self.failUnless(ConvoyIndex.get(other) is self.index)
+    def test_route_through_fleets(self):
+        fleets = self.index.mask([MAO, WES])
+        self.failUnless(self.index.has_route(BRE, TUN, fleets))
+    def test_route_gap(self):
+        fleets = self.index.mask([MAO, TYS])
+        self.failIf(self.index.has_route(BRE, TUN, fleets))
+    def test_route_same_province(self):
+        fleets = self.index.mask([NTH])
+        self.failIf(self.index.has_route(NTH, NTH, fleets))
+    def test_routes_dead_end(self):
+        fleets = self.index.mask([MAO, WES, GOL, TYS, ION, AEG])
+        routes = self.index.routes(BRE, TUN, fleets)
+        self.failUnlessEqual(routes[0], (MAO, WES))
+        self.failIf([route for route in routes if AEG in route])
+    def test_convoy_routes_occupied(self):
+        self.board.handle_NOW(NOW(SPR, 1901) % [
+            [ENG, AMY, LON],
+            [ENG, FLT, NTH],
+            [ENG, FLT, ECH],
+        ])
+        coast = self.board.coasts[(AMY, LON, None)]
+        routes = coast.convoy_routes(self.board.spaces[BEL], self.board)
+        self.failUnlessEqual([[prov.key for prov in route] for route in routes],
+                [[ECH], [NTH], [ECH, NTH], [NTH, ECH]])
+
+class ZobristTests(unittest.TestCase):
+    "Tests for the incremental position hash"
+    def setUp(self):
+        self.board = Map(variants["standard"])
+        self.keys = self.board.zobrist_keys
+    def assertConsistent(self):
+        self.failUnlessEqual(self.board.zobrist,
+                self.keys.position(self.board))
+    def test_keys_shared(self):
+        other = Map(variants["standard"])
+        self.failUnless(ZobristKeys.get(other) is self.keys)
+        self.failUnlessEqual(other.zobrist, self.board.zobrist)
+    def test_initial_hash(self):
+        self.failUnless(self.board.zobrist)
+        self.assertConsistent()
+    def test_move_and_back(self):
+        before = self.board.zobrist
+        unit = self.board.spaces[LVP].unit
+        unit.move_to(self.board.coasts[(AMY, YOR, None)])
+        self.failIfEqual(self.board.zobrist, before)
+        self.assertConsistent()
+        unit.move_to(self.board.coasts[(AMY, LVP, None)])
+        self.failUnlessEqual(self.board.zobrist, before)
+    def test_build(self):
+        before = self.board.zobrist
+        unit = Unit(self.board.powers[GER], self.board.coasts[(AMY, HOL, None)])
+        unit.build()
+        self.failIfEqual(self.board.zobrist, before)
+        self.assertConsistent()
+        unit.die()
+        self.failUnlessEqual(self.board.zobrist, before)
+    def test_dislodged(self):
+        unit = self.board.spaces[PAR].unit
+        before = self.board.zobrist
+        unit.retreat([PIC])
+        self.failIfEqual(self.board.zobrist, before)
+        self.assertConsistent()
+    def test_takeover(self):
+        before = self.board.zobrist
+        unit = self.board.spaces[LON].unit
+        unit.move_to(self.board.coasts[(FLT, BEL, None)])
+        unit.takeover()
+        self.assertConsistent()
+        unit.move_to(self.board.coasts[(FLT, LON, None)])
+        self.failIfEqual(self.board.zobrist, before)
+    def test_advance(self):
+        before = self.board.zobrist
+        self.board.advance()
+        self.failIfEqual(self.board.zobrist, before)
+        self.assertConsistent()
+    def test_same_position(self):
+        other = Map(variants["standard"])
+        other.handle_NOW(self.board.create_NOW())
+        other.handle_SCO(self.board.create_SCO())
+        self.failUnlessEqual(other.zobrist, self.board.zobrist)
+    def test_different_turn(self):
+        other = Map(variants["standard"])
+        now = self.board.create_NOW()
+        now[2] = FAL
+        other.handle_NOW(now)
+        self.failIfEqual(other.zobrist, self.board.zobrist)
+
 class Map_Bugfix(unittest.TestCase):
     ''' Tests to reproduce bugs related to the Map class'''
     def test_empty_UNO(self):
@@ -0,0 +1,146 @@
+r'''Test cases for the Parlance headless game runner
+    Copyright (C) 2004-2008  Eric Wald
+    
+    This module tests games played without a server.
+    
+    Parlance may be used, modified, and/or redistributed under the terms of
+    the Artistic License 2.0, as published by the Perl Foundation.
+'''#'''
+
+import unittest
+from os import _exit
+
+from parlance.config     import Configuration
+from parlance.gameboard  import Variant
+from parlance.headless   import HeadlessGame, JudgeFarm, play_games
+from parlance.player     import HoldBot
+from parlance.tokens     import *
+from parlance.xtended    import ENG, FRA, standard
+
+class QuietBot(HoldBot):
+    ''' A HoldBot that never asks for a draw.'''
+    def send(self, message):
+        if message is not DRW: self.__super.send(message)
+quiet_players = dict((country, QuietBot) for country in
+    ('AUS', 'ENG', 'FRA', 'GER', 'ITA', 'RUS', 'TUR'))
+
+class CrashBot(QuietBot):
+    ''' A QuietBot that kills its worker process in the second game.'''
+    games = 0
+    def __init__(self, **kwargs):
+        CrashBot.games += 1
+        if CrashBot.games > 1: _exit(3)
+        self.__super.__init__(**kwargs)
+
+class HeadlessTestCase(unittest.TestCase):
+    ''' Games played without a server'''
+    game_options = {
+        'draw': 3,
+        'send_SET': False,
+        'send_ORD': True,
+    }
+    def setUp(self):
+        Configuration.set_globally('verbosity', 0)
+        Configuration._cache.update(self.game_options)
+    def quiet_game(self):
+        return HeadlessGame(standard, quiet_players)
+    
+    def test_holdbot_draw(self):
+        ''' HoldBots all request a draw before the first orders.'''
+        game = HeadlessGame('standard')
+        history = game.run()
+        self.failUnlessEqual(game.judge.game_result, +DRW)
+        self.failUnlessEqual(history.keys(), [(1901, 0)])
+    def test_draw_year(self):
+        ''' Games end by the judge's draw year.'''
+        game = self.quiet_game()
+        history = game.run()
+        self.failUnlessEqual(game.judge.game_result, +DRW)
+        self.failUnlessEqual(max(history), (1903, 2))
+    def test_history_format(self):
+        ''' History entries match the server's format.'''
+        game = self.quiet_game()
+        history = game.run()
+        turn = history[(1901, 0)]
+        self.failUnlessEqual(len(turn[ORD]), 22)
+        self.failUnlessEqual(turn[NOW][:4], NOW(FAL, 1901)[:4])
+        self.failUnlessEqual(turn[SET], [])
+        self.failIf(turn['new_SCO'])
+        self.failUnless(history[(1901, 2)]['new_SCO'])
+    def test_player_names(self):
+        ''' Players may be given by power name.'''
+        game = HeadlessGame('standard', {'ENG': QuietBot})
+        self.failUnless(isinstance(game.players[ENG], QuietBot))
+        self.failIf(isinstance(game.players[FRA], QuietBot))
+    def test_summary(self):
+        game = self.quiet_game()
+        game.run()
+        self.failUnlessEqual(game.messages[SMR][0], SMR)
+    def test_reset(self):
+        ''' A reset game plays out the same as a new one.'''
+        game = self.quiet_game()
+        first = game.run()
+        game.reset()
+        self.failUnlessEqual(game.history, {})
+        second = game.run()
+        self.failUnlessEqual(sorted(second), sorted(first))
+        for key in first:
+            for item in (SET, ORD, SCO, NOW, 'new_SCO'):
+                self.failUnlessEqual(second[key][item], first[key][item])
+    def test_play_games(self):
+        results = play_games('standard', 2)
+        self.failUnlessEqual([result for result, history in results],
+                [+DRW, +DRW])
+
+class JudgeFarmTestCase(unittest.TestCase):
+    ''' Games played in worker processes'''
+    def setUp(self):
+        Configuration.set_globally('verbosity', 0)
+        Configuration._cache.update(HeadlessTestCase.game_options)
+    def test_farm_results(self):
+        farm = JudgeFarm('standard', quiet_players, workers=2)
+        results = farm.run(3)
+        self.failUnlessEqual(sorted(results), [0, 1, 2])
+        for result, history in results.values():
+            self.failUnlessEqual(result, +DRW)
+            self.failUnlessEqual(max(history), (1903, 2))
+    def test_farm_history(self):
+        ''' Histories from workers match those of a local game.'''
+        farm = JudgeFarm('standard', quiet_players, workers=1)
+        result, history = farm.run(1)[0]
+        local = HeadlessGame(standard, quiet_players).run()
+        self.failUnlessEqual(sorted(history), sorted(local))
+        for key in local:
+            for item in (SET, ORD, SCO, NOW, 'new_SCO'):
+                self.failUnlessEqual(history[key][item], local[key][item])
+    def test_farm_callback(self):
+        turns = []
+        farm = JudgeFarm('standard', quiet_players, workers=2)
+        farm.run(2, lambda number, key, turn: turns.append((number, key)))
+        self.failUnlessEqual(len(turns), 12)
+        self.failUnlessEqual(sorted(set(number for number, key in turns)),
+                [0, 1])
+    def test_farm_custom_variant(self):
+        ''' Workers can play variants that are not registered by name.'''
+        variant = Variant('standard', filename='parlance://data/standard.cfg')
+        variant.name = 'farm_custom'
+        farm = JudgeFarm(variant, quiet_players, workers=2)
+        results = farm.run(2)
+        self.failUnlessEqual(sorted(results), [0, 1])
+        for result, history in results.values():
+            self.failUnlessEqual(result, +DRW)
+    def test_farm_worker_crash(self):
+        ''' Games lost to a dead worker are reported.'''
+        farm = JudgeFarm('standard', {'ENG': CrashBot}, workers=1)
+        try: farm.run(3)
+        except RuntimeError, err:
+            self.failUnless('games not completed: [1, 2]' in str(err))
+        else: self.fail('Worker crash not reported')
+    def test_farm_rate(self):
+        farm = JudgeFarm('standard', workers=2)
+        farm.run(2)
+        self.failUnlessEqual(farm.games, 2)
+        self.failUnless(farm.rate() > 0)
+        self.failUnless(farm.report().startswith('2 games in '))
+
+if __name__ == '__main__': unittest.main()
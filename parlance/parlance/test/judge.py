@@ -9,20 +9,29 @@ r'''Non-DATC test cases for the Parlance judge
 '''#'''
 
 import unittest
+from itertools import chain
+from os import close, remove
+from StringIO import StringIO
+from tempfile import mkstemp
 from time import time
 
 from parlance.config    import variants, Configuration, GameOptions
 from parlance.functions import fails
-from parlance.judge     import Attack_Decision, Hold_Decision, \
-        Move_Decision, Path_Decision, Prevent_Decision
+from parlance.gameboard import Map, Turn
+from parlance.judge     import AdjudicationCache, Attack_Decision, \
+        Hold_Decision, Move_Decision, Path_Decision, Prevent_Decision, \
+        Support_Tally
 from parlance.language  import Token
 from parlance.main      import Thread
-from parlance.orders    import MoveOrder
+from parlance.orders    import MoveOrder, OrderSet, SupportMoveOrder
 from parlance.tokens    import *
 from parlance.xtended   import *
         
 from parlance.test.datc import DiplomacyAdjudicatorTestCase
 
+try: from json import loads
+except ImportError: from simplejson import loads
+
 SWI = Token('SWI', 0x504B)
 
 class Judge_Movement(DiplomacyAdjudicatorTestCase):
@@ -128,6 +137,30 @@ class Judge_Movement(DiplomacyAdjudicatorTestCase):
         self.legalOrder(GER, [(GER, AMY, GAS), MTO, SPA])
         self.legalOrder(ITA, [(ITA, FLT, POR), MTO, (SPA, NCS)])
         self.assertMapState(steady_state)
+    def test_independent_circular_movements(self):
+        ''' Separate rings of movement all succeed in one phase'''
+        self.init_state(SPR, 1901, [
+            [FRA, AMY, PAR],
+            [FRA, AMY, BUR],
+            [FRA, AMY, PIC],
+            [AUS, AMY, VIE],
+            [AUS, AMY, BOH],
+            [AUS, AMY, GAL],
+        ])
+        self.legalOrder(FRA, [(FRA, AMY, PAR), MTO, BUR])
+        self.legalOrder(FRA, [(FRA, AMY, BUR), MTO, PIC])
+        self.legalOrder(FRA, [(FRA, AMY, PIC), MTO, PAR])
+        self.legalOrder(AUS, [(AUS, AMY, VIE), MTO, BOH])
+        self.legalOrder(AUS, [(AUS, AMY, BOH), MTO, GAL])
+        self.legalOrder(AUS, [(AUS, AMY, GAL), MTO, VIE])
+        self.assertMapState([
+            [FRA, AMY, BUR],
+            [FRA, AMY, PIC],
+            [FRA, AMY, PAR],
+            [AUS, AMY, BOH],
+            [AUS, AMY, GAL],
+            [AUS, AMY, VIE],
+        ])
 
 class Judge_Convoys(DiplomacyAdjudicatorTestCase):
     ''' Minute details of convoy adjudication'''
@@ -479,6 +512,347 @@ class Judge_Basics(DiplomacyAdjudicatorTestCase):
         self.assertMapState([
                 [GER, AMY, RUH],
         ])
+    def test_position_hash(self):
+        ''' The map's position hash follows the judge's changes.'''
+        board = self.judge.map
+        self.init_state(FAL, 1901, [
+            [FRA, AMY, BUR],
+            [FRA, AMY, RUH],
+            [GER, AMY, MUN],
+        ])
+        self.legalOrder(FRA, [(FRA, AMY, BUR), MTO, MUN])
+        self.legalOrder(FRA, [(FRA, AMY, RUH), SUP, (FRA, AMY, BUR), MTO, MUN])
+        self.legalOrder(GER, [(GER, AMY, MUN), HLD])
+        self.assertMapState([
+            [FRA, AMY, MUN],
+            [FRA, AMY, RUH],
+            [GER, AMY, MUN, MRT],
+        ])
+        self.failUnlessEqual(board.zobrist, board.zobrist_keys.position(board))
+        self.legalOrder(GER, [(GER, AMY, MUN), RTO, BOH])
+        self.judge.run()
+        self.failUnlessEqual(board.zobrist, board.zobrist_keys.position(board))
+    def test_decisions_released(self):
+        ''' Decisions are kept for reuse, without references to the phase.'''
+        self.init_state(SPR, 1901, [
+            [FRA, AMY, BUR],
+            [GER, AMY, MUN],
+        ])
+        self.legalOrder(FRA, [(FRA, AMY, BUR), MTO, MUN])
+        self.assertMapState([
+            [FRA, AMY, BUR],
+            [GER, AMY, MUN],
+        ])
+        decisions = self.judge.decisions
+        self.failIf(list(decisions))
+        released = list(chain(*decisions.free.values()))
+        self.failUnless(released)
+        for choice in released:
+            self.failUnlessEqual((choice.order, choice.into, choice.depends),
+                    (None, None, []))
+    def test_decisions_reused(self):
+        ''' Later movement phases use the decisions of earlier ones.'''
+        def run_phase():
+            self.init_state(SPR, 1901, [
+                [FRA, AMY, BUR],
+                [FRA, AMY, RUH],
+                [GER, AMY, MUN],
+            ])
+            self.legalOrder(FRA, [(FRA, AMY, BUR), MTO, MUN])
+            self.legalOrder(FRA, [(FRA, AMY, RUH), SUP, (FRA, AMY, BUR), MTO, MUN])
+            self.assertMapState([
+                [FRA, AMY, MUN],
+                [FRA, AMY, RUH],
+                [GER, AMY, MUN, MRT],
+            ])
+            return set(map(id, chain(*self.judge.decisions.free.values())))
+        first = run_phase()
+        self.failUnlessEqual(run_phase(), first)
+    def test_support_tally(self):
+        tally = Support_Tally()
+        for nation in ('FRA', 'FRA', 'GER'): tally.add(nation)
+        tally.change('FRA', 1, 0)
+        tally.change('GER', 0, 1)
+        self.failUnlessEqual((tally.count(True), tally.count(False)), (1, 2))
+        self.failUnlessEqual(tally.count(False, ['FRA']), 0)
+        self.failUnlessEqual(tally.count(True, ['GER', 'ITA']), 1)
+    def test_support_tally_cut(self):
+        ''' Supports are counted only once they are known to stand.'''
+        self.init_state(SPR, 1901, [
+            [FRA, AMY, BUR],
+            [FRA, AMY, RUH],
+            [FRA, AMY, BEL],
+            [GER, AMY, MUN],
+            [GER, AMY, KIE],
+        ])
+        self.legalOrder(FRA, [(FRA, AMY, RUH), SUP, (FRA, AMY, BUR)])
+        self.legalOrder(FRA, [(FRA, AMY, BEL), SUP, (FRA, AMY, BUR)])
+        self.legalOrder(GER, [(GER, AMY, MUN), MTO, BUR])
+        self.legalOrder(GER, [(GER, AMY, KIE), MTO, RUH])
+        self.assertMapState([
+            [FRA, AMY, BUR],
+            [FRA, AMY, RUH],
+            [FRA, AMY, BEL],
+            [GER, AMY, MUN],
+            [GER, AMY, KIE],
+        ])
+        tally = self.judge.map.ordered_unit(FRA, [AMY, BUR]).tally
+        self.failUnlessEqual((tally.passed, tally.possible), (1, 1))
+        self.failUnlessEqual(tally.powers, {FRA.key: [1, 1]})
+    def test_contested_provinces(self):
+        ''' Provinces occupied or entered are closed to retreats.'''
+        self.init_state(SPR, 1901, [
+            [FRA, AMY, BUR],
+            [FRA, AMY, PIC],
+            [GER, AMY, RUH],
+            [GER, AMY, HOL],
+            [ENG, FLT, ECH],
+        ])
+        self.legalOrder(FRA, [(FRA, AMY, BUR), MTO, BEL])
+        self.legalOrder(FRA, [(FRA, AMY, PIC), SUP, (FRA, AMY, BUR), MTO, BEL])
+        self.legalOrder(GER, [(GER, AMY, RUH), MTO, BEL])
+        self.legalOrder(ENG, [(ENG, FLT, ECH), MTO, BEL])
+        self.judge.run()
+        bits = self.judge.map.province_bits
+        for key in (PIC, HOL, BEL, RUH, ECH):
+            self.failUnless(self.judge.contested & bits[key], key)
+        for key in (BUR, KIE, NTH, PAR):
+            self.failIf(self.judge.contested & bits[key], key)
+    def test_retreats_avoid_standoff(self):
+        self.init_state(SPR, 1901, [
+            [FRA, AMY, BUR],
+            [FRA, AMY, PIC],
+            [GER, AMY, MUN],
+            [GER, AMY, KIE],
+            [ENG, AMY, BEL],
+        ])
+        self.legalOrder(FRA, [(FRA, AMY, BUR), MTO, BEL])
+        self.legalOrder(FRA, [(FRA, AMY, PIC), SUP, (FRA, AMY, BUR), MTO, BEL])
+        self.legalOrder(GER, [(GER, AMY, MUN), MTO, RUH])
+        self.legalOrder(GER, [(GER, AMY, KIE), MTO, RUH])
+        self.assertMapState([
+            [FRA, AMY, BEL],
+            [FRA, AMY, PIC],
+            [GER, AMY, MUN],
+            [GER, AMY, KIE],
+            [ENG, AMY, BEL, MRT],
+        ])
+        unit = self.judge.map.ordered_unit(ENG, [AMY, BEL])
+        self.failUnlessEqual(unit.retreats, [HOL])
+
+class Judge_Adjudicate(DiplomacyAdjudicatorTestCase):
+    ''' Hypothetical adjudication without side effects'''
+    game_options = {'LVL': 0, 'cache_size': 0}
+    def setUp(self):
+        DiplomacyAdjudicatorTestCase.setUp(self)
+        self.board = NOW(SPR, 1901) % [
+            [ENG, FLT, GAS],
+            [FRA, AMY, PAR],
+            [FRA, AMY, MAR],
+        ]
+        self.init_state(SPR, 1901, [[GER, AMY, MUN]])
+        board = Map(variants[self.variant_name])
+        board.handle_NOW(self.board)
+        Marseilles = board.spaces[MAR].unit
+        Paris = board.spaces[PAR].unit
+        Gascony = board.coasts[(AMY, GAS, None)]
+        self.orders = OrderSet()
+        self.orders.add(MoveOrder(Marseilles, Gascony), FRA)
+        self.orders.add(SupportMoveOrder(Paris, Marseilles, Gascony), FRA)
+    def test_adjudicate_results(self):
+        orders, now = self.judge.adjudicate(self.board, self.orders)
+        self.assertContains(orders, ORD (SPR, 1901) ([FRA, AMY, MAR], MTO, GAS) (SUC))
+        self.assertContains(orders, ORD (SPR, 1901) ([ENG, FLT, GAS], HLD) (RET))
+        units = [unit[:4] for unit in now.fold()[2:]]
+        self.failUnlessEqual(sorted(units), sorted([
+            [ENG, FLT, GAS, MRT],
+            [FRA, AMY, PAR],
+            [FRA, AMY, GAS],
+        ]))
+    def test_adjudicate_untouched(self):
+        before = self.judge.map.create_NOW()
+        self.judge.adjudicate(self.board, self.orders)
+        self.failUnlessEqual(self.judge.map.create_NOW(), before)
+        self.failIf(self.judge.next_orders)
+    def test_adjudicate_move_phase(self):
+        board = NOW(WIN, 1901) % [[FRA, AMY, PAR]]
+        self.failUnlessRaises(ValueError,
+                self.judge.adjudicate, board, OrderSet())
+    def test_adjudicate_cache(self):
+        self.judge.adjudicate(self.board, self.orders)
+        self.failUnlessEqual(self.judge.cache, None)
+    def test_scratch_reused(self):
+        ''' Repeated calls share one scratch judge.'''
+        first = self.judge.adjudicate(self.board, self.orders)
+        scratch = list(self.judge.scratch)
+        second = self.judge.adjudicate(self.board, OrderSet())
+        third = self.judge.adjudicate(self.board, self.orders)
+        self.failUnlessEqual(len(scratch), 1)
+        self.failUnlessEqual(self.judge.scratch, scratch)
+        self.failUnlessEqual(third, first)
+        self.assertContains(second[0],
+                ORD (SPR, 1901) ([FRA, AMY, MAR], HLD) (SUC))
+    def test_scratch_released_on_error(self):
+        ''' A failed adjudication leaves no decisions in the scratch judge.'''
+        self.judge.adjudicate(self.board, self.orders)
+        scratch = self.judge.scratch[0]
+        def fail(decision_list): raise UserWarning('Adjudication failed')
+        scratch.make_decisions = fail
+        self.failUnlessRaises(UserWarning,
+                self.judge.adjudicate, self.board, OrderSet())
+        self.failIf(list(scratch.decisions))
+        for unit in scratch.map.units:
+            self.failIf(hasattr(unit, 'decisions'), unit)
+        del scratch.make_decisions
+        orders, now = self.judge.adjudicate(self.board, OrderSet())
+        self.assertContains(orders,
+                ORD (SPR, 1901) ([FRA, AMY, MAR], HLD) (SUC))
+
+class Judge_AdjudicationCache(Judge_Adjudicate):
+    ''' Hypothetical adjudication with remembered results'''
+    game_options = {'LVL': 0, 'cache_size': 2}
+    def test_adjudicate_cache(self):
+        self.judge.adjudicate(self.board, self.orders)
+        self.failUnlessEqual(len(self.judge.cache), 1)
+    def test_cache_hit(self):
+        first = self.judge.adjudicate(self.board, self.orders)
+        second = self.judge.adjudicate(self.board, self.orders)
+        self.failUnlessEqual(first, second)
+        self.failUnlessEqual((self.judge.cache.hits, self.judge.cache.misses),
+                (1, 1))
+    def test_cache_copies(self):
+        ''' Changing returned messages leaves the cache intact.'''
+        orders, now = self.judge.adjudicate(self.board, self.orders)
+        expected = [list(order) for order in orders], list(now)
+        del orders[0][:]
+        del now[:]
+        orders.pop()
+        orders, now = self.judge.adjudicate(self.board, self.orders)
+        self.failUnlessEqual(([list(order) for order in orders], list(now)),
+                expected)
+    def test_cache_orders(self):
+        self.judge.adjudicate(self.board, self.orders)
+        orders, now = self.judge.adjudicate(self.board, OrderSet())
+        self.assertContains(orders, ORD (SPR, 1901) ([FRA, AMY, MAR], HLD) (SUC))
+        self.failUnlessEqual(self.judge.cache.misses, 2)
+    def test_cache_unit_order(self):
+        ''' Units listed in another order share an entry.'''
+        self.judge.adjudicate(self.board, self.orders)
+        board = NOW(SPR, 1901) % [
+            [FRA, AMY, PAR],
+            [FRA, AMY, MAR],
+            [ENG, FLT, GAS],
+        ]
+        self.judge.adjudicate(board, self.orders)
+        self.failUnlessEqual(self.judge.cache.hits, 1)
+    def test_cache_retreats(self):
+        ''' Dislodged units with different retreats get separate entries.'''
+        def board(retreats):
+            return NOW(SPR, 1901) % [
+                [ENG, FLT, GAS, MRT, retreats],
+                [FRA, AMY, PAR],
+                [FRA, AMY, MAR],
+            ]
+        self.judge.adjudicate(board([BRE]), OrderSet())
+        self.judge.adjudicate(board([BRE, SPA]), OrderSet())
+        self.judge.adjudicate(board([BRE]), OrderSet())
+        self.failUnlessEqual((self.judge.cache.hits, self.judge.cache.misses),
+                (1, 2))
+    def test_cache_turn(self):
+        self.judge.adjudicate(self.board, self.orders)
+        board = NOW(FAL, 1901) % [
+            [ENG, FLT, GAS],
+            [FRA, AMY, PAR],
+            [FRA, AMY, MAR],
+        ]
+        orders, now = self.judge.adjudicate(board, self.orders)
+        self.assertContains(orders, ORD (FAL, 1901) ([FRA, AMY, MAR], MTO, GAS) (SUC))
+        self.failUnlessEqual(self.judge.cache.misses, 2)
+    
+    def test_lru_eviction(self):
+        cache = AdjudicationCache(2)
+        cache.store('a', 1)
+        cache.store('b', 2)
+        self.failUnlessEqual(cache.lookup('a'), 1)
+        cache.store('c', 3)
+        self.failUnlessEqual(cache.lookup('b'), None)
+        self.failUnlessEqual(cache.lookup('a'), 1)
+        self.failUnlessEqual(cache.stats(),
+                {'size': 2, 'hits': 2, 'misses': 1, 'evictions': 1})
+    def test_fifo_eviction(self):
+        cache = AdjudicationCache(2, 'fifo')
+        cache.store('a', 1)
+        cache.store('b', 2)
+        self.failUnlessEqual(cache.lookup('a'), 1)
+        cache.store('c', 3)
+        self.failUnlessEqual(cache.lookup('a'), None)
+        self.failUnlessEqual(cache.lookup('b'), 2)
+    def test_replace_entry(self):
+        cache = AdjudicationCache(2)
+        cache.store('a', 1)
+        cache.store('a', 4)
+        self.failUnlessEqual(len(cache), 1)
+        self.failUnlessEqual(cache.lookup('a'), 4)
+    def test_unknown_eviction(self):
+        self.failUnlessRaises(ValueError, AdjudicationCache, 2, 'random')
+
+class Judge_Statistics(DiplomacyAdjudicatorTestCase):
+    ''' Per-phase timing and decision counts'''
+    def circle(self):
+        self.init_state(SPR, 1901, [
+            [FRA, AMY, PAR],
+            [FRA, AMY, BUR],
+            [FRA, AMY, PIC],
+        ])
+        self.legalOrder(FRA, [(FRA, AMY, PAR), MTO, BUR])
+        self.legalOrder(FRA, [(FRA, AMY, BUR), MTO, PIC])
+        self.legalOrder(FRA, [(FRA, AMY, PIC), MTO, PAR])
+        self.assertMapState([
+            [FRA, AMY, BUR],
+            [FRA, AMY, PIC],
+            [FRA, AMY, PAR],
+        ])
+        return self.judge.stats.phases[(1901, 0)]
+    def test_phase_record(self):
+        record = self.circle()
+        self.failUnlessEqual(record['turn'], str(Turn(SPR, 1901)))
+        self.failUnlessEqual(record['orders'], 3)
+        self.failUnless(record['calculations'] > 0)
+        self.failUnless(record['time']['move_algorithm'] >= 0)
+    def test_decision_counts(self):
+        record = self.circle()
+        self.failUnlessEqual(record['decisions']['Move'], 3)
+    def test_circular_rule(self):
+        record = self.circle()
+        self.failUnlessEqual(dict(record['rules']), {'circular': 1})
+        self.failUnlessEqual(record['paradoxes'], 1)
+    def test_totals(self):
+        self.circle()
+        totals = self.judge.stats.totals()
+        self.failUnlessEqual(totals['orders'], 3)
+        self.failUnlessEqual(totals['phases'], len(self.judge.stats.phases))
+    def test_stats_dump(self):
+        self.circle()
+        stream = StringIO()
+        self.judge.stats.dump(stream, variant='standard')
+        data = loads(stream.getvalue())
+        self.failUnlessEqual(data['variant'], 'standard')
+        self.failUnlessEqual(data['totals']['orders'], 3)
+        self.failUnlessEqual(data['phases'][0]['turn'], str(Turn(SPR, 1901)))
+    def test_stats_file(self):
+        ''' Statistics are appended to the file, one line per game.'''
+        self.circle()
+        handle, filename = mkstemp()
+        close(handle)
+        try:
+            self.judge.options.stats_file = filename
+            self.judge.write_stats()
+            self.judge.write_stats()
+            lines = open(filename).readlines()
+        finally: remove(filename)
+        self.failUnlessEqual(len(lines), 2)
+        self.failUnlessEqual(loads(lines[0])['variant'],
+                self.judge.variant_name)
 
 class Judge_Loose(DiplomacyAdjudicatorTestCase):
     ''' Judge output for loose orders'''
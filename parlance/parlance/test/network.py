@@ -17,7 +17,7 @@ from time            import sleep
 
 from parlance.config    import VerboseObject
 from parlance.functions import any
-from parlance.language  import Representation, Token, protocol
+from parlance.language  import PackedMessage, Representation, Token, protocol
 from parlance.main      import ThreadManager
 from parlance.network   import Client, Connection, ServerSocket
 from parlance.player    import Clock, HoldBot
@@ -227,6 +227,16 @@ class Network_Errors(NetworkTestCase):
         client = self.fake_client(ReservedSender)
         self.manager.process()
         self.failUnlessEqual(client.error_code, protocol.IllegalToken)
+    def test_reserved_packed_tokens(self):
+        ''' Packed messages are checked for reserved tokens, too.'''
+        c = Connection()
+        c.options.packed_messages = True
+        c.rep = c.proto.default_rep
+        errors = []
+        c.send_error = lambda code, from_them=False: errors.append(code)
+        data = pack('!HHHH', HLO.number, BRA.number, 0x585F, KET.number)
+        self.failUnlessEqual(c.unpack_message(data), None)
+        self.failUnlessEqual(errors, [protocol.IllegalToken])
 
 class Network_Basics(NetworkTestCase):
     def test_full_connection(self):
@@ -302,6 +312,15 @@ class Network_Basics(NetworkTestCase):
         unpacked = c.unpack_message(pack('!HHHH', *msg))
         self.failUnlessEqual(repr(unpacked),
             "Message([HLO, [Token('Sth', 0x4101)]])")
+    def test_unpack_packed_message(self):
+        c = Connection()
+        c.options.packed_messages = True
+        c.rep = Representation({0x4101: 'Sth'}, c.proto.base_rep)
+        data = pack('!HHHH', HLO.number, BRA.number, 0x4101, KET.number)
+        unpacked = c.unpack_message(data)
+        self.failUnless(isinstance(unpacked, PackedMessage))
+        self.failUnless(unpacked.pack() is data)
+        self.failUnlessEqual(str(unpacked), 'HLO ( Sth )')
 
 class Network_Full_Games(NetworkTestCase):
     def test_holdbots(self):
@@ -311,5 +330,10 @@ class Network_Full_Games(NetworkTestCase):
         ''' seven holdbots; two games'''
         self.connect_server([HoldBot] * 7, 2)
         self.failUnlessEqual(len(self.server.games), 2)
+    def test_packed_messages(self):
+        ''' Seven holdbots, keeping incoming messages packed'''
+        self.set_option('packed_messages', True)
+        try: self.connect_server([HoldBot] * 7)
+        finally: self.set_option('packed_messages', False)
 
 if __name__ == '__main__': unittest.main()
@@ -0,0 +1,222 @@
+r'''Test cases for Parlance orders
+    Copyright (C) 2004-2008  Eric Wald
+    
+    This module tests the order classes and the table of possible orders.
+    
+    Parlance may be used, modified, and/or redistributed under the terms of
+    the Artistic License 2.0, as published by the Perl Foundation.
+'''#'''
+
+import unittest
+from array import array
+from copy  import copy
+
+from parlance.config    import Configuration, variants
+from parlance.gameboard import Map, Turn
+from parlance.judge     import DatcOptions
+from parlance.language  import Message
+from parlance.orders    import HoldOrder, MoveOrder, OrderSet, OrderTable, \
+        WaiveOrder, createUnitOrder
+from parlance.tokens    import *
+from parlance.xtended   import *
+
+class OrderTableTestCase(unittest.TestCase):
+    "Tests for the table of possible orders"
+    def setUp(self):
+        Configuration.set_globally('verbosity', 0)
+        self.board = Map(variants['standard'])
+        self.table = OrderTable.get(self.board)
+    def assertConsistent(self):
+        ''' Checks each numbered order against the judge's legality notes.'''
+        choices, mask = self.table.legal_orders(self.board)
+        phase = self.board.current_turn.phase()
+        for number in range(len(self.table)):
+            order = self.table.create_order(number, self.board)
+            if order is None: legal = False
+            else:
+                power = order.unit and order.unit.nation or order.nation
+                legal = order.order_note(power, phase) == MBV
+            self.failUnlessEqual(legal, bool(mask[number]),
+                '%s: %s' % (self.table.actions[number], legal))
+        listed = sorted(sum([list(numbers) for numbers in choices.values()], []))
+        self.failUnlessEqual(listed,
+            [number for number, flag in enumerate(mask) if flag])
+    def assertParsed(self):
+        ''' Checks that each legal order survives the trip through a SUB.'''
+        choices, mask = self.table.legal_orders(self.board)
+        phase = self.board.current_turn.phase()
+        datc = DatcOptions()
+        for numbers in choices.values():
+            for number in numbers:
+                order = self.table.create_order(number, self.board)
+                power = order.unit and order.unit.nation or order.nation
+                message = Message(order)
+                parsed = createUnitOrder(message.fold(), power, self.board, datc)
+                self.failUnlessEqual(parsed.order_note(power, phase), MBV,
+                    str(message))
+    def convoy_position(self):
+        self.board.handle_NOW(NOW(SPR, 1902) % [
+            [ENG, FLT, NTH], [ENG, FLT, NWG], [ENG, AMY, LON],
+            [FRA, FLT, ECH], [FRA, FLT, MAO], [FRA, AMY, BRE],
+            [GER, AMY, HOL], [GER, FLT, HEL],
+            [ITA, FLT, TYS], [ITA, FLT, WES], [ITA, AMY, TUN], [ITA, AMY, NAP],
+            [RUS, AMY, NWY],
+            [TUR, FLT, AEG], [TUR, FLT, EAS], [TUR, AMY, SYR], [TUR, AMY, GRE],
+            [AUS, FLT, ION], [AUS, AMY, ALB],
+        ])
+    
+    def test_table_shared(self):
+        other = Map(variants['standard'])
+        self.failUnless(OrderTable.get(other) is self.table)
+    def test_numbers(self):
+        for number, action in enumerate(self.table.actions):
+            self.failUnlessEqual(self.table.numbers[action], number)
+    def test_spans(self):
+        start, stop = self.table.spans[(FLT, LON, None)]
+        actions = self.table.actions[start:stop]
+        self.failUnlessEqual(set(action[0] for action in actions),
+            set([(FLT, LON, None)]))
+        self.failUnlessEqual(actions[0][1], HLD)
+    def test_array_types(self):
+        choices, mask = self.table.legal_orders(self.board)
+        self.failUnless(isinstance(mask, array))
+        self.failUnlessEqual(len(mask), len(self.table))
+        for numbers in choices.values():
+            self.failUnlessEqual(numbers.typecode, 'I')
+    def test_starting_position(self):
+        self.assertConsistent()
+    def test_starting_messages(self):
+        self.assertParsed()
+    def test_convoy_position(self):
+        self.convoy_position()
+        self.assertConsistent()
+    def test_convoy_messages(self):
+        self.convoy_position()
+        self.assertParsed()
+    def test_convoy_orders(self):
+        self.convoy_position()
+        choices, mask = self.table.legal_orders(self.board)
+        London = self.board.spaces[LON].unit
+        orders = [self.table.actions[number] for number in choices[London.key]]
+        self.failUnless(((AMY, LON, None), CTO, NWY) in orders)
+        self.failIf(((AMY, LON, None), CTO, LVN) in orders)
+    def test_retreat_phase(self):
+        self.board.handle_NOW(NOW(SUM, 1901) % [
+            [ENG, FLT, NTH],
+            [ENG, FLT, NWG, MRT, [BAR, NAO]],
+            [FRA, FLT, ECH],
+        ])
+        choices, mask = self.table.legal_orders(self.board)
+        self.failUnlessEqual(choices.keys(), [(ENG, FLT, NWG)])
+        self.failUnlessEqual(len(choices[(ENG, FLT, NWG)]), 3)
+        self.assertConsistent()
+        self.assertParsed()
+    def test_build_phase(self):
+        self.board.handle_NOW(NOW(WIN, 1901) % [
+            [ENG, FLT, NTH],
+            [FRA, FLT, ECH],
+            [RUS, AMY, MOS],
+        ])
+        self.board.powers[FRA].centers = [PAR]
+        choices, mask = self.table.legal_orders(self.board)
+        self.failIf(choices.has_key(FRA))
+        builds = [self.table.actions[number] for number in choices[ENG]]
+        self.failUnless((ENG, WVE) in builds)
+        self.failUnless((ENG, BLD, (FLT, LON, None)) in builds)
+        self.assertConsistent()
+        self.assertParsed()
+    def test_removal_phase(self):
+        self.board.handle_NOW(NOW(WIN, 1901) % [
+            [ENG, FLT, NTH],
+            [ENG, FLT, ECH],
+        ])
+        self.board.powers[ENG].centers = [LON]
+        choices, mask = self.table.legal_orders(self.board)
+        removals = [self.table.actions[number] for number in choices[ENG]]
+        self.failUnlessEqual(sorted(removals), [
+            ((FLT, ECH, None), REM),
+            ((FLT, NTH, None), REM),
+        ])
+        self.assertConsistent()
+
+class OrderSetTestCase(unittest.TestCase):
+    "Tests for the indexes kept by order sets"
+    def setUp(self):
+        Configuration.set_globally('verbosity', 0)
+        self.board = Map(variants['standard'])
+        self.russia = self.board.powers[RUS]
+        self.moscow = self.board.spaces[MOS].unit
+        self.warsaw = self.board.coasts[(AMY, WAR, None)]
+        self.orders = OrderSet()
+    def test_latest_order(self):
+        hold = HoldOrder(self.moscow)
+        move = MoveOrder(self.moscow, self.warsaw)
+        self.orders.add(hold, RUS)
+        self.orders.add(move, RUS)
+        self.orders.add(HoldOrder(self.moscow), TUR)
+        self.failUnless(self.orders.get_order(self.moscow) is move)
+        self.orders.remove(move, RUS)
+        self.failUnless(self.orders.get_order(self.moscow) is hold)
+        self.orders.remove(hold, RUS)
+        self.failUnlessEqual(self.orders.get_order(self.moscow), None)
+    def test_foreign_order(self):
+        self.orders.add(HoldOrder(self.moscow), TUR)
+        self.failUnlessEqual(self.orders.get_order(self.moscow), None)
+        self.failUnlessEqual(len(self.orders.order_list(TUR)), 1)
+    def test_order_list_power(self):
+        ''' Orders may be listed by Power or by token.'''
+        self.orders.add(HoldOrder(self.moscow), self.russia)
+        self.orders.add(WaiveOrder(self.russia), RUS)
+        self.failUnlessEqual(len(self.orders.order_list(RUS)), 2)
+        self.failUnlessEqual(len(self.orders.order_list(self.russia)), 2)
+    def test_clear_nation(self):
+        self.orders.add(HoldOrder(self.moscow), RUS)
+        self.orders.add(HoldOrder(self.moscow), TUR)
+        self.orders.clear(RUS)
+        self.failUnlessEqual(len(self.orders), 1)
+        self.failUnlessEqual(self.orders.order_list(RUS), [])
+        self.failUnlessEqual(self.orders.get_order(self.moscow), None)
+        self.failIf(self.orders.missing_orders(Turn.move_phase, self.russia)
+                is None)
+    def test_clear_all(self):
+        self.orders.add(HoldOrder(self.moscow), RUS)
+        self.orders.clear()
+        self.failIf(self.orders)
+        self.failIf(self.orders.has_order(self.board.spaces[MOS]))
+        self.failUnlessEqual(self.orders.get_order(self.moscow), None)
+    def test_has_order(self):
+        moscow = self.board.spaces[MOS]
+        order = HoldOrder(self.moscow)
+        self.orders.add(order, RUS)
+        self.failUnless(self.orders.has_order(moscow))
+        self.failIf(self.orders.has_order(self.board.spaces[WAR]))
+        self.orders.remove(order, RUS)
+        self.failIf(self.orders.has_order(moscow))
+    def test_missing_count(self):
+        phase = Turn.move_phase
+        self.failUnlessEqual(self.orders.missing_count(phase, self.russia), 4)
+        self.orders.add(HoldOrder(self.moscow), RUS)
+        self.orders.add(HoldOrder(self.moscow), RUS)
+        self.failUnlessEqual(self.orders.missing_count(phase, self.russia), 3)
+        for unit in self.russia.units: self.orders.add(HoldOrder(unit), RUS)
+        self.failUnlessEqual(self.orders.missing_count(phase, self.russia), 0)
+        self.failUnlessEqual(self.orders.missing_orders(phase, self.russia),
+                None)
+    def test_missing_count_phases(self):
+        ''' Counts and MIS messages agree in every phase.'''
+        self.moscow.retreat([STP])
+        for phase, count in [(Turn.move_phase, 4), (Turn.retreat_phase, 1),
+                (Turn.build_phase, 0), (0, 0)]:
+            self.failUnlessEqual(self.orders.missing_count(phase, self.russia),
+                    count)
+            missing = self.orders.missing_orders(phase, self.russia)
+            self.failUnlessEqual(missing is None, not count)
+    def test_copy(self):
+        self.orders.add(HoldOrder(self.moscow), RUS)
+        self.orders.add(WaiveOrder(self.russia), RUS)
+        duplicate = copy(self.orders)
+        self.failUnlessEqual(len(duplicate), 2)
+        self.failUnless(duplicate.get_order(self.moscow))
+        self.failUnlessEqual(len(duplicate.order_list(RUS)), 2)
+
+if __name__ == '__main__': unittest.main()
@@ -14,7 +14,7 @@ from time       import sleep, time
 from parlance.config     import Configuration, GameOptions, VerboseObject
 from parlance.functions  import num2name, fails, failing
 from parlance.gameboard  import Turn
-from parlance.language   import Time
+from parlance.language   import PackedMessage, Time
 from parlance.main       import ThreadManager
 from parlance.network    import Service
 from parlance.player     import Clock, HoldBot
@@ -492,6 +492,23 @@ class Server_Press(ServerTestCase):
         ''' The server trims high-level tokens from TRY messages.'''
         self.assertPressSent(TRY(IOU, PRP, QRY))
         self.assertPressReceived(TRY(PRP))
+    def test_send_packed_press(self):
+        ''' Packed press is forwarded without being decoded.'''
+        press = PRP(PCE(self.sender.power, self.recipient.power))
+        msg = SND(self.recipient.power)(press)
+        self.recipient.queue = []
+        self.sender.send(PackedMessage(msg.pack()))
+        forwarded = FRM(self.sender.power)(self.recipient.power)(press)
+        received = [item for item in self.recipient.queue
+            if item == forwarded]
+        self.failUnless(received)
+        self.failUnless(isinstance(received[0], PackedMessage))
+    def test_send_packed_try(self):
+        ''' Packed TRY messages are still trimmed.'''
+        msg = SND(self.recipient.power)(TRY(IOU, PRP, QRY))
+        self.recipient.queue = []
+        self.sender.send(PackedMessage(msg.pack()))
+        self.assertPressReceived(TRY(PRP))
     def test_send_eliminated(self):
         ''' The server rejects press including eliminated powers.'''
         out = self.eliminated.power
@@ -914,6 +931,23 @@ class Server_Admin_Other(Server_Admin):
         self.failUnless(game.paused)
         self.assertEqual(self.master.get_time(), None)
     
+    def test_judge_stats_empty(self):
+        self.start_game()
+        self.assertAdminResponse(self.master, 'judge stats',
+                'No adjudication statistics are available.')
+    def test_judge_stats(self):
+        ''' Players can see how long the judge has been taking.'''
+        game = self.start_game()
+        stats = game.judge.stats
+        stats.phase(game.judge.turn())
+        stats.count('orders', 22)
+        stats.count_item('rules', 'circular')
+        lines = self.master.admin('Server: judge stats')
+        self.failUnless(lines[0].startswith('Last phase (%s): ' %
+                game.judge.turn()), lines)
+        self.assertContains('  Paradox rules: circular 1', lines)
+        self.failUnless(lines[-2].startswith('Whole game (1 phase): '), lines)
+    
     def test_end_cleanup(self):
         ''' Someone can connect to an abandoned game and end it.'''
         game = self.start_game()
@@ -1134,5 +1168,5 @@ class Server_Bugfix(ServerTestCase):
                 power=player.power, passcode=player.pcode)
         self.wait_for_actions()
         self.failIf(game.paused)
-    
+
 if __name__ == '__main__': unittest.main()
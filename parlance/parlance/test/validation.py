@@ -0,0 +1,218 @@
+r'''Test cases for Parlance message validation
+    Copyright (C) 2004-2008  Eric Wald
+    
+    This module compares the memoizing syntax checker with the original
+    backtracking one, and pins the error positions reported to clients.
+    
+    Parlance may be used, modified, and/or redistributed under the terms of
+    the Artistic License 2.0, as published by the Perl Foundation.
+'''#'''
+
+import unittest
+from random import Random
+
+from parlance.benchmark  import sample_messages
+from parlance.language   import Message, PackedMessage, Token, protocol
+from parlance.tokens     import *
+from parlance.validation import Validator, count_valid
+from parlance.xtended    import *
+
+class BacktrackingValidator(Validator):
+    ''' The original recursive syntax checker, kept as a reference.
+        Each alternative re-matches every subexpression it contains.
+    '''#'''
+    def validate_expression(self, msg, sub):
+        if not self.syntax.has_key(sub):
+            raise ValueError('unknown expression "%s"' % sub)
+        best = 0
+        valid = False
+        length = len(msg)
+        for level, sub_list in self.syntax[sub]:
+            if level <= self.syntax_level:
+                result, good = self.validate_option(msg, sub_list)
+                if good == valid and result > best:
+                    best = result
+                    if valid and best == length: break
+                elif good and not valid:
+                    best = result
+                    valid = good
+                    if valid and best == length: break
+        return best, valid
+    def validate_option(self, msg, item_list):
+        index = 0
+        option = None
+        in_sub = in_cat = repeat = False
+        length = len(msg)
+        for opt in item_list:
+            if isinstance(opt, str):
+                if   opt == 'any':      return length, True
+                elif opt == 'sub':      in_sub = True
+                elif opt == 'cat':      in_cat = True
+                elif opt == 'repeat':   repeat = True
+                elif opt == 'optional': option = (index, True)
+                else:
+                    if in_sub:
+                        result, good = self.count_subs(msg[index:], opt, repeat)
+                        index += result
+                        if not (result and good): break
+                    elif in_cat:
+                        if protocol.token_cats.has_key(opt):
+                            num = protocol.token_cats[opt]
+                            if isinstance(num, tuple):
+                                check = lambda x: num[0] <= x.category <= num[1]
+                            else: check = lambda x: x.category == num
+                        elif opt == 'Token':
+                            check = lambda x: x not in (BRA, KET, ERR)
+                        else: raise ValueError, 'unknown category "%s"' % opt
+                        result = count_valid(msg[index:], check, repeat)
+                        if result: index += result
+                        else: break
+                    else:
+                        result = self.validate_expression(msg[index:], opt)
+                        index += result[0]
+                        if not result[1]: break
+                        if repeat:
+                            while result[1]:
+                                result = self.validate_expression(msg[index:],
+                                        opt)
+                                index += result[0]
+                    in_sub = in_cat = repeat = False
+            elif isinstance(opt, Token):
+                result = count_valid(msg[index:], lambda x: x == opt, repeat)
+                repeat = False
+                if result: index += result
+                else: break
+            else: raise UserWarning, 'Invalid State'
+        else: return index, True
+        return option or (index, False)
+    def count_subs(self, msg, sub, repeat):
+        if not msg or msg[0] != BRA: return 0, False
+        level = 1
+        sublen = 0
+        while level > 0:
+            sublen += 1
+            old_sublen = sublen
+            sublen += msg[sublen:].index(KET)
+            level += msg[old_sublen:sublen].count(BRA) - 1
+        result = self.validate_expression(msg[1:sublen], sub)
+        index = result[0] + 2
+        if result[1]:
+            if repeat:
+                result, valid = self.count_subs(msg[index:], sub, repeat)
+                if result: return index + result, valid
+            return index, True
+        else: return index - 1, False
+
+class ValidatorTestCase(unittest.TestCase):
+    ''' Syntax checking of client and server messages'''
+    levels = (0, 40, 200, 8000)
+    
+    def reply(self, klass, level, msg, from_server=False):
+        validator = klass(level)
+        if from_server: result = validator.validate_server_message(msg)
+        else: result = validator.validate_client_message(msg)
+        return str(result)
+    def corpus(self):
+        ''' Valid messages of various kinds, including nested press.'''
+        peace = AND (PCE(ENG, FRA)) (DRW)
+        messages = [message for name, message in sample_messages()
+            if not name.startswith('standard.')]
+        messages += [
+            SND(ENG)(PRP(peace)),
+            SND(ENG)(PRP(ORR(NOT(DRW))(peace))),
+            SND(1)(ENG, FRA)(PRP(XDO([[ENG, AMY, LON], MTO, WAL]))),
+            SND(ENG)(FCT(NOT(NOT(DRW)))),
+            SND(ENG)(PRP(ORR(peace)(NOT(ORR(DRW)(PCE(ENG, FRA)))))),
+            SND(ENG)(TRY([PRP, PCE, ALY])),
+            SND(ENG)(TRY()),
+            HUH(ERR, YES(NME("HoldBot")("Parlance 1.0.166"))),
+            NME('name')('version'),
+            MAP('standard'),
+            SUB([ENG, AMY, LVP], MTO, YOR)([ENG, FLT, LON], SUP,
+                [ENG, AMY, LVP], MTO, YOR),
+            +GOF,
+        ]
+        return messages
+    def mutations(self, message, rng, count):
+        ''' Creates copies of the message with a few tokens
+            deleted, inserted, or replaced.
+        '''#'''
+        pool = sorted(set(message)) + [BRA, KET, ERR, ENG, DRW]
+        for dummy in range(count):
+            tokens = list(message)
+            for change in range(rng.randint(1, 3)):
+                index = rng.randint(0, len(tokens))
+                action = rng.randint(0, 2)
+                if action == 0 and index < len(tokens): del tokens[index]
+                elif action == 1: tokens.insert(index, rng.choice(pool))
+                elif index < len(tokens): tokens[index] = rng.choice(pool)
+            if tokens: yield Message(tokens)
+    
+    def test_valid_corpus(self):
+        ''' The corpus is valid at the highest syntax level.'''
+        for message in self.corpus():
+            if message[0] in (MDF, SCO, NOW, SMR, HUH, MAP): continue
+            self.failUnlessEqual(self.reply(Validator, 8000, message), 'False',
+                    str(message))
+    def test_matches_backtracking(self):
+        ''' Replies match the original checker, for valid and broken input.'''
+        rng = Random(25)
+        for original in self.corpus():
+            for message in [original] + list(self.mutations(original, rng, 8)):
+                for level in self.levels:
+                    for from_server in (False, True):
+                        self.failUnlessEqual(
+                            self.reply(Validator, level, message, from_server),
+                            self.reply(BacktrackingValidator, level, message,
+                                from_server),
+                            '%s at level %d' % (message, level))
+    def test_packed_matches(self):
+        ''' Packed messages get the same replies as decoded ones.'''
+        rng = Random(22)
+        for original in self.corpus():
+            for message in [original] + list(self.mutations(original, rng, 4)):
+                packed = PackedMessage(message.pack())
+                self.failUnlessEqual(self.reply(Validator, 200, packed),
+                        self.reply(Validator, 200, message), str(message))
+    
+    def assertReply(self, message, reply, level=0, from_server=False):
+        self.failUnlessEqual(self.reply(Validator, level, message,
+            from_server), reply)
+    def test_error_unknown_command(self):
+        self.assertReply(WHT(YES), 'HUH ( ERR WHT ( YES ) )')
+    def test_error_wrong_argument(self):
+        self.assertReply(NME('name')(-3), 'HUH ( NME ( "name" ) ( ERR -3 ) )')
+    def test_error_missing_argument(self):
+        self.assertReply(NME('name'), 'HUH ( NME ( "name" ) ERR )')
+    def test_error_server_only(self):
+        self.assertReply(MAP('standard'), 'HUH ( MAP ERR ( "standard" ) )')
+        self.assertReply(MAP('standard'), 'False', from_server=True)
+    def test_error_press_level(self):
+        ''' Press above the syntax level is marked where it starts.'''
+        msg = SND(ENG)(PRP(ORR(NOT(DRW))(AND(PCE(ENG, FRA))(DRW))))
+        self.assertReply(msg, 'HUH ( SND ( ENG ) ( PRP ( ORR ( NOT ( DRW ) ) '
+            '( ERR AND ( PCE ( ENG FRA ) ) ( DRW ) ) ) ) )', 40)
+        self.assertReply(msg, 'False', 100)
+    def test_error_nested_press(self):
+        ''' Errors deep within nested press are marked in place.'''
+        msg = SND(ENG)(PRP(AND(DRW)(YES)))
+        self.assertReply(msg,
+            'HUH ( SND ( ENG ) ( PRP ( AND ( DRW ) ( ERR YES ) ) ) )', 200)
+        msg = SND(ENG)(PRP(ORR(DRW)(PCE(ENG, 3))))
+        self.assertReply(msg,
+            'HUH ( SND ( ENG ) ( PRP ( ORR ( DRW ) ( PCE ( ENG ERR 3 ) ) ) ) )',
+            200)
+    def test_error_order(self):
+        msg = SUB([ENG, AMY, LVP], MTO)
+        self.assertReply(msg, 'HUH ( SUB ( ( ENG AMY LVP ) MTO ERR ) )')
+    def test_error_empty_try(self):
+        ''' An empty TRY is valid, but other empty press is not.'''
+        self.assertReply(SND(ENG)(TRY()), 'False', 10)
+        self.assertReply(SND(ENG)(PRP()), 'PRN ( SND ( ENG ) ( PRP ( ) ) )',
+            10)
+    def test_error_unbalanced(self):
+        ''' Unbalanced parentheses get PRN instead of HUH.'''
+        msg = protocol.default_rep.translate('IAM(NOT')
+        self.assertReply(msg, 'PRN ( IAM ( NOT )')
+
+if __name__ == '__main__': unittest.main()
@@ -12,7 +12,7 @@ r'''Parlance message validation
 import re
 
 from config   import VerboseObject, parse_file
-from language import Token, protocol
+from language import Message, PackedMessage, Token, protocol
 from tokens   import BRA, ERR, HUH, KET, PRN
 
 __all__ = ['Validator']
@@ -153,11 +153,16 @@ class Validator(VerboseObject):
         return levels
     
     def trim(self, press):
-        ''' Trims high-level tokens from TRY messages.'''
+        ''' Trims high-level tokens from TRY messages.
+            Returns the press, decoded into a Message if it was packed
+            and has tokens to remove.
+        '''#'''
         for token, level in self.trimmed.items():
-            if level > self.syntax_level:
+            if level > self.syntax_level and token in press:
+                press = press.tokenize()
                 while token in press:
                     press.remove(token)
+        return press
     
     def validate_server_message(self, msg):
         return self.validate(msg, 'server_message')
@@ -229,7 +234,7 @@ class Validator(VerboseObject):
                     if submsg.count(BRA) != submsg.count(KET):
                         if msg[0] == PRN: return False
                         else: return PRN(msg)
-                result = HUH(msg)
+                result = HUH(Message(msg))
                 result.insert(index + 2, ERR)
                 return result
     
@@ -268,30 +273,9 @@ class Validator(VerboseObject):
             >>> validate_expression(m, 'message', 0)
             (71, True)
         '''#'''
-        if not isinstance(msg, list):
+        if not isinstance(msg, (list, PackedMessage)):
             raise ValueError('message must be a list')
-        if not self.syntax.has_key(sub):
-            raise ValueError('unknown expression "%s"' % sub)
-        best = 0
-        valid = False
-        length = len(msg)
-        for level,sub_list in self.syntax[sub]:
-            if level <= self.syntax_level:
-                self.spaces += 1
-                self.log_debug(16, '%sChecking "%s" against %s',
-                        ' ' * self.spaces, msg, sub_list)
-                result, good = self.validate_option(msg, sub_list)
-                self.log_debug(16, '%sResult: %s, %s',
-                        ' ' * self.spaces, result, good)
-                self.spaces -= 1
-                if good == valid and result > best:
-                    best = result
-                    if valid and best == length: break
-                elif good and not valid:
-                    best = result
-                    valid = good
-                    if valid and best == length: break
-        return best, valid
+        return MessageParser(self, msg).expression(sub, 0, len(msg))
     
     def validate_option(self, msg, item_list):
         ''' Tries to match the message with the given expression list.
@@ -311,54 +295,8 @@ class Validator(VerboseObject):
             ...     ['repeat', 'sub', 'offer', 'sco_power'], 200)
             (4, True)
         '''#'''
-        index = 0
-        option = None
-        in_sub = in_cat = repeat = False
-        length = len(msg)
-        for opt in item_list:
-            if isinstance(opt, str):
-                if   opt == 'any':      return length, True
-                elif opt == 'sub':      in_sub = True
-                elif opt == 'cat':      in_cat = True
-                elif opt == 'repeat':   repeat = True
-                elif opt == 'optional': option = (index, True)
-                else:
-                    if in_sub:
-                        # Wrapped subexpression
-                        result, good = self.count_subs(msg[index:], opt, repeat)
-                        index += result
-                        if not (result and good): break
-                    elif in_cat:
-                        # Category name
-                        if protocol.token_cats.has_key(opt):
-                            num = protocol.token_cats[opt]
-                            if isinstance(num, tuple):
-                                check = lambda x: num[0] <= x.category <= num[1]
-                            else: check = lambda x: x.category == num
-                        elif opt == 'Token':
-                            check = lambda x: x not in (BRA, KET, ERR)
-                        else: raise ValueError, 'unknown category "%s"' % opt
-                        result = count_valid(msg[index:], check, repeat)
-                        if result: index += result
-                        else: break
-                    else:
-                        # Unwrapped subexpression(s)
-                        result = self.validate_expression(msg[index:], opt)
-                        index += result[0]
-                        if not result[1]: break
-                        if repeat:
-                            while result[1]:
-                                result = self.validate_expression(msg[index:], opt)
-                                index += result[0]
-                    in_sub = in_cat = repeat = False
-            elif isinstance(opt, Token):
-                result = count_valid(msg[index:], lambda x: x == opt, repeat)
-                repeat = False
-                if result: index += result
-                else: break
-            else: raise UserWarning, 'Invalid State'
-        else: return index, True
-        return option or (index, False)
+        return MessageParser(self, msg).option(self.compile(item_list),
+                0, len(msg))
     
     def count_subs(self, msg, sub, repeat):
         ''' Tries to match the message with the given wrapped subexpression.
@@ -379,26 +317,204 @@ class Validator(VerboseObject):
             >>> count_subs(msg, 'offer', True, 120)
             (12, True)
         '''#'''
+        return MessageParser(self, msg).subs(sub, 0, len(msg), repeat)
+    
+    # Compiled forms of the syntax rules
+    ANY, OPTIONAL, SUB, CHECK, EXPRESSION = range(5)
+    compiled = {}
+    @classmethod
+    def compile(klass, item_list):
+        ''' Translates a rule from the syntax dictionary into a tuple of
+            (kind, argument, repeat) steps, with category and token
+            comparisons turned into functions.  Results are cached.
+            
+            >>> Validator.compile(['sub', 'offer', 'optional', 'number'])
+            ((2, 'offer', False), (1, None, False), (4, 'number', False))
+        '''#'''
+        key = tuple(item_list)
+        steps = klass.compiled.get(key)
+        if steps is None:
+            steps = []
+            in_sub = in_cat = repeat = False
+            for opt in item_list:
+                if isinstance(opt, str):
+                    if   opt == 'any':      steps.append((klass.ANY, None, False))
+                    elif opt == 'sub':      in_sub = True
+                    elif opt == 'cat':      in_cat = True
+                    elif opt == 'repeat':   repeat = True
+                    elif opt == 'optional':
+                        steps.append((klass.OPTIONAL, None, False))
+                    else:
+                        if in_sub: steps.append((klass.SUB, opt, repeat))
+                        elif in_cat:
+                            steps.append((klass.CHECK, category_check(opt),
+                                repeat))
+                        else: steps.append((klass.EXPRESSION, opt, repeat))
+                        in_sub = in_cat = repeat = False
+                elif isinstance(opt, Token):
+                    steps.append((klass.CHECK, lambda x, opt=opt: x == opt,
+                        repeat))
+                    repeat = False
+                else: raise UserWarning, 'Invalid State'
+            steps = klass.compiled[key] = tuple(steps)
+        return steps
+
+class MessageParser(object):
+    ''' Matches a single message against the syntax rules of a Validator.
+        Subexpressions are identified by their start and stop positions
+        in the message, so the result of matching each expression rule
+        against each subexpression is computed only once, no matter how
+        many alternatives try it.  This keeps deeply nested press from
+        taking exponential time.
+        
+        Tokens are compared as numbers, so a PackedMessage is checked
+        without being decoded.
+        
+        >>> Eng = Token('ENG', 0x4101)
+        >>> Fra = Token('FRA', 0x4102)
+        >>> m = SND (Eng) (PRP (ORR (NOT (DRW)) (AND (PCE(Eng, Fra)) (DRW))))
+        >>> parser = MessageParser(Validator(40), m)
+        >>> parser.expression('client_command', 0, len(m))
+        (15, False)
+        >>> parser.expression('press_message', 5, len(m) - 1)
+        (10, False)
+    '''#'''
+    def __init__(self, validator, msg):
+        self.validator = validator
+        self.msg = msg
+        self.numbers = numbers = getattr(msg, 'numbers', msg)
+        self.memo = {}
+        
+        # Matching parentheses, by position
+        self.kets = kets = {}
+        stack = []
+        for index, token in enumerate(numbers):
+            if token == BRA: stack.append(index)
+            elif token == KET and stack: kets[stack.pop()] = index
+    
+    def expression(self, sub, start, stop):
+        ''' Tries to match msg[start:stop] with the given expression level.
+            Returns the number of tokens in the best match,
+            and whether the full match is valid.
+        '''#'''
+        key = (sub, start, stop)
+        result = self.memo.get(key)
+        if result is not None: return result
+        
+        validator = self.validator
+        if not validator.syntax.has_key(sub):
+            raise ValueError('unknown expression "%s"' % sub)
+        debugging = validator.debugging(16)
+        best = 0
+        valid = False
+        length = stop - start
+        for level, sub_list in validator.syntax[sub]:
+            if level <= validator.syntax_level:
+                if debugging:
+                    validator.spaces += 1
+                    validator.log_debug(16, '%sChecking "%s" against %s',
+                            ' ' * validator.spaces, self.msg[start:stop],
+                            sub_list)
+                result, good = self.option(validator.compile(sub_list),
+                        start, stop)
+                if debugging:
+                    validator.log_debug(16, '%sResult: %s, %s',
+                            ' ' * validator.spaces, result, good)
+                    validator.spaces -= 1
+                if good == valid and result > best:
+                    best = result
+                    if valid and best == length: break
+                elif good and not valid:
+                    best = result
+                    valid = good
+                    if valid and best == length: break
+        self.memo[key] = result = (best, valid)
+        return result
+    
+    def option(self, steps, start, stop):
+        ''' Tries to match msg[start:stop] with a compiled expression list.
+            Returns the number of tokens in the best match,
+            and whether the full match is valid.
+        '''#'''
+        index = start
+        option = None
+        for kind, arg, repeat in steps:
+            if kind == Validator.CHECK:
+                result = self.count(arg, index, stop, repeat)
+                if result: index += result
+                else: break
+            elif kind == Validator.EXPRESSION:
+                # Unwrapped subexpression(s)
+                result, good = self.expression(arg, index, stop)
+                index += result
+                if not good: break
+                if repeat:
+                    while good:
+                        result, good = self.expression(arg, index, stop)
+                        index += result
+            elif kind == Validator.SUB:
+                # Wrapped subexpression
+                result, good = self.subs(arg, index, stop, repeat)
+                index += result
+                if not (result and good): break
+            elif kind == Validator.OPTIONAL: option = (index - start, True)
+            else: return stop - start, True
+        else: return index - start, True
+        return option or (index - start, False)
+    
+    def subs(self, sub, start, stop, repeat):
+        ''' Tries to match msg[start:stop] with the given wrapped
+            subexpression, as described for Validator.count_subs().
+        '''#'''
         # Check for the start of a subexpression
-        if not msg or msg[0] != BRA: return 0, False
+        if start >= stop or self.numbers[start] != BRA: return 0, False
         
         # Find the matching KET
-        level = 1
-        sublen = 0
-        while level > 0:
-            sublen += 1
-            old_sublen = sublen
-            sublen += msg[sublen:].index(KET)
-            level += msg[old_sublen:sublen].count(BRA) - 1
+        ket = self.kets.get(start)
+        if ket is None or ket >= stop:
+            raise ValueError('unbalanced parentheses in message')
         
-        result = self.validate_expression(msg[1:sublen], sub)
-        index = result[0] + 2
-        if result[1]:
+        result, good = self.expression(sub, start + 1, ket)
+        index = result + 2
+        if good:
             if repeat:
-                result, valid = self.count_subs(msg[index:], sub, repeat)
+                result, valid = self.subs(sub, start + index, stop, repeat)
                 if result: return index + result, valid
             return index, True
         else: return index - 1, False
+    
+    def count(self, check, start, stop, repeat):
+        ''' Counts the tokens of msg[start:stop] accepted by the check,
+            as count_valid() does.
+        '''#'''
+        numbers = self.numbers
+        if repeat:
+            index = start
+            while index < stop and check(numbers[index]): index += 1
+            return index - start
+        elif start < stop and check(numbers[start]): return 1
+        else: return 0
+
+def category_check(name):
+    ''' Creates a function to determine whether a token is in a category.
+        Works on token numbers as well as Tokens.
+        
+        >>> category_check('Powers')(ENG)
+        True
+        >>> category_check('Powers')(int(ENG))
+        True
+        >>> category_check('Token')(KET)
+        False
+    '''#'''
+    if protocol.token_cats.has_key(name):
+        num = protocol.token_cats[name]
+        if isinstance(num, tuple):
+            low, high = num
+            return lambda x: low <= x >> 8 <= high
+        else: return lambda x: x >> 8 == num
+    elif name == 'Token':
+        return lambda x: x not in (BRA, KET, ERR)
+    else: raise ValueError, 'unknown category "%s"' % name
 
 def count_valid(msg, func, repeat):
     ''' Counts the number of tokens for which the given function returns True.
@@ -2,22 +2,66 @@ r'''Parlance standard map environment
     Copyright (C) 2004-2008  Eric Wald
     
     This module includes the standard map, default map tokens, and starting
-    position messages. It can take a few seconds to load, and might not work
-    properly, but offers a convenient way to import all those names.
+    position messages, as a convenient way to import all those names.
+    Each variant, map, and starting message is built the first time it is
+    used, so importing a few tokens or a single variant is quick;
+    "from parlance.xtended import *" still builds everything.
     
     Parlance may be used, modified, and/or redistributed under the terms of
     the Artistic License 2.0, as published by the Perl Foundation.
 '''
 from sys       import modules
+from types     import ModuleType
+
+try: from threading import RLock
+except ImportError: from dummy_threading import RLock
 
 from gameboard import Map, Variant
 from language  import protocol
 
+class LazyModule(ModuleType):
+    ''' A module whose attributes may be built on first access.
+        Builders are called with the module, and their results are kept
+        as ordinary attributes, so each successful one is called only once.
+        A builder that raises is kept, to be tried again on the next access.
+    '''#'''
+    def __init__(self, original, builders):
+        ModuleType.__init__(self, original.__name__, original.__doc__)
+        # Python 2 clears the globals of a module that is collected.
+        self._original = original
+        self._builders = builders
+        # Reentrant, because builders may use other lazy attributes.
+        self._lock = RLock()
+        for name, value in vars(original).iteritems():
+            if name not in ('__name__', '__doc__'):
+                setattr(self, name, value)
+    def __getattr__(self, name):
+        # Only called when the attribute is not yet defined.
+        self._lock.acquire()
+        try:
+            # Another thread may have built it while this one waited.
+            if name in vars(self): return vars(self)[name]
+            builder = self._builders.get(name)
+            if builder is None: raise AttributeError(name)
+            value = builder(self)
+            setattr(self, name, value)
+            del self._builders[name]
+        finally: self._lock.release()
+        return value
+
+def variant_builders(name):
+    ''' Creates builders for the variant, map, and starting messages.'''
+    return {
+        name: lambda module: Variant(name,
+                filename="parlance://data/%s.cfg" % name),
+        name + '_map': lambda module: Map(getattr(module, name)),
+        name + '_sco': lambda module: getattr(module, name).sco(),
+        name + '_now': lambda module: getattr(module, name).now(),
+    }
 
-mini = Variant("mini", filename="parlance://data/mini.cfg")
-small = Variant("small", filename="parlance://data/small.cfg")
-standard = Variant("standard", filename="parlance://data/standard.cfg")
-three = Variant("three", filename="parlance://data/three.cfg")
+builders = {}
+for variant_name in ('mini', 'small', 'standard', 'three'):
+    builders.update(variant_builders(variant_name))
 
 __all__ = ['mini', 'mini_map', 'mini_sco', 'mini_now',
         'small', 'small_map', 'small_sco', 'small_now',
@@ -25,26 +69,6 @@ __all__ = ['mini', 'mini_map', 'mini_sco', 'mini_now',
         'three', 'three_map', 'three_sco', 'three_now',
 		'default_rep', 'base_rep']
 
-# Mini map and its various attendants
-mini_map = Map(mini)
-mini_sco = mini.sco()
-mini_now = mini.now()
-
-# Small map and its various attendants
-small_map = Map(small)
-small_sco = small.sco()
-small_now = small.now()
-
-# Standard map and its various attendants
-standard_map = Map(standard)
-standard_sco = standard.sco()
-standard_now = standard.now()
-
-# Three map and its various attendants
-three_map = Map(three)
-three_sco = three.sco()
-three_now = three.now()
-
 default_rep = protocol.default_rep
 base_rep = protocol.base_rep
 
@@ -54,3 +78,4 @@ for name, token in default_rep.items():
     setattr(module, name, token)
 __all__.extend(default_rep.keys())
 
+modules[__name__] = LazyModule(module, builders)
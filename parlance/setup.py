@@ -34,6 +34,7 @@ setup(
             "parlance-server = parlance.server:run",
             "parlance-holdbot = parlance.player:run",
             "parlance-chatty = parlance.chatty:run",
+            "parlance-benchmark = parlance.benchmark:run",
             "parlance-config = parlance.config:run",
             "parlance-raw-client = parlance.main:run",
             "parlance-raw-server = parlance.network:run",